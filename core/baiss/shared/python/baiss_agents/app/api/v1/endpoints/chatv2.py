@@ -12,20 +12,24 @@ from dotenv import load_dotenv
 import logging
 import json
 import httpx
+import asyncio
 from pydantic import BaseModel
-from baiss_sdk.parsers.json_extractor import JsonExtractor
-from baiss_sdk.parsers.python_extractor import PythonExtractor
+from baiss_sdk.parsers.stream_parser import StreamParser
 from starlette.websockets import WebSocket, WebSocketDisconnect
 from baiss_agents.app.api.v1.endpoints.files import start_tree_structure_operation_impl
+from baiss_sdk.files.scheduler import INTERACTIVE_PRIORITY
+from baiss_agents.app.core.config import load_system_prompts
+from baiss_agents.app.core.llama_client import llama_client
+from baiss_agents.app.core.llama_sessions import llama_sessions
 #from baiss_agents.app.core.config import ai_client
-from baiss_sdk.db import DbProxyClient
-from baiss_sdk import get_baiss_project_path
 from baiss_sdk.files.embeddings import Embeddings
-from baiss_sdk.search.pipeline import SearchPipeline
+from baiss_sdk.search.service import search_service
+from baiss_sdk.search.cache import search_cache
+from baiss_sdk.db.filters import SearchFilters
 import time
 import datetime
-from pathlib import Path
 from baiss_sdk.sandbox.python_sandbox import PythonSandbox
+from baiss_sdk.sandbox.pool import sandbox_pool
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
@@ -34,7 +38,16 @@ load_dotenv()
 
 
 
-class SimilaritySearchRequest(BaseModel):
+class SearchFiltersRequest(BaseModel):
+    # Metadata filters, applied before the chunks are scored (see SearchFilters)
+    path_prefixes: Optional[List[str]] = None
+    document_ids: Optional[List[int]] = None
+    content_types: Optional[List[str]] = None
+    modified_after: Optional[datetime.datetime] = None
+    modified_before: Optional[datetime.datetime] = None
+
+
+class SimilaritySearchRequest(SearchFiltersRequest):
     query: str
     search_type: str = "cosine"  # "cosine", "bm25", or "hybrid"
     top_k: int = 8
@@ -42,10 +55,20 @@ class SimilaritySearchRequest(BaseModel):
     score_threshold: float = 0.0
     cosine_weight: float = 0.7
     bm25_weight: float = 0.3
+    fusion: str = "zscore"  # hybrid score fusion, "zscore" or "rrf"
     url_embedding: str
     model_path: Optional[str] = None
 
 
+class BatchSimilaritySearchRequest(SearchFiltersRequest):
+    queries: List[str]
+    search_type: str = "hybrid"  # "cosine", "bm25", or "hybrid"
+    top_k: int = 8
+    score_threshold: float = 0.0
+    fusion: str = "zscore"  # hybrid score fusion, "zscore" or "rrf"
+    url_embedding: Optional[str] = None
+
+
 
 def now() -> str:
     return datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
@@ -64,39 +87,36 @@ async def api_v1_llmbox_similarity(request: SimilaritySearchRequest):
         cosine_weight = request.cosine_weight
         bm25_weight = request.bm25_weight
         url_embedding = request.url_embedding
+        filters = SearchFilters.from_dict(request.model_dump())
         if not query:
             raise ValueError("Query must be provided.")
 
 
-        # Initialize database client
-        db_client = DbProxyClient()
-        db_client.connect()
-        
-        # Setup extensions
-        db_client.setup_extensions()
-        
-        # Only create HNSW index for cosine/hybrid searches 
-        #if search_type in ["cosine", "hybrid"]:
-        #    db_client.create_hnsw_index()
-        
-        # Always create FTS index
-        db_client.create_fts_index()
-        logging.info(f"Database client connected and indexes created.")
+        # Searches run on the warm connection of the search service (see main.py), repeated
+        # searches are answered by the search cache until the index changes
         results = []
 
         if search_type == "cosine":
-            # Generate query embedding
-            logging.info(f"Generated query embedding for cosine search.")
-            query_embedding = await Embeddings(url = url_embedding).embed(query)
-            if query_embedding is None:
-                raise ValueError("Failed to generate embedding for the query.")
-            if not isinstance(query_embedding, list) or len(query_embedding) == 0:
-                raise ValueError(f"Invalid embedding returned: {type(query_embedding)}, length: {len(query_embedding) if isinstance(query_embedding, list) else 'N/A'}")
-            # Perform cosine similarity search
-            results = db_client.similarity_search_cosine(
-                query_embedding=query_embedding,
-                top_k=top_k,
-                score_threshold=score_threshold
+            async def cosine_search():
+                # Generate query embedding
+                logging.info(f"Generated query embedding for cosine search.")
+                query_embedding = await search_cache.embed(Embeddings(url = url_embedding), query)
+                if query_embedding is None:
+                    raise ValueError("Failed to generate embedding for the query.")
+                if not isinstance(query_embedding, list) or len(query_embedding) == 0:
+                    raise ValueError(f"Invalid embedding returned: {type(query_embedding)}, length: {len(query_embedding) if isinstance(query_embedding, list) else 'N/A'}")
+                # Perform cosine similarity search
+                return await search_service.run(
+                    lambda db_client: db_client.similarity_search_cosine(
+                        query_embedding=query_embedding,
+                        top_k=top_k,
+                        score_threshold=score_threshold,
+                        filters=filters
+                    )
+                )
+            results = await search_cache.search(
+                cosine_search, query, search_type, top_k,
+                score_threshold=score_threshold, url_embedding=url_embedding, filters=filters
             )
             
             # Format results
@@ -115,10 +135,16 @@ async def api_v1_llmbox_similarity(request: SimilaritySearchRequest):
         elif search_type == "bm25":
             # Perform BM25 search (no model needed)
             logging.info(f"Performing BM25 search for query: {query}")
-            results = db_client.similarity_search_bm25(
-                query=query,
-                top_k=top_k,
-                score_threshold=score_threshold
+            results = await search_cache.search(
+                lambda: search_service.run(
+                    lambda db_client: db_client.similarity_search_bm25(
+                        query=query,
+                        top_k=top_k,
+                        score_threshold=score_threshold,
+                        filters=filters
+                    )
+                ),
+                query, search_type, top_k, score_threshold=score_threshold, filters=filters
             )
             
             
@@ -136,17 +162,23 @@ async def api_v1_llmbox_similarity(request: SimilaritySearchRequest):
             ]
 
         elif search_type == "hybrid":
-            # Generate query embedding for hybrid search
-            
-            query_embedding = await Embeddings(url = url_embedding).embed(query)
-
-            search_pipeline = SearchPipeline(db_client)
-            
-            # Perform hybrid search
-            results = search_pipeline.search(
-                query_text=query,
-                query_embedding=query_embedding,
-                final_top_k=top_k
+            async def hybrid_search():
+                # Generate query embedding for hybrid search
+                query_embedding = await search_cache.embed(Embeddings(url = url_embedding), query)
+
+                # Perform hybrid search
+                return await search_service.run(
+                    lambda db_client: search_service.pipeline(db_client).search(
+                        query_text=query,
+                        query_embedding=query_embedding,
+                        final_top_k=top_k,
+                        fusion=request.fusion,
+                        filters=filters
+                    )
+                )
+            results = await search_cache.search(
+                hybrid_search, query, search_type, top_k,
+                fusion=request.fusion, url_embedding=url_embedding, filters=filters
             )
             logger.info(f"Hybrid search returned {results} results.")
             # exit(0)
@@ -169,8 +201,6 @@ async def api_v1_llmbox_similarity(request: SimilaritySearchRequest):
         else:
             raise ValueError(f"Invalid search_type: {search_type}. Must be 'cosine', 'bm25', or 'hybrid'.")
 
-        db_client.disconnect()
-
         return JSONResponse(
             content={
                 "status": 200,
@@ -185,7 +215,8 @@ async def api_v1_llmbox_similarity(request: SimilaritySearchRequest):
                         "top_k": top_k,
                         "score_threshold": score_threshold,
                         "cosine_weight": cosine_weight if search_type == "hybrid" else None,
-                        "bm25_weight": bm25_weight if search_type == "hybrid" else None
+                        "bm25_weight": bm25_weight if search_type == "hybrid" else None,
+                        "fusion": request.fusion if search_type == "hybrid" else None
                     }
                 },
                 "timestamp": now()
@@ -208,6 +239,54 @@ async def api_v1_llmbox_similarity(request: SimilaritySearchRequest):
         )
 
 
+@router.get("/search_cache/stats")
+async def api_v1_search_cache_stats():
+    """Hit rates of the query embedding and search result caches."""
+    return JSONResponse(
+        content={
+            "status": 200,
+            "success": True,
+            "message": "Search cache statistics.",
+            "error": None,
+            "data": search_cache.stats,
+            "timestamp": now()
+        },
+        status_code=200
+    )
+
+
+@router.get("/sandbox_pool/stats")
+async def api_v1_sandbox_pool_stats():
+    """Executions, recycled workers and mean queue wait versus execution time of the sandbox pool."""
+    return JSONResponse(
+        content={
+            "status": 200,
+            "success": True,
+            "message": "Sandbox pool statistics.",
+            "error": None,
+            "data": sandbox_pool.stats,
+            "timestamp": now()
+        },
+        status_code=200
+    )
+
+
+@router.get("/llama_sessions/stats")
+async def api_v1_llama_sessions_stats():
+    """Prompt tokens prefilled versus taken from the llama.cpp KV cache, and time to first token."""
+    return JSONResponse(
+        content={
+            "status": 200,
+            "success": True,
+            "message": "Llama session statistics.",
+            "error": None,
+            "data": llama_sessions.stats,
+            "timestamp": now()
+        },
+        status_code=200
+    )
+
+
 def convert_stream_chunks(chunk: dict, cache: dict = None) -> dict:
         """
         Converts a chunk from the Llama model to the standard response format.
@@ -288,6 +367,145 @@ def convert_paths_response(paths: List[Dict[str, str]]):
     result["response"]["choices"].append({"paths": result_paths, "messages": []})
     return result
 
+def format_search_result(result) -> Dict[str, Any]:
+    """Response item of a search result, a (content, path, score, id, metadata, ...) tuple or a reranked result."""
+    if isinstance(result, dict):
+        content, path, score, id, metadata = result["chunk_content"], result["path"], result["score"], result["id"], result["metadata"]
+    else:
+        content, path, score, id, metadata = result[:5]
+    return {
+        "chunk_content": content,
+        "path": path if not path.startswith("file://") else path[7:],
+        "score": score,
+        "id": id,
+        "metadata": metadata,
+    }
+
+async def batch_similarity_search(request: BatchSimilaritySearchRequest) -> List[List[Dict[str, Any]]]:
+    """
+    Runs the queries of a batch: the embeddings of every query are requested at once, the
+    retrievals run concurrently on the search service and hybrid candidates are reranked by
+    one batch. Results of a query are cached like those of /similarity_search.
+    Returns:
+        List[List[Dict[str, Any]]]: The formatted results of each query, in query order.
+    """
+    queries = request.queries
+    search_type = request.search_type
+    top_k = request.top_k
+    score_threshold = request.score_threshold
+    url_embedding = request.url_embedding
+    filters = SearchFilters.from_dict(request.model_dump())
+    if not queries or not all(queries):
+        raise ValueError("Queries must be provided.")
+
+    async def embed(batch: List[str]) -> List[list]:
+        if not url_embedding:
+            raise ValueError(f"Embedding URL must be provided for {search_type} search.")
+        embeddings = await search_cache.embed_many(Embeddings(url = url_embedding), batch)
+        failed = [query for query, embedding in zip(batch, embeddings) if not embedding]
+        if failed:
+            raise ValueError(f"Failed to generate embeddings for the queries: {failed}")
+        return embeddings
+
+    if search_type == "hybrid":
+        async def compute(batch: List[str]) -> List[Any]:
+            return await search_service.search_many(batch, await embed(batch), top_k, request.fusion, filters)
+        params = dict(fusion=request.fusion, url_embedding=url_embedding, filters=filters)
+    elif search_type == "cosine":
+        async def compute(batch: List[str]) -> List[Any]:
+            return await asyncio.gather(*(
+                search_service.run(lambda db_client, embedding = embedding: db_client.similarity_search_cosine(embedding, top_k, score_threshold, filters))
+                for embedding in await embed(batch)
+            ))
+        params = dict(score_threshold=score_threshold, url_embedding=url_embedding, filters=filters)
+    elif search_type == "bm25":
+        async def compute(batch: List[str]) -> List[Any]:
+            return await asyncio.gather(*(
+                search_service.run(lambda db_client, query = query: db_client.similarity_search_bm25(query, top_k, score_threshold, filters))
+                for query in batch
+            ))
+        params = dict(score_threshold=score_threshold, filters=filters)
+    else:
+        raise ValueError(f"Invalid search_type: {search_type}. Must be 'cosine', 'bm25', or 'hybrid'.")
+
+    results = await search_cache.search_many(compute, queries, search_type, top_k, **params)
+    return [[format_search_result(result) for result in query_results] for query_results in results]
+
+@router.post("/similarity_search/batch")
+async def api_v1_llmbox_similarity_batch(request: BatchSimilaritySearchRequest):
+    """
+    Similarity search of several queries in one request (see batch_similarity_search).
+    Results are returned per query, in the order of the queries.
+    """
+    try:
+        results = await batch_similarity_search(request)
+        return JSONResponse(
+            content={
+                "status": 200,
+                "success": True,
+                "message": f"Similarity search of {len(results)} queries completed using {request.search_type} method.",
+                "error": None,
+                "data": {
+                    "results": [
+                        {"query": query, "results": query_results, "total_results": len(query_results)}
+                        for query, query_results in zip(request.queries, results)
+                    ],
+                    "search_type": request.search_type,
+                    "parameters": {
+                        "top_k": request.top_k,
+                        "score_threshold": request.score_threshold,
+                        "fusion": request.fusion if request.search_type == "hybrid" else None
+                    }
+                },
+                "timestamp": now()
+            },
+            status_code=200
+        )
+    except Exception as e:
+        logger.error(f"Batch similarity search error: {e}")
+        return JSONResponse(
+            content={
+                "status": 500,
+                "success": False,
+                "message": str(e),
+                "error": str(e),
+                "data": None,
+                "timestamp": now()
+            },
+            status_code=500
+        )
+
+async def run_sandbox_code(function: Dict[str, Any], url_embedding: str, paths: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Runs a function of the reply, its main, in the sandbox (3 attempts).
+    Returns:
+        Optional[Dict[str, Any]]: The sandbox result, None if the sandbox could not run the code.
+    """
+    for attempts in range(3):
+        try:
+            sandbox = PythonSandbox()
+            sandbox.add_tool_reference(
+                name="searchlocaldocuments",
+                module_path="baiss_sdk.tools",
+                class_name="allTools",
+                method_name="searchlocaldocuments",
+                init_kwargs={"url_embedding": url_embedding, "paths": paths}
+            )
+            code_to_execute = str(function["body"]).rstrip() + "\n\nasyncio.run(main())\n"
+            logger.info(f"extracted code {code_to_execute}")
+            # Awaited, so other sessions keep streaming while the code runs
+            return await sandbox.execute_async(code_to_execute, timeout=30)
+        except Exception as e:
+            logging.error(f"Sandbox execution error on attempt {attempts + 1}: {e}", exc_info=True)
+            await asyncio.sleep(1)
+    return None
+
+async def run_search_tool(query: str, url_embedding: str, paths: List[str]) -> List[Dict[str, Any]]:
+    """Runs a search tool call of the reply; searches of a chat with attached files only look into these files."""
+    logger.info(f"Performing additional search for query: {query}")
+    search_params = BatchSimilaritySearchRequest(queries=[query], search_type="hybrid", url_embedding=url_embedding, top_k=5, path_prefixes=paths or None)
+    return (await batch_similarity_search(search_params))[0]
+
 @router.websocket("/pre_chat")
 async def get_pre_chat(websocket: WebSocket):
     await websocket.accept()
@@ -314,10 +532,7 @@ async def get_pre_chat(websocket: WebSocket):
         if len(paths) > 0:
             # check if paths are in db
             logging.info(f"Received paths: {paths}")
-            db_client = DbProxyClient()
-            db_client.connect()
-
-            existing_paths = db_client.check_if_paths_exists(paths)
+            existing_paths = await search_service.run(lambda db_client: db_client.check_if_paths_exists(paths))
             logging.info(f"Existing paths in DB: {existing_paths}")
             unprocessed_paths = [path for path, exists in existing_paths.items() if not exists]
             if len(unprocessed_paths) > 0:
@@ -332,16 +547,24 @@ async def get_pre_chat(websocket: WebSocket):
                                 "choices": [{"unprocessed_path": unprocessed_path, "messages": []}]
                             }
                             })
-                        tree_structure_result = await start_tree_structure_operation_impl(unprocessed_paths, extensions=["csv", "pdf", "xlsx", "xls", "txt", "docx", "md"], url=url_embedding)
-                        if tree_structure_result.status_code != 200:
-                            await websocket.send_json({
-                                "status": 400,
-                                "success": False,
-                                "message": str(e),
-                                "error": str(e),
-                                "timestamp": now()
-                            })
-                        else:
+                    # Chat-attached files preempt background folder scans
+                    tree_structure_result = await start_tree_structure_operation_impl(
+                        unprocessed_paths,
+                        extensions=["csv", "pdf", "xlsx", "xls", "txt", "docx", "md"],
+                        url=url_embedding,
+                        priority=INTERACTIVE_PRIORITY
+                    )
+                    if tree_structure_result.status_code != 200:
+                        error = json.loads(tree_structure_result.body).get("error")
+                        await websocket.send_json({
+                            "status": 400,
+                            "success": False,
+                            "message": error,
+                            "error": error,
+                            "timestamp": now()
+                        })
+                    else:
+                        for unprocessed_path in unprocessed_paths:
                             await websocket.send_json({
                                 "status": 200,
                                 "success" : True,
@@ -359,21 +582,11 @@ async def get_pre_chat(websocket: WebSocket):
                         "error": str(e),
                         "timestamp": now()
                     })
-            db_client.disconnect()
-
-        #TODO: system prompt should be cached and launched with the API 
-        system_prompt_path_str = get_baiss_project_path("core","baiss","shared","python","baiss_agents","app","system_prompt","brain","brain.md")
-        
-        system_prompt_path = Path(system_prompt_path_str)
-
-        
-        
-        if not system_prompt_path.exists():
-            raise FileNotFoundError(f"System prompt file not found at {system_prompt_path}")
-        
-        with open(system_prompt_path, "r", encoding="utf-8") as f:
-            system_prompt_content = f.read()
 
+        # Loaded once at startup (see main.py)
+        system_prompt_content = load_system_prompts().get("brain")
+        if system_prompt_content is None:
+            raise FileNotFoundError("System prompt of the 'brain' agent is not loaded")
 
 
 
@@ -383,6 +596,9 @@ async def get_pre_chat(websocket: WebSocket):
         }
         
         all_messages = [system_prompt_message] + messages
+        # Every completion of the conversation runs on its llama.cpp slot; the tool loop below only
+        # appends messages, so each one reuses the KV cache of the previous one
+        conversation = llama_sessions.conversation_key(all_messages, data.get("conversation_id"))
 
         # Prepare the payload for llama server
         payload = {
@@ -419,12 +635,31 @@ async def get_pre_chat(websocket: WebSocket):
         
         while i < MAX_ATTEMPTS and should_continue:
             payload["messages"] = all_messages
-            content_buffer = ""
             should_continue = False  # Reset - only continue if we have more work
-
-            # Stream the response from llama server to websocket
-            async with httpx.AsyncClient(timeout=300.0) as client:
-                async with client.stream("POST", url, json=payload) as response:
+            # The searches and the code of the reply start as soon as the parser sees them, while
+            # the rest of the reply is generated; their results are collected once it is done
+            parser = StreamParser(hidden_tags=("code_execution",))
+            functions = []
+            code_task = None
+            search_tasks = []
+
+            def dispatch(events):
+                nonlocal code_task
+                for event in events:
+                    value = event["value"]
+                    if event["type"] == "function":
+                        functions.append(value)
+                        # The code runs main(): start at the first main (else the first function, see below)
+                        if code_task is None and value["name"] == "main":
+                            code_task = asyncio.create_task(run_sandbox_code(value, url_embedding, paths))
+                    elif isinstance(value, dict) and value.get("tool") == "search" and value.get("query"):
+                        logging.info(f"Extracted tool: {value}")
+                        search_tasks.append(asyncio.create_task(run_search_tool(value["query"], url_embedding, paths)))
+
+            try:
+                # Stream the response from llama server to websocket, over the pooled client of the loop
+                async with llama_sessions.turn(url, conversation, payload) as turn, \
+                           llama_client().stream("POST", url, json=payload) as response:
                     response.raise_for_status()
 
                     async for line in response.aiter_lines():
@@ -435,6 +670,14 @@ async def get_pre_chat(websocket: WebSocket):
 
                             # Skip [DONE] message
                             if line.strip() == "[DONE]":
+                                # Text held back by the parser (a possible tag at the very end)
+                                visible, events = parser.close()
+                                dispatch(events)
+                                if visible:
+                                    await websocket.send_json(convert_stream_chunks({
+                                        "object": "chat.completion.chunk",
+                                        "choices": [{"index": 0, "delta": {"content": visible}}]
+                                    }))
                                 await websocket.send_json({
                                     "status": 200,
                                     "success": True,
@@ -442,152 +685,100 @@ async def get_pre_chat(websocket: WebSocket):
                                     "timestamp": now()
                                 })
                                 break
-                            
+
                             try:
                                 # Parse and forward the JSON chunk
                                 chunk_data = json.loads(line)
+                                turn.update(chunk_data)
 
+                                # Hide the <code_execution> tags, even split across chunks
+                                should_send = True
                                 if "choices" in chunk_data and isinstance(chunk_data["choices"], list):
                                     for choice in chunk_data["choices"]:
                                         delta = choice.get("delta", {})
                                         content = delta.get("content", "")
                                         if content:
-                                            content_buffer += content
+                                            turn.token()
+                                            delta["content"], events = parser.feed(content)
+                                            dispatch(events)
+                                            should_send = should_send and bool(delta["content"])
 
                                 data = convert_stream_chunks(chunk_data)
-                                
-                                # Filter out <code_execution> tags from the response
-                                should_send = True
-                                if data["response"]["choices"]:
-                                    for choice in data["response"]["choices"]:
-                                        for msg in choice.get("messages", []):
-                                            for content_item in msg.get("content", []):
-                                                if content_item.get("type") == "text":
-                                                    text = content_item.get("text", "")
-                                                    # Skip if text contains code_execution tags
-                                                    if "<code_execution>" in text or "</code_execution>" in text:
-                                                        should_send = False
-                                                    # Also filter out the tags from partial matches
-                                                    elif text.strip() in ["<code", "<code_", "<code_e", "<code_ex", 
-                                                                          "<code_exe", "<code_exec", "<code_execu", 
-                                                                          "<code_execut", "<code_executi", "<code_executio",
-                                                                          "<code_execution>", "</code", "</code_", "</code_e", "</code_ex",
-                                                                          "</code_exe", "</code_exec", "</code_execu",
-                                                                          "</code_execut", "</code_executi", "</code_execution>"]:
-                                                        should_send = False
-                                
+
                                 if data["response"]["choices"] and should_send:
                                     logging.info(f"Streaming chunk: {data}")
                                     await websocket.send_json(data)
                             except json.JSONDecodeError:
                                 logger.warning(f"Failed to parse JSON chunk: {line}")
                                 continue
-            # to check wash had l3iba khas tkon flkhr ola ndiroha lwst
-            extract_tools = JsonExtractor.extract_objects(content_buffer)
-            extract_python = PythonExtractor(content_buffer).functions
-
-            if extract_python:
-                # logging.info(f"Extracted Python functions/classes/methods: {extract_python}")
-
-                for attempts in range(3):
-                    try:
-                        sandbox = PythonSandbox()
-                        sandbox.add_tool_reference(
-                            name="searchlocaldocuments",
-                            module_path="baiss_sdk.tools",
-                            class_name="allTools",
-                            method_name="searchlocaldocuments",
-                            init_kwargs={"url_embedding": url_embedding}
-                        )
-                        code_to_execute = str(extract_python[0]["body"]).rstrip() + "\n\nasyncio.run(main())\n"
-                        logger.info(f"extracted code {code_to_execute}")
-                        exec_result = sandbox.execute(code_to_execute, timeout=30)
-                        # logging.info(f"Sandbox execution result: {exec_result}")
-                        if exec_result.get("success"):
-                            exec_data = exec_result.get("stdout")
-                            if exec_data:
-                                all_messages.append({
-                                    "role": "user",
-                                    "content": f"<code_execution_result>{str(exec_data)}</code_execution_result>"
-                                })
-                            else: 
-                                all_messages.append({
-                                    "role": "user",
-                                    "content": f"The code executed successfully with no result."
-                                })
-
-                            await websocket.send_json({
-                                    "success" : True,
-                                    "error"   : None,
-                                    "response": {
-                                        "code_execution_status": True,
-                                        "error": None
-                                    }
-                                })
-                            should_continue = True
-                            break
-                        else:
-                            exec_error = exec_result.get("error")
-                            # logging.error(f"Sandbox execution error: {exec_error}")
-                            all_messages.append({
-                                "role": "user",
-                                "content": f"<code_execution_result> {exec_error} </code_execution_result>"
-                            })
-
-
-                            await websocket.send_json({
-                                    "success" : True,
-                                    "error"   : None,
-                                    "response": {
-                                        "code_execution_status": False,
-                                        "error": exec_error
-                                    }
-                                })
-                            should_continue = True
-                            time.sleep(1)
-                            break
-                    except Exception as e:
-                        logging.error(f"Sandbox execution error on attempt {attempts + 1}: {e}", exc_info=True)
-                        time.sleep(1)
-
+                # Reply ended without [DONE]: nothing more is sent, only the last events are run
+                _, events = parser.close()
+                dispatch(events)
+                if code_task is None and functions:
+                    code_task = asyncio.create_task(run_sandbox_code(functions[0], url_embedding, paths))
+            except BaseException:
+                for task in search_tasks + ([code_task] if code_task else []):
+                    task.cancel()
+                raise
+
+            # None without code, or when the sandbox could not run it
+            exec_result = (await code_task) if code_task is not None else None
+            if exec_result is not None and exec_result.get("success"):
+                exec_data = exec_result.get("stdout")
+                if exec_data:
+                    all_messages.append({
+                        "role": "user",
+                        "content": f"<code_execution_result>{str(exec_data)}</code_execution_result>"
+                    })
+                else: 
+                    all_messages.append({
+                        "role": "user",
+                        "content": f"The code executed successfully with no result."
+                    })
 
-            if len(extract_tools) > 0:
-                try:
-                    logging.info(f"Extracted tools: {extract_tools}")
-                    for tool in extract_tools:
-                        if tool.get("tool") == "search" and tool.get("query"):
-                            search_query = tool["query"]
-                            logger.info(f"Performing additional search for query: {search_query}")
-                            search_params = SimilaritySearchRequest(query=search_query, search_type="hybrid", url_embedding=url_embedding, top_k=5)
-                            search_result = await api_v1_llmbox_similarity(search_params)
-                            # logging.info(f"Additional similarity search completed with status: {search_result.body}")
-                            result_content = json.loads(search_result.body.decode('utf-8'))
-                            status = result_content.get('status')
-                            if result_content.get("data"):
-                                data = result_content.get('data', {})
-                                results = data.get('results', [])
-                                logging.info(f"Additional search results: {results}")
-                                all_messages.append({
-                                    "role": "user",
-                                    "content": f"<search_results>{str(results)}</search_results>"
-                                })
-                                should_continue = True
-                            else:
-                                all_messages.append({
-                                    "role": "user",
-                                    "content": "<search_results>[]</search_results>"
-                                })
-                                should_continue = True
-                        else:
-                            logging.info("No search tool found in extracted tools.")
-                            # No valid tool, don't continue
-                except Exception as tool_error:
-                    logging.error(f"Error processing tools: {tool_error}")
+                await websocket.send_json({
+                        "success" : True,
+                        "error"   : None,
+                        "response": {
+                            "code_execution_status": True,
+                            "error": None
+                        }
+                    })
+                should_continue = True
+            elif exec_result is not None:
+                exec_error = exec_result.get("error")
+                # logging.error(f"Sandbox execution error: {exec_error}")
+                all_messages.append({
+                    "role": "user",
+                    "content": f"<code_execution_result> {exec_error} </code_execution_result>"
+                })
+
+
+                await websocket.send_json({
+                        "success" : True,
+                        "error"   : None,
+                        "response": {
+                            "code_execution_status": False,
+                            "error": exec_error
+                        }
+                    })
+                should_continue = True
+                await asyncio.sleep(1)
+
+            if search_tasks:
+                # One message per search, in the order of the reply
+                for outcome in await asyncio.gather(*search_tasks, return_exceptions=True):
+                    if isinstance(outcome, Exception):
+                        logging.error(f"Error processing tools: {outcome}")
+                        outcome = []
+                    else:
+                        logging.info(f"Additional search results: {outcome}")
+                        results.extend(outcome)
                     all_messages.append({
                         "role": "user",
-                        "content": "<search_results>[]</search_results>"
+                        "content": f"<search_results>{str(outcome)}</search_results>"
                     })
-                    should_continue = True
+                should_continue = True
             # else: no tools/code found, should_continue stays False, loop ends naturally
             
             i += 1
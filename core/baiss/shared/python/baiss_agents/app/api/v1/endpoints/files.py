@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 import uuid
 import threading
 import time
@@ -12,15 +13,16 @@ import httpx
 import baisstools
 baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
 import multiprocessing
-from baiss_agents.app.core.config import change_global_token
 import logging
 from fastapi               import APIRouter
 from fastapi.responses     import JSONResponse
 from starlette.websockets import WebSocket, WebSocketDisconnect
 from baiss_sdk.files import file_reader
 from baiss_sdk.parsers.arguments import ArgList
-from baiss_sdk.files.structures.scan import generate_full_tree_structures, TreeStructureScanner
-from baiss_agents.app.core.config import init_global_token, init_embedding_url
+from baiss_sdk.files.structures.scan import TreeStructureScanner
+from baiss_agents.app.core.watcher import file_watcher
+from baiss_agents.app.core.scheduler import ingestion_scheduler
+from baiss_sdk.files.scheduler import IngestionJob, BACKGROUND_PRIORITY
 # from baiss_agents.app.models.files import (
 #     MetadataValidationRequest
 # )
@@ -75,17 +77,49 @@ class TreeStructureProgressRequest(BaseModel):
 class StopTreeStructureRequest(BaseModel):
     process_id: str
 
+def job_progress_message(job: IngestionJob) -> Dict[str, Any]:
+    # No "message" field: the desktop client stops reading when a message mentions completion
+    return {
+        "status"  : 202,
+        "success" : True,
+        "response": {"job": job.snapshot()},
+        "error"   : None,
+    }
+
 @router.websocket("/tree-structure/start")
 async def start_tree_structure_operation(websocket: WebSocket):
-    """Start a tree structure generation operation StartTreeStructureRequest """
+    """Start a tree structure generation operation StartTreeStructureRequest, streaming the job progress """
     await websocket.accept()
+    operation = None
     try:
         data = await websocket.receive_json()
         paths = data.get("paths")
         extensions = data.get("extensions")
         url = data.get("url")
-        token = False
-        result = await start_tree_structure_operation_impl(paths, extensions, url, token=token)
+
+        async def send_progress(job: IngestionJob):
+            await websocket.send_json(job_progress_message(job))
+
+        operation = asyncio.create_task(start_tree_structure_operation_impl(paths, extensions, url, on_progress=send_progress))
+
+        async def listen_for_cancel():
+            # The client sends {"action": "cancel"} or disconnects to stop its job
+            try:
+                while True:
+                    message = await websocket.receive_json()
+                    if isinstance(message, dict) and message.get("action") == "cancel":
+                        break
+            except WebSocketDisconnect:
+                logger.info("WebSocket disconnected by client.")
+            except Exception as e:
+                logger.warning(f"Stopped listening to tree structure websocket: {e}")
+            operation.cancel()
+
+        listener = asyncio.create_task(listen_for_cancel())
+        try:
+            result = await operation
+        finally:
+            listener.cancel()
         if result.status_code == 200:
             await websocket.send_json({
                 "status": 200,
@@ -98,38 +132,41 @@ async def start_tree_structure_operation(websocket: WebSocket):
                 "status": result.status_code,
                 "success": False,
                 "response": None,
-                "error": result.content.get("error")
+                "error": json.loads(result.body).get("error")
             })
 
+    except asyncio.CancelledError:
+        if operation is None or not operation.cancelled():
+            raise
+        logger.info("Tree structure operation cancelled by client.")
+
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected by client.")
-        change_global_token(new_token=True)
 
     except Exception as e:
         logger.error(f"WebSocket error during tree structure operation: {e}")
-        await websocket.send_json({
-            "status": 500,
-            "success": False,
-            "response": None,
-            "error": str(e)
-        })
+        try:
+            await websocket.send_json({
+                "status": 500,
+                "success": False,
+                "response": None,
+                "error": str(e)
+            })
+        except Exception:
+            pass
     finally:
-        await websocket.close()
+        try:
+            await websocket.close()
+        except Exception:
+            pass
 
-async def start_tree_structure_operation_impl(paths, extensions, url: str, token = None):
-    """Implementation function that can be called directly from C# bridge"""
+async def start_tree_structure_operation_impl(paths, extensions, url: str, priority: int = BACKGROUND_PRIORITY, on_progress = None):
+    """
+    Implementation function that can be called directly from C# bridge.
+    Queues an ingestion job with the given priority and waits for it; on_progress(job)
+    is awaited as the job advances. Cancelling the caller cancels the job.
+    """
     try:
-        paths = list(set(paths))
-        extensions = list(set(extensions))
-        # logger.info(f"token received: {token}")
-        if url is None or url.strip() == "":
-            raise Exception("Embedding URL must be provided and cannot be empty.")
-        # logger.info(f"655656646546546546546554654654654654654url received: {url}")
-        # exit(0)
-        # init_stop()
-        init_global_token(token)
-        init_embedding_url(url)
-
         # Validate inputs
         if not paths or not isinstance(paths, list):
             logger.error(f"Paths validation failed: paths={paths}, is_list={isinstance(paths, list)}, bool(paths)={bool(paths)}")
@@ -154,9 +191,25 @@ async def start_tree_structure_operation_impl(paths, extensions, url: str, token
                     "error": "extensions must be a non-empty list"
                 }
             )
+        paths = list(set(paths))
+        extensions = list(set(extensions))
+        if url is None or url.strip() == "":
+            raise Exception("Embedding URL must be provided and cannot be empty.")
 
-        # Check for cancellation using Python's threading mechanisms
-        await generate_full_tree_structures(paths, extensions)
+        job = ingestion_scheduler.submit(paths, extensions, url, priority=priority)
+        try:
+            async for _ in job.watch():
+                if on_progress is not None:
+                    await on_progress(job)
+        except BaseException:
+            # Client gone or cancelled: stop the job instead of leaving it running unobserved
+            ingestion_scheduler.cancel(job.id)
+            raise
+        if job.state != "completed":
+            raise Exception(job.error or f"Ingestion job {job.id} was {job.state}.")
+
+        # Keep the scanned folders fresh from now on
+        await file_watcher.add_roots(paths, extensions, url)
 
         return JSONResponse(
             status_code=200,
@@ -164,8 +217,10 @@ async def start_tree_structure_operation_impl(paths, extensions, url: str, token
                 "status": 200,
                 "success": True,
                 "response": {
+                    "job_id": job.id,
                     "paths": paths,
                     "extensions": extensions,
+                    "progress": job.progress,
                     "message": "Tree structure operation is successfully completed."
                 },
                 "error": None
@@ -185,8 +240,18 @@ async def start_tree_structure_operation_impl(paths, extensions, url: str, token
         )
 
 
-
-
+@router.get("/tree-structure/jobs")
+async def get_tree_structure_jobs():
+    """Lists the queued, running and recently finished ingestion jobs."""
+    return JSONResponse(
+        status_code = 200,
+        content = {
+            "status"  : 200,
+            "success" : True,
+            "response": ingestion_scheduler.jobs(),
+            "error"   : None,
+        }
+    )
 
 
 @router.post("/delete_from_tree_structure_with_paths")
@@ -195,6 +260,7 @@ async def delete_from_tree_structure_with_paths(request: DeleteTreeStructureRequ
     try:
         # logger.info(f"Deleting paths from tree structures: {list(paths)}")
         loop = asyncio.get_event_loop()
+        await file_watcher.remove_roots(paths)
         await loop.run_in_executor(None, TreeStructureScanner.delete_path_file_or_folder, paths)
         return JSONResponse(
             status_code = 200,
@@ -248,9 +314,21 @@ async def delete_from_tree_structure_with_extensions(request: DeleteTreeStructur
 
 
 @router.post("/stop_tree_structure_operation")
-async def stop_tree_structure_operation():
+async def stop_tree_structure_operation(job_id: Optional[str] = None):
+    """Cancels one ingestion job, or all of them when no job_id is given."""
     try:
-        change_global_token(new_token=True)
+        if job_id is not None and ingestion_scheduler.get(job_id) is None:
+            return JSONResponse(
+                status_code = 404,
+                content = {
+                    "status"  : 404,
+                    "success" : False,
+                    "response": None,
+                    "error"   : f"Unknown job: {job_id}",
+                }
+            )
+        cancelled = ingestion_scheduler.cancel(job_id)
+        logger.info(f"Cancelled ingestion jobs: {cancelled}")
         return JSONResponse(
             status_code = 200,
             content = {
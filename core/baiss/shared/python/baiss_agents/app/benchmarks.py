@@ -0,0 +1,389 @@
+"""
+Concurrency benchmark of the /pre_chat chat orchestrator.
+
+Runs chat sessions against a local fake llama server: the first completion of a session
+asks for code execution (the code sleeps in the sandbox) and keeps generating after the code,
+the second one answers. Sessions run one at a time, then all together; with a non-blocking
+orchestrator the concurrent run takes about as long as a single session, and as the code starts
+when its block closes, a session takes about max(sandbox, trailing tokens) rather than the sum.
+The first completion also calls the search tool (answered by a stand-in search), and every
+session must end with the message listing the paths of the search results.
+
+The sandbox benchmark runs tool-using snippets with a process per snippet, then on the warm
+worker pool, and reports the queue wait versus the execution time of each.
+
+The KV cache benchmark runs multi-turn conversations through /pre_chat against a fake llama
+server that keeps the prompt of each slot and only prefills the tokens after the common prefix
+(at a fixed cost per token), first without slot affinity, where the server hands out any idle
+slot, then with the conversations pinned to their slots. It reports the prefilled tokens and
+the time to first token of each turn.
+
+Usage:
+    python -m baiss_agents.app.benchmarks pre_chat --sessions 4 --sandbox-seconds 2 --trailing-tokens 100
+    python -m baiss_agents.app.benchmarks sandbox --snippets 20 --concurrency 4 --workers 2
+    python -m baiss_agents.app.benchmarks kv_cache --conversations 4 --turns 5 --slots 4
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+
+def fake_llama_server(sandbox_seconds: float, tokens: int = 20, trailing_tokens: int = 0, token_delay: float = 0.02, search: bool = False) -> ThreadingHTTPServer:
+    """
+    Streams chat completion chunks; asks for code execution (in <code_execution> tags split across
+    chunks, followed by trailing_tokens more tokens) until a code execution result is in the messages.
+    With search, the replies asking for code execution also call the search tool first.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            executed = any("<code_execution_result>" in str(message.get("content")) for message in body["messages"])
+            if executed:
+                pieces = ["answer "] * tokens
+            else:
+                code = f"\n<code_execution>\nasync def main():\n    import time\n    time.sleep({sandbox_seconds})\n    print('done')\n</code_execution>\n"
+                if search:
+                    code = '\n{"tool": "search", "query": "benchmark question"}\n' + code
+                pieces = ["thinking "] * tokens + [code[start:start + 5] for start in range(0, len(code), 5)] + ["more "] * trailing_tokens
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for piece in pieces + [None]:
+                if piece is None:
+                    line = "data: [DONE]\n\n"
+                else:
+                    chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}}]}
+                    line = f"data: {json.dumps(chunk)}\n\n"
+                data = line.encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+                time.sleep(token_delay)
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+
+def fake_prefix_cache_server(slots: int, prefill_ms_per_token: float, tokens: int = 20, token_delay: float = 0.005) -> ThreadingHTTPServer:
+    """
+    Serves /props and streams chat completions like a llama.cpp server with slots: a request runs on
+    its id_slot, else on a random idle slot, and with cache_prompt only prefills the tokens (words
+    of the messages) after the common prefix with the slot's previous prompt. Every chunk carries
+    the timings (prompt_n, cache_n, prompt_ms) of the request.
+    """
+    prompts: List[List[str]] = [[] for _ in range(slots)]
+    busy = [False] * slots
+    condition = threading.Condition()
+    rng = random.Random(0)
+
+    def acquire(slot: int) -> int:
+        with condition:
+            if slot is not None and 0 <= slot < slots:
+                condition.wait_for(lambda: not busy[slot])
+            else:
+                condition.wait_for(lambda: not all(busy))
+                slot = rng.choice([index for index in range(slots) if not busy[index]])
+            busy[slot] = True
+            return slot
+
+    def release(slot: int):
+        with condition:
+            busy[slot] = False
+            condition.notify_all()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            data = json.dumps({"total_slots": slots}).encode()
+            self.send_response(200 if self.path == "/props" else 404)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            prompt = [word for message in body["messages"] for word in f"<{message['role']}> {message.get('content') or ''}".split()]
+            slot = acquire(body.get("id_slot"))
+            try:
+                cached = 0
+                if body.get("cache_prompt"):
+                    previous = prompts[slot]
+                    while cached < min(len(previous), len(prompt) - 1) and previous[cached] == prompt[cached]:
+                        cached += 1
+                prefill = len(prompt) - cached
+                prompts[slot] = prompt
+                timings = {"cache_n": cached, "prompt_n": prefill, "prompt_ms": prefill * prefill_ms_per_token}
+                time.sleep(timings["prompt_ms"] / 1000.0)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                reply = [f"answer{index} " for index in range(tokens)]
+                for piece in reply + [None]:
+                    if piece is None:
+                        line = "data: [DONE]\n\n"
+                    else:
+                        prompts[slot].append(piece.strip())
+                        chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}}], "timings": timings}
+                        line = f"data: {json.dumps(chunk)}\n\n"
+                    data = line.encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                    time.sleep(token_delay)
+                self.wfile.write(b"0\r\n\r\n")
+            finally:
+                release(slot)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+
+class RecordingWebSocket:
+    """Stands in for the websocket of a session: sends one request and timestamps every message sent back."""
+
+    def __init__(self, request: Dict[str, Any]):
+        self.request = request
+        self.sent: List[tuple] = []
+
+    async def accept(self):
+        pass
+
+    async def receive_json(self) -> Dict[str, Any]:
+        return self.request
+
+    async def send_json(self, data: Dict[str, Any]):
+        self.sent.append((time.perf_counter(), data))
+
+    async def close(self):
+        pass
+
+
+async def run_sessions(url: str, sessions: int) -> List[RecordingWebSocket]:
+    from baiss_agents.app.api.v1.endpoints.chatv2 import get_pre_chat
+    websockets = [
+        RecordingWebSocket({
+            "url"          : url,
+            "embedding_url": url,
+            "paths"        : [],
+            "messages"     : [{"role": "user", "content": f"question {i}"}],
+        })
+        for i in range(sessions)
+    ]
+    await asyncio.gather(*(get_pre_chat(websocket) for websocket in websockets))
+    return websockets
+
+
+def bench_pre_chat(args):
+    from baiss_agents.app.api.v1.endpoints import chatv2
+    from baiss_agents.app.core.llama_client import close_llama_clients
+    server = fake_llama_server(args.sandbox_seconds, trailing_tokens = args.trailing_tokens, search = True)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    async def search(query: str, url_embedding: str, paths: List[str]) -> List[Dict[str, Any]]:
+        # No documents are indexed here: the search tool answers with a fixed result
+        return [{"chunk_content": query, "path": "/benchmark/document.txt", "score": 1.0, "id": 1, "metadata": {}}]
+
+    async def main():
+        run_search_tool, chatv2.run_search_tool = chatv2.run_search_tool, search
+        try:
+            started = time.perf_counter()
+            single = await run_sessions(url, 1)
+            single_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            websockets = await run_sessions(url, args.sessions)
+            concurrent_time = time.perf_counter() - started
+        finally:
+            chatv2.run_search_tool = run_search_tool
+            await close_llama_clients()
+
+        errors = [data for websocket in single + websockets for _, data in websocket.sent if data.get("success") is False]
+        shown = ["".join(content["text"] for choice in data["response"]["choices"] for message in choice.get("messages", []) for content in message["content"])
+                 for websocket in websockets for _, data in websocket.sent if data.get("response", {}).get("choices")]
+        leaked = sum(1 for text in shown if "code_execution" in text)
+        executed = sum(1 for websocket in websockets for _, data in websocket.sent if data.get("response", {}).get("code_execution_status"))
+        # The last message of a session lists the paths of its search results
+        with_paths = sum(1 for websocket in single + websockets if websocket.sent
+                         and any(choice.get("paths") for choice in websocket.sent[-1][1].get("response", {}).get("choices") or []))
+        # Sessions that were still sending while every other session had started
+        last_start = max(websocket.sent[0][0] for websocket in websockets)
+        overlapping = sum(1 for websocket in websockets if websocket.sent[-1][0] > last_start)
+        print(f"1 session: {single_time:.2f}s, {args.sessions} concurrent sessions: {concurrent_time:.2f}s "
+              f"({args.sessions * single_time / concurrent_time:.1f}x throughput)")
+        print(f"code executions: {executed}/{args.sessions}, sessions in progress together: {overlapping}/{args.sessions}, "
+              f"chunks showing a hidden tag: {leaked}, sessions sent their paths: {with_paths}/{args.sessions + 1}, errors: {len(errors)}")
+        if errors:
+            print(errors[0])
+        return (not errors and not leaked and executed == args.sessions and with_paths == args.sessions + 1
+                and concurrent_time < 1.5 * single_time)
+
+    ok = asyncio.run(main())
+    server.shutdown()
+    return ok
+
+
+def bench_sandbox(args):
+    from baiss_sdk.sandbox.pool import sandbox_pool
+    from baiss_sdk.sandbox.python_sandbox import PythonSandbox
+    code = "async def main():\n    print(json.dumps({'tool': str(type(searchlocaldocuments))}))\n\nasyncio.run(main())\n"
+
+    def sandbox() -> PythonSandbox:
+        sandbox = PythonSandbox()
+        sandbox.add_modules(*args.modules)
+        sandbox.add_tool_reference(
+            name="searchlocaldocuments",
+            module_path="baiss_sdk.tools",
+            class_name="allTools",
+            method_name="searchlocaldocuments",
+            init_kwargs={"url_embedding": None, "paths": []}
+        )
+        return sandbox
+
+    async def run(label: str) -> bool:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one():
+            async with semaphore:
+                return await sandbox().execute_async(code, timeout = 60)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one() for _ in range(args.snippets)))
+        elapsed = time.perf_counter() - started
+        queue_ms = sum(result["timings"]["queue_ms"] for result in results) / len(results)
+        execution_ms = sum(result["timings"]["execution_ms"] for result in results) / len(results)
+        failed = [result for result in results if not result["success"]]
+        print(f"{label:<18}: {args.snippets} snippets in {elapsed:.2f}s, mean queue wait {queue_ms:.1f} ms, "
+              f"mean execution {execution_ms:.1f} ms, failures: {len(failed)}")
+        if failed:
+            print(failed[0]["error"])
+        return not failed
+
+    ok = asyncio.run(run("process per snippet"))
+    sandbox_pool.size = args.workers
+    sandbox_pool.preload = sandbox_pool.preload + [module for module in args.modules if module not in sandbox_pool.preload]
+    started = time.perf_counter()
+    sandbox_pool.start()
+    print(f"pool of {args.workers} workers ready in {time.perf_counter() - started:.2f}s")
+    try:
+        ok = asyncio.run(run("warm pool")) and ok
+        print(f"pool stats: {sandbox_pool.stats}")
+    finally:
+        sandbox_pool.stop()
+    return ok
+
+
+def shown_text(websocket: RecordingWebSocket) -> str:
+    """The reply text sent to the client of a session."""
+    return "".join(content["text"] for _, data in websocket.sent for choice in data.get("response", {}).get("choices") or []
+                   for message in choice.get("messages", []) for content in message["content"])
+
+
+def bench_kv_cache(args):
+    from baiss_agents.app.api.v1.endpoints.chatv2 import get_pre_chat
+    from baiss_agents.app.core.llama_client import close_llama_clients
+    from baiss_agents.app.core.llama_sessions import llama_sessions
+    filler = " ".join(f"word{index}" for index in range(args.message_words))
+
+    async def run(label: str, pinned: bool) -> List[Dict[str, float]]:
+        server = fake_prefix_cache_server(args.slots, args.prefill_ms_per_token)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        llama_sessions.enabled = pinned
+        histories = [[] for _ in range(args.conversations)]
+        rounds = []
+        try:
+            for turn in range(args.turns):
+                for index, history in enumerate(histories):
+                    history.append({"role": "user", "content": f"{label} conversation {index} turn {turn}: {filler}"})
+                websockets = [
+                    RecordingWebSocket({"url": url, "embedding_url": url, "paths": [], "messages": list(history)})
+                    for history in histories
+                ]
+                before = llama_sessions.stats
+                await asyncio.gather(*(get_pre_chat(websocket) for websocket in websockets))
+                after = llama_sessions.stats
+                for history, websocket in zip(histories, websockets):
+                    # The client resends the reply it was shown with the next turn
+                    history.append({"role": "assistant", "content": shown_text(websocket)})
+                turns = max(1, after["turns"] - before["turns"])
+                rounds.append({
+                    "prefill_tokens": (after["prefill_tokens"] - before["prefill_tokens"]) / turns,
+                    "cached_tokens" : (after["cached_tokens"] - before["cached_tokens"]) / turns,
+                    "ttft_ms"       : (after["ttft_ms"] - before["ttft_ms"]) / turns,
+                })
+        finally:
+            server.shutdown()
+        return rounds
+
+    async def main():
+        try:
+            unpinned = await run("unpinned", pinned = False)
+            pinned = await run("pinned", pinned = True)
+        finally:
+            await close_llama_clients()
+        print(f"{args.conversations} conversations of {args.turns} turns on {args.slots} slots, "
+              f"prefill {args.prefill_ms_per_token} ms/token (mean per request)")
+        print(f"{'turn':>4} | {'unpinned prefill':>16} {'cached':>7} {'ttft ms':>8} | {'pinned prefill':>14} {'cached':>7} {'ttft ms':>8}")
+        for turn, (before, after) in enumerate(zip(unpinned, pinned)):
+            print(f"{turn:>4} | {before['prefill_tokens']:>16.0f} {before['cached_tokens']:>7.0f} {before['ttft_ms']:>8.1f} | "
+                  f"{after['prefill_tokens']:>14.0f} {after['cached_tokens']:>7.0f} {after['ttft_ms']:>8.1f}")
+        total = lambda rounds, key: sum(round[key] for round in rounds)
+        print(f"prefilled tokens: {total(unpinned, 'prefill_tokens'):.0f} -> {total(pinned, 'prefill_tokens'):.0f}, "
+              f"mean ttft: {total(unpinned, 'ttft_ms') / args.turns:.1f} ms -> {total(pinned, 'ttft_ms') / args.turns:.1f} ms")
+        print(f"session stats: {llama_sessions.stats}")
+        # After the first turn, pinned conversations only prefill their new messages (while they keep their slot)
+        return total(pinned, "prefill_tokens") < total(unpinned, "prefill_tokens") and llama_sessions.stats["rewritten_prompts"] == 0
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+    pre_chat = subparsers.add_parser("pre_chat", help = "concurrent /pre_chat sessions with sandboxed code execution")
+    pre_chat.add_argument("--sessions", type = int, default = 4)
+    pre_chat.add_argument("--sandbox-seconds", type = float, default = 2.0)
+    pre_chat.add_argument("--trailing-tokens", type = int, default = 0, help = "tokens generated after the code block")
+    sandbox = subparsers.add_parser("sandbox", help = "sandbox snippets with a process each, then on the worker pool")
+    sandbox.add_argument("--snippets", type = int, default = 20)
+    sandbox.add_argument("--concurrency", type = int, default = 4)
+    sandbox.add_argument("--workers", type = int, default = 2)
+    sandbox.add_argument("--modules", nargs = "*", default = ["pandas"], help = "modules added to the sandbox")
+    kv_cache = subparsers.add_parser("kv_cache", help = "multi-turn conversations with and without llama.cpp slot affinity")
+    kv_cache.add_argument("--conversations", type = int, default = 4)
+    kv_cache.add_argument("--turns", type = int, default = 5)
+    kv_cache.add_argument("--slots", type = int, default = 4)
+    kv_cache.add_argument("--message-words", type = int, default = 200, help = "words of each user message")
+    kv_cache.add_argument("--prefill-ms-per-token", type = float, default = 0.1)
+    args = parser.parse_args()
+    if args.command == "pre_chat":
+        sys.exit(0 if bench_pre_chat(args) else 1)
+    if args.command == "sandbox":
+        sys.exit(0 if bench_sandbox(args) else 1)
+    if args.command == "kv_cache":
+        sys.exit(0 if bench_kv_cache(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -46,25 +46,6 @@ class Config:
 # Create a global config instance
 config = Config()
 
-# do not remove the stop token, used in files.py
-global_token = None
-def init_global_token(token):
-    global global_token
-    global_token = False
-    return global_token
-
-def change_global_token(new_token = True):
-    global global_token
-    global_token = new_token
-    return global_token
-
-embedding_url = None
-def init_embedding_url(url):
-    global embedding_url
-    embedding_url = url
-    return embedding_url
-
-
 # Global variables for caching
 system_prompts: Dict[str, str] = {}
 
@@ -153,6 +134,20 @@ class Settings(BaseSettings):
  
     client_type_vision: str = "None"
     model_id_vision: str = "None"
+
+    # Cosine search backend: "duckdb" or "memmap" (embedding matrix under local-data/vectors)
+    BAISS_VECTOR_BACKEND: str = "duckdb"
+    # Reranker: intra-op threads of the ONNX model (0 = onnxruntime default) and model time
+    # budget per search in milliseconds (0 = rerank every candidate)
+    BAISS_RERANK_THREADS: int = 0
+    BAISS_RERANK_BUDGET_MS: float = 0.0
+    # Sandbox worker pool: warm workers (0 = a process per snippet), snippets run by a worker
+    # before it is replaced and its memory limit in MB (0 = no limit)
+    BAISS_SANDBOX_WORKERS: int = 2
+    BAISS_SANDBOX_MAX_EXECUTIONS: int = 50
+    BAISS_SANDBOX_MAX_MEMORY_MB: float = 1024.0
+    # Pin each chat conversation to a llama.cpp slot, so that its turns reuse the KV cache
+    BAISS_LLAMA_SLOT_AFFINITY: bool = True
  
     @property
     def AGENT_CONFIGS(self) -> dict:
@@ -256,7 +251,9 @@ def load_system_prompts() -> dict[str, str]:
                     with open(prompt_path, "r", encoding="utf-8") as f:
                         system_prompts[agent_name] = f.read()
                 except FileNotFoundError:
-                    raise RuntimeError(f"System prompt file not found for agent '{agent_name}': {prompt_path}")
+                    # Not every agent ships a prompt, callers check for the one they need
+                    import logging
+                    logging.getLogger(__name__).warning(f"System prompt file not found for agent '{agent_name}': {prompt_path}")
                 except IOError as e:
                     raise RuntimeError(f"Error reading system prompt for agent '{agent_name}': {e}")
  
@@ -0,0 +1,26 @@
+import asyncio
+import weakref
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+import httpx
+
+# Clients are bound to the event loop that created them, so one pooled client is kept per loop.
+# Every chat session of the loop streams its completions through it (see chatv2.get_pre_chat).
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def llama_client() -> httpx.AsyncClient:
+    """Returns the long-lived client of the llama server on the running loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(timeout = 300.0)
+        _clients[loop] = client
+    return client
+
+
+async def close_llama_clients():
+    """Closes the client of the running loop, at shutdown."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
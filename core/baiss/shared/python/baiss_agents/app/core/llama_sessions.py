@@ -0,0 +1,223 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+from baiss_agents.app.core.llama_client import llama_client
+
+logger = logging.getLogger(__name__)
+
+_COMPLETIONS_PATH = "/v1/chat/completions"
+
+
+class LlamaTurn:
+    """One completion request of a conversation: its slot, and the timings reported while it streams."""
+
+    def __init__(self, conversation: str, slot: Optional[int], messages: int, reused_messages: int):
+        self.conversation    = conversation
+        self.slot            = slot
+        self.messages        = messages
+        self.reused_messages = reused_messages
+        self.started         = time.perf_counter()
+        self.first_token_ms: Optional[float] = None
+        self.timings: Dict[str, Any] = {}
+
+    def token(self):
+        """Marks the arrival of a content token; the first one sets the time to first token."""
+        if self.first_token_ms is None:
+            self.first_token_ms = (time.perf_counter() - self.started) * 1000.0
+
+    def update(self, chunk: Dict[str, Any]):
+        """Keeps the llama.cpp timings of a stream chunk (sent with timings_per_token)."""
+        timings = chunk.get("timings")
+        if isinstance(timings, dict):
+            self.timings = timings
+
+    @property
+    def report(self) -> Dict[str, Any]:
+        """
+        Prompt tokens evaluated (prefilled) and taken from the KV cache of the slot, with the
+        prefill time the cache saved, estimated at the measured prefill speed of the turn.
+        """
+        prefilled = self.timings.get("prompt_n")
+        cached = self.timings.get("cache_n")
+        prompt_ms = self.timings.get("prompt_ms")
+        saved_ms = None
+        if cached is not None and prefilled and prompt_ms is not None:
+            saved_ms = cached * prompt_ms / prefilled
+        return {
+            "slot"            : self.slot,
+            "messages"        : self.messages,
+            "reused_messages" : self.reused_messages,
+            "prefill_tokens"  : prefilled,
+            "cached_tokens"   : cached,
+            "prefill_ms"      : prompt_ms,
+            "saved_prefill_ms": saved_ms,
+            "ttft_ms"         : self.first_token_ms,
+        }
+
+
+class LlamaSessionManager:
+    """
+    Pins the conversations of the chat to llama.cpp server slots, so that each completion of a
+    conversation (every round trip of the tool loop, every user turn) reuses the KV cache of the
+    previous one: the request names the conversation's slot (id_slot) with cache_prompt, and only
+    the tokens after the longest common prefix with the slot's last prompt are prefilled. This only
+    pays off if the prompts of a conversation grow by appending: the system prompt is sent
+    byte-identical (loaded once) and messages are never rewritten; a turn that rewrites earlier
+    messages is logged.
+    A conversation keeps its slot while the slot is idle; when all slots are taken, the least
+    recently used conversation gives its slot up. Without /props (slot count unknown) requests
+    are not pinned, the server picks the slot.
+    """
+
+    def __init__(self, max_conversations: int = 256):
+        self.max_conversations = max_conversations
+        self.enabled = True
+        self._total_slots: Dict[str, Optional[int]] = {}
+        # conversation -> {"base", "slot", "messages": fingerprints of its last prompt}, LRU order
+        self._conversations: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # (base url, slot) -> owning conversation, and -> requests in flight
+        self._owners: Dict[tuple, str] = {}
+        self._busy: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+        self._stats = {"turns": 0, "prefill_tokens": 0, "cached_tokens": 0, "saved_prefill_ms": 0.0, "ttft_ms": 0.0, "rewritten_prompts": 0}
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["conversations"] = len(self._conversations)
+        turns = max(1, stats["turns"])
+        total = stats["prefill_tokens"] + stats["cached_tokens"]
+        stats["cache_hit_rate"] = (stats["cached_tokens"] / total) if total else 0.0
+        stats["mean_ttft_ms"] = stats["ttft_ms"] / turns
+        return stats
+
+    @staticmethod
+    def base_url(url: str) -> str:
+        return url[:-len(_COMPLETIONS_PATH)] if url.endswith(_COMPLETIONS_PATH) else url.rstrip("/")
+
+    @staticmethod
+    def _fingerprint(message: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(message, sort_keys = True, ensure_ascii = False).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def conversation_key(messages: List[Dict[str, Any]], conversation_id: str = None) -> str:
+        """
+        Key of a conversation: the client's conversation id if given, else its first two messages
+        (the system prompt and the first user message), which the client resends with every turn.
+        """
+        if conversation_id:
+            return f"id:{conversation_id}"
+        head = json.dumps(messages[:2], sort_keys = True, ensure_ascii = False)
+        return "head:" + hashlib.sha256(head.encode("utf-8")).hexdigest()
+
+    async def total_slots(self, url: str) -> Optional[int]:
+        """Slot count of the llama server (its /props), None if unknown."""
+        base = self.base_url(url)
+        if base not in self._total_slots:
+            try:
+                response = await llama_client().get(f"{base}/props", timeout = 5.0)
+                response.raise_for_status()
+                self._total_slots[base] = int(response.json()["total_slots"])
+            except Exception as e:
+                logger.warning(f"Slot count of the llama server {base} unknown, completions are not pinned: {e}")
+                self._total_slots[base] = None
+        return self._total_slots[base]
+
+    def _pick_slot(self, base: str, current: Optional[int], total: int) -> Optional[int]:
+        """
+        The conversation's slot if idle, else an idle slot (unowned first, then the least recently
+        used). When every slot is busy, the conversation waits for its own slot, or if it has none
+        the request is not pinned and the server runs it on the first slot that frees up.
+        """
+        if current is not None and not self._busy.get((base, current)):
+            return current
+        idle = [slot for slot in range(total) if not self._busy.get((base, slot))]
+        if not idle:
+            return current
+        unowned = [slot for slot in idle if (base, slot) not in self._owners]
+        if unowned:
+            return unowned[0]
+        owners = {self._owners[(base, slot)]: slot for slot in idle}
+        return next((owners[key] for key in self._conversations if key in owners), idle[0])
+
+    def _acquire(self, base: str, conversation: str, total: Optional[int], fingerprints: List[str]) -> tuple:
+        """Assigns the slot of a request and records its prompt; returns (slot, previous prompt)."""
+        with self._lock:
+            record = self._conversations.get(conversation)
+            previous = record["messages"] if record else []
+            current = record["slot"] if record and record["base"] == base else None
+            if record and record["base"] != base and self._owners.get((record["base"], record["slot"])) == conversation:
+                # Moved to another llama server
+                del self._owners[(record["base"], record["slot"])]
+            slot = self._pick_slot(base, current, total) if total else None
+            if slot is not None and slot != current:
+                # Take the slot over from its owner, give up the one held so far
+                owner = self._owners.get((base, slot))
+                if owner in self._conversations and self._conversations[owner]["base"] == base:
+                    self._conversations[owner]["slot"] = None
+                if current is not None:
+                    del self._owners[(base, current)]
+                self._owners[(base, slot)] = conversation
+            if slot is not None:
+                self._busy[(base, slot)] = self._busy.get((base, slot), 0) + 1
+            self._conversations[conversation] = {"base": base, "slot": slot, "messages": fingerprints}
+            self._conversations.move_to_end(conversation)
+            while len(self._conversations) > self.max_conversations:
+                evicted, record = self._conversations.popitem(last = False)
+                if record["slot"] is not None and self._owners.get((record["base"], record["slot"])) == evicted:
+                    del self._owners[(record["base"], record["slot"])]
+        return slot, previous
+
+    def _release(self, base: str, slot: Optional[int], report: Dict[str, Any]):
+        with self._lock:
+            if slot is not None:
+                self._busy[(base, slot)] -= 1
+            self._stats["turns"] += 1
+            self._stats["prefill_tokens"] += report["prefill_tokens"] or 0
+            self._stats["cached_tokens"] += report["cached_tokens"] or 0
+            self._stats["saved_prefill_ms"] += report["saved_prefill_ms"] or 0.0
+            self._stats["ttft_ms"] += report["ttft_ms"] or 0.0
+
+    @asynccontextmanager
+    async def turn(self, url: str, conversation: str, payload: Dict[str, Any]) -> AsyncIterator[LlamaTurn]:
+        """
+        Prepares payload (its messages set) for the slot of the conversation and yields the LlamaTurn
+        to feed with the stream; the slot is released and the turn reported on exit.
+        """
+        base = self.base_url(url)
+        total = await self.total_slots(url) if self.enabled else None
+        fingerprints = [self._fingerprint(message) for message in payload["messages"]]
+        slot, previous = self._acquire(base, conversation, total, fingerprints)
+        reused = 0
+        while reused < min(len(previous), len(fingerprints)) and previous[reused] == fingerprints[reused]:
+            reused += 1
+        if previous and reused < len(previous):
+            # Earlier messages changed: the slot's cache only covers the common prefix
+            with self._lock:
+                self._stats["rewritten_prompts"] += 1
+            logger.info(f"Conversation prompt rewritten after message {reused} of {len(previous)}, its KV cache is reused up to there")
+
+        payload["cache_prompt"] = True
+        if slot is None:
+            payload.pop("id_slot", None)
+        else:
+            payload["id_slot"] = slot
+        turn = LlamaTurn(conversation, slot, len(fingerprints), reused)
+        try:
+            yield turn
+        finally:
+            report = turn.report
+            self._release(base, slot, report)
+            logger.info(f"Llama turn: {report}")
+
+
+# Shared by the chat sessions of the process
+llama_sessions = LlamaSessionManager()
@@ -0,0 +1,25 @@
+import asyncio
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from baiss_sdk.db import DbProxyClient
+from baiss_sdk.files.scheduler import IngestionScheduler, IngestionJob
+from baiss_sdk.files.structures.scan import generate_full_tree_structures
+
+# Runs tree structure operations: chat-attached paths (/pre_chat) preempt
+# background folder scans (/tree-structure/start), see files.py
+ingestion_scheduler = IngestionScheduler(runner = generate_full_tree_structures)
+
+async def migrate_indexes(job: IngestionJob):
+    """
+    Runner of the index migrations of a database written by an older version (see
+    DuckDb.migrate_indexes): one batch at a time, pausing at the checkpoints between
+    batches while ingestions run. Searches scan BaissChunks until an index is migrated.
+    """
+    db_client = DbProxyClient()
+    await asyncio.to_thread(db_client.connect)
+    try:
+        job.update(stage = "migrate")
+        while await asyncio.to_thread(db_client.migrate_indexes):
+            await job.checkpoint()
+    finally:
+        await asyncio.to_thread(db_client.disconnect)
@@ -0,0 +1,9 @@
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from baiss_sdk.files.watcher import FileWatcher
+from baiss_agents.app.core.scheduler import ingestion_scheduler
+
+# Keeps the indexed root folders fresh between tree structure operations,
+# started and stopped with the application (see main.py); its batches run as background
+# ingestion jobs
+file_watcher = FileWatcher(scheduler = ingestion_scheduler)
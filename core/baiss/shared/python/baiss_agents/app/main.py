@@ -6,7 +6,22 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from typing import Dict
+import asyncio
 from baiss_agents.app.api.v1.router import api_router
+from baiss_agents.app.core.config import get_settings, load_system_prompts
+from baiss_agents.app.core.llama_client import close_llama_clients
+from baiss_agents.app.core.llama_sessions import llama_sessions
+from baiss_agents.app.core.watcher import file_watcher
+from baiss_agents.app.core.scheduler import ingestion_scheduler, migrate_indexes
+from baiss_sdk.files.scheduler import MAINTENANCE_PRIORITY
+from baiss_sdk.db import DbProxyClient
+from baiss_sdk.db.vector_store import open_vector_store, close_vector_store
+from baiss_sdk.search.service import search_service
+from baiss_sdk.files.structures.pipeline import shutdown_parse_executor
+from baiss_sdk.sandbox.pool import sandbox_pool
+from baiss_sdk.sandbox.rpc import host_bridge
+# Registers the tools the sandbox workers call on the host bridge
+import baiss_sdk.tools
 import logging
 import sys
 
@@ -30,12 +45,65 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+def open_memmap_vector_store():
+    """Maps the embedding matrices into memory, rebuilding them from DuckDB if they are stale."""
+    db_client = DbProxyClient()
+    db_client.connect()
+    try:
+        open_vector_store(db_client)
+    finally:
+        db_client.disconnect()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan events"""
     # Startup
     logger.info("Starting up application...")
     try:
+        # Read once here instead of by every chat session
+        await asyncio.to_thread(load_system_prompts)
+        if get_settings().BAISS_VECTOR_BACKEND.strip().lower() == "memmap":
+            try:
+                await asyncio.to_thread(open_memmap_vector_store)
+            except Exception as e:
+                # Cosine searches fall back to DuckDB
+                logger.error(f"Memmap vector store could not be opened: {e}")
+        search_service.rerank_threads = get_settings().BAISS_RERANK_THREADS or None
+        search_service.rerank_budget_ms = get_settings().BAISS_RERANK_BUDGET_MS or None
+        try:
+            # Sandboxed tools search through this process
+            host_bridge.start(asyncio.get_running_loop())
+        except Exception as e:
+            # Sandboxed tools open connections of their own
+            logger.error(f"Host bridge could not start: {e}")
+        if host_bridge.running:
+            try:
+                # Loads the extensions and validates the search indexes once
+                await asyncio.to_thread(search_service.start)
+            except Exception as e:
+                # Searches fall back to a connection per request
+                logger.error(f"Search service could not start: {e}")
+        else:
+            # The warm connection would hold the DuckDB file lock for the lifespan, and the
+            # sandboxed tools, which then open their own connection, could not search
+            logger.warning("Search service not started: the sandbox cannot reach it without the host bridge")
+        llama_sessions.enabled = get_settings().BAISS_LLAMA_SLOT_AFFINITY
+        sandbox_pool.size = get_settings().BAISS_SANDBOX_WORKERS
+        sandbox_pool.max_executions = get_settings().BAISS_SANDBOX_MAX_EXECUTIONS
+        sandbox_pool.max_memory_mb = get_settings().BAISS_SANDBOX_MAX_MEMORY_MB
+        try:
+            # Workers import the sandbox modules and tools before the first chat needs them
+            await asyncio.to_thread(sandbox_pool.start)
+        except Exception as e:
+            # Snippets fall back to a process each
+            logger.error(f"Sandbox pool could not start: {e}")
+        try:
+            await file_watcher.start()
+        except Exception as e:
+            # The index still refreshes through tree structure operations
+            logger.error(f"File watcher could not start: {e}")
+        # Indexes of the chunks written by an older version are built in the background
+        ingestion_scheduler.submit([], [], None, MAINTENANCE_PRIORITY, runner = migrate_indexes)
 
         logger.info("Application startup complete.")
     except Exception as e:
@@ -46,6 +114,16 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down application...")
+    # The watcher first, so that it submits no more jobs
+    await file_watcher.stop()
+    await ingestion_scheduler.shutdown()
+    shutdown_parse_executor()
+    # Sandboxed tools search through the search service until the pool and bridge are down
+    await asyncio.to_thread(sandbox_pool.stop)
+    await asyncio.to_thread(host_bridge.stop)
+    await asyncio.to_thread(search_service.stop)
+    await close_llama_clients()
+    close_vector_store()
 
 # Create FastAPI app with default values
 app = FastAPI(
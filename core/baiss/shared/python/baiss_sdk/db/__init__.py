@@ -1,18 +1,25 @@
 import os
 import sys
 
+import time
+import logging
 import baisstools
 baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from baiss_sdk.db.base_db import BaseDb
 from baiss_sdk.db.duck_db import DuckDb
+from baiss_sdk.db.vector_store import get_vector_store
+from baiss_sdk.db.fusion import fused_search
+from baiss_sdk.db.filters import SearchFilters
 from baiss_sdk import get_baiss_project_path
 
 
 class DbProxyClient(BaseDb):
-    def __init__(self, base: str = "duckdb", **kwargs):
+    def __init__(self, base: str = "duckdb", vector_backend: str = None, **kwargs):
         # super().__init__()
         base = str(base).strip().lower()
+        # "memmap" ranks cosine searches with the vector store opened at server start (see vector_store.py)
+        self.vector_backend = str(vector_backend or os.environ.get("BAISS_VECTOR_BACKEND", "duckdb")).strip().lower()
         
         path = get_baiss_project_path("local-data", base)
         if not os.path.exists(path):
@@ -37,20 +44,26 @@ class DbProxyClient(BaseDb):
     def disconnect(self):
         return self._client.disconnect()
 
+    def cursor(self) -> "DbProxyClient":
+        client = DbProxyClient.__new__(DbProxyClient)
+        client.vector_backend = self.vector_backend
+        client._client = self._client.cursor()
+        return client
+
     def execute_query(self, query: str):
         return self._client.execute_query(query)
 
     def create_db_and_tables(self):
         return self._client.create_db_and_tables()
     
-    def insert_rows(self, table: str, rows: List[Dict[str, Any]]):
-        return self._client.insert_rows(table, rows)
+    def insert_rows(self, table: str, rows: List[Dict[str, Any]], bulk: bool = True) -> List[int]:
+        return self._client.insert_rows(table, rows, bulk)
     
     def delete_by_paths(self, paths: List[str]):
         return self._client.delete_by_paths(paths)
 
-    def retrieve_unprocessed_files(self, extensions: List[str]) -> List[tuple]:
-        return self._client.retrieve_unprocessed_files(extensions)
+    def retrieve_unprocessed_files(self, extensions: List[str], paths: List[str] = None) -> List[tuple]:
+        return self._client.retrieve_unprocessed_files(extensions, paths)
 
     def delete_by_extensions(self, extensions: List[str]):
         return self._client.delete_by_extensions(extensions)
@@ -74,31 +87,106 @@ class DbProxyClient(BaseDb):
     def create_fts_index(self, force_recreate=False):
         return self._client.create_fts_index(force_recreate)
 
-    def similarity_search_cosine(self, query_embedding, top_k=5, score_threshold=0.0):
-        return self._client.similarity_search_cosine(query_embedding, top_k, score_threshold)
-
-    def similarity_search_bm25(self, query, top_k=5, score_threshold=0.0):
-        return self._client.similarity_search_bm25(query, top_k, score_threshold)
+    def migrate_indexes(self, batch_size=5000):
+        return self._client.migrate_indexes(batch_size)
+
+    def similarity_search_cosine(self, query_embedding, top_k=5, score_threshold=0.0, filters=None):
+        store = get_vector_store() if self.vector_backend == "memmap" else None
+        if store is None or not store.has(len(query_embedding)):
+            return self._client.similarity_search_cosine(query_embedding, top_k, score_threshold, filters)
+        start_time = time.time()
+        ranked = [(id, score) for id, score in self.rank_cosine(query_embedding, top_k, filters) if score >= score_threshold]
+        chunks = {row[2]: row for row in self._client.get_chunks_by_ids([id for id, _ in ranked])}
+        results = [(chunks[id][0], chunks[id][1], score, id, chunks[id][3]) for id, score in ranked if id in chunks]
+        logging.info(f"Memmap cosine search took {time.time() - start_time:.4f} seconds")
+        return results
+
+    def rank_cosine(self, query_embedding: List[float], top_k: int = 5, filters: SearchFilters = None) -> List[tuple]:
+        store = get_vector_store() if self.vector_backend == "memmap" else None
+        if store is None or not store.has(len(query_embedding)):
+            return self._client.rank_cosine(query_embedding, top_k, filters)
+        if filters is None or filters.is_empty():
+            return store.search(query_embedding, top_k)
+        # The matrix only scores the rows of the chunks passing the filters
+        return store.search(query_embedding, top_k, self._client.get_chunk_ids(filters))
+
+    def similarity_search_bm25(self, query, top_k=5, score_threshold=0.0, filters=None):
+        return self._client.similarity_search_bm25(query, top_k, score_threshold, filters)
+
+    def rank_bm25(self, query: str, top_k: int = 5, filters: SearchFilters = None) -> List[tuple]:
+        return self._client.rank_bm25(query, top_k, filters)
 
     def hybrid_similarity_search(self, query_text, query_embedding, top_k=5, 
-                               cosine_weight=0.3, score_threshold=0.0, k=60):
-        return self._client.hybrid_similarity_search(query_text, query_embedding, top_k, 
-                                              cosine_weight, score_threshold, k)
+                               cosine_weight=0.3, score_threshold=0.0, k=60, fusion="zscore", rrf_k=60, filters=None):
+        # Fused here rather than in the client, so the cosine ranking goes through the vector backend
+        return fused_search(self, query_text, query_embedding, top_k, cosine_weight, score_threshold, k, fusion, rrf_k, filters)
     def check_if_paths_exists(self, paths: List[str]):
         return self._client.check_if_paths_exists(paths)
 
     def check_if_path_exist_or_changed(self, path: str, file_hash: str) -> bool:
         return self._client.check_if_path_exist_or_changed(path, file_hash)
     
+    def get_cached_embeddings(self, model: str, text_hashes: List[str]) -> Dict[str, List[float]]:
+        return self._client.get_cached_embeddings(model, text_hashes)
+
+    def put_cached_embeddings(self, model: str, embeddings: Dict[str, List[float]]):
+        return self._client.put_cached_embeddings(model, embeddings)
+
+    def evict_embedding_cache(self, max_entries: int) -> int:
+        return self._client.evict_embedding_cache(max_entries)
+
     def get_all_paths(self) -> List[str]:
         return self._client.get_all_paths()
     
+    def get_document_stats(self, paths: List[str] = None) -> List[tuple]:
+        return self._client.get_document_stats(paths)
+
+    def insert_documents(self, rows: List[Dict[str, Any]]):
+        return self._client.insert_documents(rows)
+
+    def update_document_stats(self, documents: List[tuple]):
+        return self._client.update_document_stats(documents)
+
+    def delete_documents(self, paths: List[str], recursive: bool = False):
+        return self._client.delete_documents(paths, recursive)
+
+    def move_documents(self, moves: List[tuple]):
+        return self._client.move_documents(moves)
+
+    def get_watched_roots(self) -> List[Dict[str, Any]]:
+        return self._client.get_watched_roots()
+
+    def add_watched_roots(self, paths: List[str], extensions: List[str], embedding_url: str = None):
+        return self._client.add_watched_roots(paths, extensions, embedding_url)
+
+    def remove_watched_roots(self, paths: List[str]):
+        return self._client.remove_watched_roots(paths)
+
     def update_document_processed_status(self, path: str, processed: bool):
         return self._client.update_document_processed_status(path, processed)
     
     def check_if_path_in_chunks_and_delete(self, path: str):
         return self._client.check_if_path_in_chunks_and_delete(path)
 
+    def get_chunk_ids(self, filters: SearchFilters) -> List[int]:
+        return self._client.get_chunk_ids(filters)
+
+    def get_chunks_by_ids(self, ids: List[int]) -> List[tuple]:
+        return self._client.get_chunks_by_ids(ids)
+
+    def get_vector_stats(self) -> Dict[int, tuple]:
+        return self._client.get_vector_stats()
+
+    def iter_chunk_vectors(self, dim: int, batch_size: int = 50000):
+        return self._client.iter_chunk_vectors(dim, batch_size)
+
+    def get_chunk_hashes(self, paths: List[str]) -> Dict[str, Dict[Optional[str], List[int]]]:
+        return self._client.get_chunk_hashes(paths)
+
+    def write_document_chunks(self, paths: List[str], rows: List[Dict[str, Any]], processed_paths: List[str], removed_chunk_ids: List[int] = None,
+                              failed_parts: Dict[str, int] = None):
+        return self._client.write_document_chunks(paths, rows, processed_paths, removed_chunk_ids, failed_parts)
+
 if __name__ == "__main__":
     db_client = DbProxyClient(base="duckdb")
     db_client.create_db_and_tables()
@@ -7,7 +7,8 @@ baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
 
 import logging
 from dotenv import load_dotenv
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from baiss_sdk.db.filters import SearchFilters
 
 
 class BaseDb:
@@ -53,13 +54,17 @@ class BaseDb:
         """
         raise NotImplementedError("Subclasses must implement this method.")
 
-    def insert_rows(self, table: str, rows: List[Dict[str, Any]]):
+    def insert_rows(self, table: str, rows: List[Dict[str, Any]], bulk: bool = True) -> List[int]:
         """
         Insert multiple rows into a specified table.
 
         Args:
             table (str): The name of the table to insert rows into.
             rows (List[Dict[str, Any]]): A list of dictionaries representing the rows to insert.
+            bulk (bool): Use the staged bulk insert path instead of row-by-row inserts.
+
+        Returns:
+            List[int]: The ids of the inserted rows, in input order.
         """
         raise NotImplementedError("Subclasses must implement this method.")
 
@@ -73,12 +78,13 @@ class BaseDb:
         """
         raise NotImplementedError("Subclasses must implement this method.")
 
-    def retrieve_unprocessed_files(self, extensions: List[str]) -> List[tuple]:
+    def retrieve_unprocessed_files(self, extensions: List[str], paths: List[str] = None) -> List[tuple]:
         """
         Retrieve files with specified extensions that have not been processed yet.
 
         Args:
             extensions (List[str]): A list of file extensions to filter by.
+            paths (List[str]): Only retrieve files at or below these paths (all files if None).
 
         Returns:
             List[tuple]: A list of tuples containing the paths and IDs of unprocessed files.
@@ -128,29 +134,110 @@ class BaseDb:
         raise NotImplementedError("Subclasses must implement this method.")
     
 
+    def cursor(self):
+        """
+        Return a client bound to a new cursor of this connection, for use from another thread.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def get_chunks_by_ids(self, ids: List[int]) -> List[tuple]:
+        """
+        Retrieve the content of chunks by id.
+
+        Args:
+            ids (List[int]): The chunk ids.
+
+        Returns:
+            List[tuple]: (chunk_content, path, id, metadata) tuples.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def get_chunk_ids(self, filters: SearchFilters) -> List[int]:
+        """
+        Retrieve the ids of the chunks passing metadata filters.
+
+        Args:
+            filters (SearchFilters): The metadata filters.
+
+        Returns:
+            List[int]: The chunk ids.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def get_vector_stats(self) -> Dict[int, tuple]:
+        """
+        Retrieve the number of stored vectors and the sum of their chunk ids, per embedding dimension.
+
+        Returns:
+            Dict[int, tuple]: {dim: (count, sum of ids)}.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def iter_chunk_vectors(self, dim: int, batch_size: int = 50000):
+        """
+        Stream the normalized chunk vectors of one embedding dimension as (ids, vectors) numpy batches.
+
+        Args:
+            dim (int): The embedding dimension.
+            batch_size (int): Rows per batch.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+
     def setup_extensions(self):
         """Setup required database extensions for similarity search."""
         raise NotImplementedError("Subclasses must implement this method.")
 
     def create_hnsw_index(self, force_recreate=False):
-        """Create HNSW index for vector similarity search."""
+        """Create HNSW index for vector similarity search, or add the vectors missing from it."""
         raise NotImplementedError("Subclasses must implement this method.")
 
     def create_fts_index(self, force_recreate=False):
-        """Create FTS index for text search."""
+        """Validate the BM25 index used for text search, rebuilding it when force_recreate is set."""
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def migrate_indexes(self, batch_size: int = 5000) -> bool:
+        """Run one batch of the pending index migrations, returning False once none is left."""
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def similarity_search_cosine(self, query_embedding: List[float], top_k: int = 5, score_threshold: float = 0.0, filters: SearchFilters = None):
+        """Perform cosine similarity search over the chunks passing the metadata filters."""
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def similarity_search_bm25(self, query: str, top_k: int = 5, score_threshold: float = 0.0, filters: SearchFilters = None):
+        """Perform BM25 text similarity search over the chunks passing the metadata filters."""
         raise NotImplementedError("Subclasses must implement this method.")
 
-    def similarity_search_cosine(self, query_embedding: List[float], top_k: int = 5, score_threshold: float = 0.0):
-        """Perform cosine similarity search."""
+    def rank_cosine(self, query_embedding: List[float], top_k: int = 5, filters: SearchFilters = None) -> List[tuple]:
+        """
+        Rank chunks by cosine similarity without fetching their content.
+
+        Args:
+            query_embedding (List[float]): The query embedding.
+            top_k (int): Number of chunks to rank.
+            filters (SearchFilters): Metadata filters the ranked chunks must pass.
+
+        Returns:
+            List[tuple]: (chunk id, cosine similarity) pairs, best first.
+        """
         raise NotImplementedError("Subclasses must implement this method.")
 
-    def similarity_search_bm25(self, query: str, top_k: int = 5, score_threshold: float = 0.0):
-        """Perform BM25 text similarity search."""
+    def rank_bm25(self, query: str, top_k: int = 5, filters: SearchFilters = None) -> List[tuple]:
+        """
+        Rank chunks by BM25 score without fetching their content.
+
+        Args:
+            query (str): The query text.
+            top_k (int): Number of chunks to rank.
+            filters (SearchFilters): Metadata filters the ranked chunks must pass.
+
+        Returns:
+            List[tuple]: (chunk id, BM25 score) pairs, best first.
+        """
         raise NotImplementedError("Subclasses must implement this method.")
 
     def hybrid_similarity_search(self, query_text: str, query_embedding: List[float], top_k: int = 5, 
-                            k: int = 2, score_threshold: float = 0.0):
-        """Perform hybrid similarity search combining cosine and BM25."""
+                            k: int = 2, score_threshold: float = 0.0, fusion: str = "zscore", filters: SearchFilters = None):
+        """Perform hybrid similarity search combining cosine and BM25 ("zscore" or "rrf" fusion) over the chunks passing the metadata filters."""
         raise NotImplementedError("Subclasses must implement this method.")
     
     def check_if_paths_exists(self, paths: List[str]):
@@ -173,12 +260,89 @@ class BaseDb:
             bool: True if the path exists and the hash matches, False otherwise.
         """
         raise NotImplementedError("Subclasses must implement this method.")
+    def get_cached_embeddings(self, model: str, text_hashes: List[str]) -> Dict[str, List[float]]:
+        """Look up cached embeddings for the given model and chunk text hashes.
+        Args:
+            model (str): The embedding model id.
+            text_hashes (List[str]): Hashes of the chunk texts.
+        Returns:
+            Dict[str, List[float]]: The cached embeddings, keyed by text hash.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+    def put_cached_embeddings(self, model: str, embeddings: Dict[str, List[float]]):
+        """Store embeddings in the embedding cache.
+        Args:
+            model (str): The embedding model id.
+            embeddings (Dict[str, List[float]]): Embeddings keyed by text hash.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+    def evict_embedding_cache(self, max_entries: int) -> int:
+        """Evict the least recently used embedding cache entries beyond max_entries.
+        Args:
+            max_entries (int): The maximum number of entries to keep.
+        Returns:
+            int: The number of evicted entries.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
     def get_all_paths(self) -> List[str]:
         """Get all paths from the BaissDocuments table.
         Returns:
             List[str]: A list of all document paths.
         """
         raise NotImplementedError("Subclasses must implement this method.")
+    def get_document_stats(self, paths: List[str] = None) -> List[tuple]:
+        """Get the stored hash and stat signature of documents.
+        Args:
+            paths (List[str]): Restrict the lookup to these paths (all documents if None).
+        Returns:
+            List[tuple]: (path, hash, size, mtime_ns, inode) tuples.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+    def insert_documents(self, rows: List[Dict[str, Any]]):
+        """Insert document records with a single set-based statement.
+        Args:
+            rows (List[Dict[str, Any]]): BaissDocuments rows; ids are assigned by the database client.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+    def update_document_stats(self, documents: List[tuple]):
+        """Update hashes and stat signatures, marking documents whose hash changed as unprocessed.
+        Args:
+            documents (List[tuple]): (path, hash, size, mtime_ns, inode) tuples.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+    def delete_documents(self, paths: List[str], recursive: bool = False):
+        """Delete documents and their chunks, matching paths exactly.
+        Args:
+            paths (List[str]): The document paths to delete.
+            recursive (bool): Also delete every document below these paths, treating them as folders.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+    def move_documents(self, moves: List[tuple]):
+        """Rename documents (or folders of documents) in place, keeping their chunks.
+        Args:
+            moves (List[tuple]): (source path, destination path, destination depth) tuples.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+    def get_watched_roots(self) -> List[Dict[str, Any]]:
+        """Get the root folders registered for filesystem watching.
+        Returns:
+            List[Dict[str, Any]]: Roots with their path, extensions and embedding_url.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+    def add_watched_roots(self, paths: List[str], extensions: List[str], embedding_url: str = None):
+        """Register (or update) root folders for filesystem watching.
+        Args:
+            paths (List[str]): The root folder paths.
+            extensions (List[str]): The file extensions indexed under these roots.
+            embedding_url (str): The embedding service used to index them.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+    def remove_watched_roots(self, paths: List[str]):
+        """Unregister root folders from filesystem watching.
+        Args:
+            paths (List[str]): The root folder paths.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
     def update_document_processed_status(self, path: str, processed: bool):
         """Update the processed status of a document.
         Args:
@@ -192,4 +356,25 @@ class BaseDb:
         Args:
             path (str): The document path to check and delete chunks for.
         """
-        raise NotImplementedError("Subclasses must implement this method.")
\ No newline at end of file
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def get_chunk_hashes(self, paths: List[str]) -> Dict[str, Dict[Optional[str], List[int]]]:
+        """Get the ids of the stored chunks of documents, grouped by chunk hash.
+        Args:
+            paths (List[str]): The document paths.
+        Returns:
+            Dict[str, Dict[Optional[str], List[int]]]: {path: {chunk_hash: [chunk ids]}}; chunks without a hash are under None.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def write_document_chunks(self, paths: List[str], rows: List[Dict[str, Any]], processed_paths: List[str], removed_chunk_ids: List[int] = None,
+                              failed_parts: Dict[str, int] = None):
+        """Write the chunks of several documents and update their processed status in one transaction.
+        Args:
+            paths (List[str]): Document paths whose existing chunks are all replaced.
+            rows (List[Dict[str, Any]]): The new BaissChunks rows for these documents.
+            processed_paths (List[str]): Document paths to mark as processed.
+            removed_chunk_ids (List[int]): Ids of individual chunks to delete (chunk-level re-ingest).
+            failed_parts (Dict[str, int]): Parts that could not be parsed, by processed path (0 for the others).
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
@@ -0,0 +1,213 @@
+"""
+Micro-benchmarks for the DuckDB storage layer.
+
+Usage:
+    python -m baiss_sdk.db.benchmarks insert --rows 20000 --dim 768
+    python -m baiss_sdk.db.benchmarks search --rows 50000 --dim 768
+    python -m baiss_sdk.db.benchmarks ann --rows 50000 --dim 768 --ef-search 16 32 64 128
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from datetime import datetime
+from typing import Any, Dict, List
+import duckdb
+import numpy as np
+from baiss_sdk.db.duck_db import DuckDb
+
+
+def scratch_db(directory: str) -> DuckDb:
+    """Creates the Baiss tables in a throwaway database (no extensions are loaded)."""
+    db = DuckDb(db_path = os.path.join(directory, "benchmark.duckdb"))
+    db.connection = duckdb.connect(db.db_path)
+    db.create_db_and_tables()
+    return db
+
+
+def make_chunk_rows(count: int, dim: int, baiss_id: int = 1, embeddings: List[List[float]] = None) -> List[Dict[str, Any]]:
+    rows = []
+    for i in range(count):
+        rows.append({
+            "baiss_id": baiss_id,
+            "chunk_content": f"chunk {i} " + "lorem ipsum " * 40,
+            "embedding": embeddings[i] if embeddings is not None else [random.random() for _ in range(dim)],
+            "metadata": {"page_number": i // 10, "token_count": 120},
+            "path": f"/benchmark/document_{baiss_id}.pdf",
+            "keywords": None,
+            "content_type": "pdf",
+            "last_modified": datetime.now()
+        })
+    return rows
+
+
+def benchmark_insert_rows(rows: int = 20000, dim: int = 768, batch_size: int = 2000) -> Dict[str, float]:
+    """
+    Compares BaissChunks insert throughput (rows/s) of the executemany path and the staged bulk path.
+    Returns:
+        Dict[str, float]: rows per second for each mode.
+    """
+    results = {}
+    for mode, bulk in [("executemany", False), ("bulk", True)]:
+        with tempfile.TemporaryDirectory() as directory:
+            db = scratch_db(directory)
+            db.insert_rows("BaissDocuments", [{"path": "/benchmark/document_1.pdf", "type": "file"}])
+            batches = [make_chunk_rows(min(batch_size, rows - start), dim) for start in range(0, rows, batch_size)]
+            started = time.perf_counter()
+            for batch in batches:
+                db.insert_rows("BaissChunks", batch, bulk = bulk)
+            elapsed = time.perf_counter() - started
+            inserted = db.connection.execute("SELECT COUNT(*) FROM BaissChunks").fetchone()[0]
+            db.disconnect()
+        results[mode] = inserted / elapsed if elapsed else float("inf")
+        print(f"{mode:>12}: {inserted} rows in {elapsed:.2f}s -> {results[mode]:.0f} rows/s")
+    print(f"{'speedup':>12}: x{results['bulk'] / results['executemany']:.1f}")
+    return results
+
+
+def make_clustered_embeddings(count: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """Gaussian clusters: closer to real embeddings than uniform noise, where every neighbour is equally far."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size = (clusters, dim))
+    points = centers[rng.integers(0, clusters, count)] + 0.5 * rng.normal(size = (count, dim))
+    return points.astype(np.float32)
+
+
+def time_searches(db: DuckDb, probes: List[List[float]], top_k: int) -> tuple:
+    """Runs similarity_search_cosine for every probe. Returns (p50 ms, p95 ms, [set of result ids per probe])."""
+    latencies, results = [], []
+    for probe in probes:
+        started = time.perf_counter()
+        found = db.similarity_search_cosine(probe, top_k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append({row[3] for row in found})
+    return np.percentile(latencies, 50), np.percentile(latencies, 95), results
+
+
+def benchmark_search(rows: int = 20000, dim: int = 768, queries: int = 50, top_k: int = 10,
+                     batch_size: int = 5000) -> Dict[str, float]:
+    """
+    Exact cosine search latency before and after the migration to fixed-width, normalized vectors:
+    FLOAT[] cast and cosine over BaissChunks vs inner product over BaissChunkVectors{dim}.
+    Returns:
+        Dict[str, float]: p50/p95 latencies (ms) of both query paths and the migration time (s).
+    """
+    embeddings = make_clustered_embeddings(rows, dim)
+    rng = np.random.default_rng(1)
+    probes = [probe.tolist() for probe in embeddings[rng.integers(0, rows, queries)]]
+    with tempfile.TemporaryDirectory() as directory:
+        db = scratch_db(directory)
+        db.insert_rows("BaissDocuments", [{"path": "/benchmark/document_1.pdf", "type": "file"}])
+        for start in range(0, rows, batch_size):
+            batch = embeddings[start:start + batch_size].tolist()
+            db.insert_rows("BaissChunks", make_chunk_rows(len(batch), dim, embeddings = batch))
+        # Back to the layout of a database written before the vector tables existed
+        db.connection.execute(f"DROP TABLE {db._vector_table(dim)}")
+        db.connection.execute("DELETE FROM BaissVectorTables")
+        db._register_vector_migrations()
+
+        before_p50, before_p95, before = time_searches(db, probes, top_k)
+        started = time.perf_counter()
+        while db.migrate_indexes(batch_size):
+            pass
+        migration = time.perf_counter() - started
+        after_p50, after_p95, after = time_searches(db, probes, top_k)
+        db.disconnect()
+
+    same = float(np.mean([len(a & b) / max(1, len(b)) for a, b in zip(after, before)]))
+    print(f"migration of {rows} x {dim} embeddings: {migration:.2f}s")
+    print(f"{'before':>8} (FLOAT[] cast + cosine): p50 {before_p50:8.2f} ms  p95 {before_p95:8.2f} ms")
+    print(f"{'after':>8} (FLOAT[{dim}] inner product): p50 {after_p50:8.2f} ms  p95 {after_p95:8.2f} ms")
+    print(f"{'speedup':>8}: x{before_p50 / after_p50:.1f}, identical top-{top_k}: {same:.3f}")
+    return {"before_p50_ms": before_p50, "before_p95_ms": before_p95, "after_p50_ms": after_p50,
+            "after_p95_ms": after_p95, "migration_s": migration}
+
+
+def benchmark_ann(rows: int = 20000, dim: int = 768, queries: int = 100, top_k: int = 10,
+                  m: int = 16, ef_construction: int = 128, ef_search: List[int] = (16, 32, 64, 128, 256),
+                  batch_size: int = 5000) -> List[Dict[str, float]]:
+    """
+    Recall-vs-latency report of similarity_search_cosine with the HNSW index against the exact scan.
+    Recall is the fraction of the exact top_k ids returned by the index, averaged over the queries.
+    The plan of the ranking query is checked for the HNSW_INDEX_SCAN of vss.
+    Returns:
+        List[Dict[str, float]]: One entry for the exact scan and one per ef_search value.
+    """
+    report = []
+    embeddings = make_clustered_embeddings(rows, dim)
+    rng = np.random.default_rng(1)
+    probes = embeddings[rng.integers(0, rows, queries)] + 0.25 * rng.normal(size = (queries, dim)).astype(np.float32)
+    probes = [probe.tolist() for probe in probes]
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = scratch_db(directory)
+        db.hnsw_m, db.hnsw_ef_construction = m, ef_construction
+        db.connection.execute("INSTALL vss;")
+        db.connection.execute("LOAD vss;")
+        db.connection.execute("SET hnsw_enable_experimental_persistence = true;")
+        db.insert_rows("BaissDocuments", [{"path": "/benchmark/document_1.pdf", "type": "file"}])
+        for start in range(0, rows, batch_size):
+            batch = embeddings[start:start + batch_size].tolist()
+            db.insert_rows("BaissChunks", make_chunk_rows(len(batch), dim, embeddings = batch))
+
+        p50, p95, exact = time_searches(db, probes, top_k)
+        report.append({"mode": "exact", "ef_search": None, "recall": 1.0, "p50_ms": p50, "p95_ms": p95})
+
+        started = time.perf_counter()
+        db.create_hnsw_index()
+        build_seconds = time.perf_counter() - started
+        print(f"HNSW build (M={m}, ef_construction={ef_construction}) over {rows} x {dim}: {build_seconds:.2f}s")
+        # vss only answers the ranking from the index if its optimizer rewrites the bound query vector
+        ranking, params = db._cosine_ranking(probes[0])
+        plan = "\n".join(row[1] for row in db.connection.execute(f"EXPLAIN {ranking}", params + [top_k]).fetchall())
+        print(f"ranking plan uses HNSW_INDEX_SCAN: {'HNSW_INDEX_SCAN' in plan}")
+
+        for ef in ef_search:
+            db.connection.execute(f"SET hnsw_ef_search = {int(ef)};")
+            p50, p95, found = time_searches(db, probes, top_k)
+            recall = float(np.mean([len(ids & truth) / max(1, len(truth)) for ids, truth in zip(found, exact)]))
+            report.append({"mode": "hnsw", "ef_search": ef, "recall": recall, "p50_ms": p50, "p95_ms": p95})
+        db.disconnect()
+
+    print(f"{'mode':>6} {'ef_search':>10} {'recall@' + str(top_k):>10} {'p50 ms':>9} {'p95 ms':>9}")
+    for entry in report:
+        print(f"{entry['mode']:>6} {entry['ef_search'] or '-':>10} {entry['recall']:>10.3f} {entry['p50_ms']:>9.2f} {entry['p95_ms']:>9.2f}")
+    return report
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description = "Baiss storage micro-benchmarks")
+    subparsers = parser.add_subparsers(dest = "benchmark", required = True)
+    insert = subparsers.add_parser("insert", help = "insert_rows throughput")
+    insert.add_argument("--rows", type = int, default = 20000)
+    insert.add_argument("--dim", type = int, default = 768)
+    insert.add_argument("--batch-size", type = int, default = 2000)
+    search = subparsers.add_parser("search", help = "exact search latency before/after the fixed-width vector migration")
+    search.add_argument("--rows", type = int, default = 20000)
+    search.add_argument("--dim", type = int, default = 768)
+    search.add_argument("--queries", type = int, default = 50)
+    search.add_argument("--top-k", type = int, default = 10)
+    ann = subparsers.add_parser("ann", help = "HNSW recall vs latency against the exact scan")
+    ann.add_argument("--rows", type = int, default = 20000)
+    ann.add_argument("--dim", type = int, default = 768)
+    ann.add_argument("--queries", type = int, default = 100)
+    ann.add_argument("--top-k", type = int, default = 10)
+    ann.add_argument("--m", type = int, default = 16)
+    ann.add_argument("--ef-construction", type = int, default = 128)
+    ann.add_argument("--ef-search", type = int, nargs = "+", default = [16, 32, 64, 128, 256])
+    args = parser.parse_args(argv)
+    if args.benchmark == "insert":
+        benchmark_insert_rows(rows = args.rows, dim = args.dim, batch_size = args.batch_size)
+    elif args.benchmark == "search":
+        benchmark_search(rows = args.rows, dim = args.dim, queries = args.queries, top_k = args.top_k)
+    elif args.benchmark == "ann":
+        benchmark_ann(rows = args.rows, dim = args.dim, queries = args.queries, top_k = args.top_k,
+                      m = args.m, ef_construction = args.ef_construction, ef_search = args.ef_search)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
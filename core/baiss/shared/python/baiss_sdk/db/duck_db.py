@@ -7,19 +7,56 @@ baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
 
 import logging
 from dotenv import load_dotenv
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from contextlib import contextmanager
 from baiss_sdk.db.base_db import BaseDb
+from baiss_sdk.db.vector_store import get_vector_store
+from baiss_sdk.db.fusion import fused_search
+from baiss_sdk.db.filters import SearchFilters
+from baiss_sdk.db.generation import bump_index_generation, index_generation
 from baiss_sdk import get_baiss_project_path
+import json
+import copy
 import duckdb
+import pandas as pd
 import uuid
 import time
 import math
+import threading
+import numpy as np
+
+# Write transactions of the process run one at a time: the background index migrations and the
+# chunk writes update the same rows (e.g. BaissTerms), and DuckDB aborts one of two transactions
+# writing the same row
+_write_lock = threading.RLock()
+
 class DuckDb(BaseDb):
     def __init__(self, db_path: str, **kwargs):
         super().__init__()
         self.db_path = db_path
         self.connection = None
         self.embedding_dim = None 
+        # Cached (column name, column type) pairs per table, reset on schema changes
+        self._table_columns = {}
+        self._in_transaction = False
+        # HNSW index settings (vss); M and ef_construction only apply when the index is (re)built
+        self.hnsw_m               = kwargs.get("hnsw_m", 16)
+        self.hnsw_ef_construction = kwargs.get("hnsw_ef_construction", 128)
+        self.hnsw_ef_search       = kwargs.get("hnsw_ef_search", 64)
+        # BM25 parameters of similarity_search_bm25
+        self.bm25_k1              = kwargs.get("bm25_k1", 1.2)
+        self.bm25_b               = kwargs.get("bm25_b", 0.75)
+        # Registered BaissChunkVectors tables, {dim: migration complete}, cached for an index generation
+        self._vector_tables = None
+        self._vector_tables_generation = None
+        # Vectors deleted per dimension since the HNSW index was built or compacted
+        self._vector_deletes: Dict[int, int] = {}
+        # Changes for the memmap vector store, applied once the transaction commits
+        self._vector_events: List[tuple] = []
+        # Searchable chunks changed in the current transaction, see generation.py
+        self._index_changed = False
+        # True for the clients returned by cursor()
+        self._is_cursor = False
 
 
     def connect(self):
@@ -51,14 +88,22 @@ class DuckDb(BaseDb):
             columns_info = self.connection.execute("DESCRIBE BaissDocuments").fetchall()
             existing_columns = [col[0] for col in columns_info]
 
+            # Set when the database was last written by an older version
+            migrated = False
+
             # 2. Define the new column(s) you want to add
             new_columns = [
                 ("processed", "BOOLEAN DEFAULT FALSE"),
+                ("size", "BIGINT"),
+                ("mtime_ns", "BIGINT"),
+                ("inode", "UBIGINT"),
+                ("failed_parts", "INTEGER DEFAULT 0"),
             ]
 
             for col_name, col_def in new_columns:
                 if col_name not in existing_columns:
                     logging.info(f"Migrating schema: Adding column '{col_name}' to BaissDocuments")
+                    migrated = True
                     
                     # Wrap in transaction for safety
                     self.connection.execute("BEGIN TRANSACTION;")
@@ -69,6 +114,32 @@ class DuckDb(BaseDb):
                     except Exception as e:
                         self.connection.execute("ROLLBACK;")
                         raise e
+
+            # 3. Columns added to BaissChunks
+            chunk_columns = [col[0] for col in self.connection.execute("DESCRIBE BaissChunks").fetchall()]
+            for col_name, col_def in [("chunk_hash", "TEXT"), ("embedding_model", "TEXT")]:
+                if col_name not in chunk_columns:
+                    logging.info(f"Migrating schema: Adding column '{col_name}' to BaissChunks")
+                    migrated = True
+                    self.connection.execute(f"ALTER TABLE BaissChunks ADD COLUMN {col_name} {col_def}")
+
+            # 4. Tables introduced after the initial schema
+            tables = {name for (name,) in self.connection.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+            self._create_embedding_cache_table()
+            self._create_watched_roots_table()
+            self._create_vector_tables_registry()
+            self._create_index_migrations_table()
+            self._create_bm25_tables()
+            # Existing sequences are only checked against their tables after an upgrade
+            self._create_id_sequences(check_existing = migrated)
+            self._table_columns = {}
+
+            # 5. Indexes of the chunks written before they existed: only registered here, they are
+            # built in the background (see migrate_indexes) while searches scan BaissChunks
+            if "BaissVectorTables" not in tables:
+                self._register_vector_migrations()
+            if "BaissChunkLengths" not in tables:
+                self._register_index_migration("bm25")
                         
         except Exception as e:
             logging.error(f"Schema migration failed: {e}")
@@ -77,9 +148,34 @@ class DuckDb(BaseDb):
     def disconnect(self):
         """Disconnect from the DuckDB database."""
         if self.connection:
+            if self._vector_tables and not self._is_cursor:
+                # An empty WAL is never replayed before vss is loaded, which HNSW indexes require
+                try:
+                    self.connection.execute("CHECKPOINT;")
+                except Exception as e:
+                    logging.warning(f"Failed to checkpoint before disconnecting: {e}")
             self.connection.close()
             logging.info("Disconnected from DuckDB database")
             self.connection = None
+            self._table_columns = {}
+            self._vector_tables = None
+
+    def cursor(self) -> "DuckDb":
+        """
+        Return a client bound to a new cursor of this connection, for use from another thread.
+        Extensions and schema are not checked again; close it with disconnect(), which leaves
+        this connection open.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        client = copy.copy(self)
+        client.connection = self.connection.cursor()
+        client._table_columns = {}
+        client._in_transaction = False
+        client._vector_events = []
+        client._index_changed = False
+        client._is_cursor = True
+        return client
 
     def execute_query(self, query: str) -> Any:
         """
@@ -144,7 +240,11 @@ class DuckDb(BaseDb):
                     keywords JSON,
                     content_type TEXT,
                     last_modified TIMESTAMP,
-                    processed BOOLEAN DEFAULT FALSE
+                    processed BOOLEAN DEFAULT FALSE,
+                    size BIGINT,
+                    mtime_ns BIGINT,
+                    inode UBIGINT,
+                    failed_parts INTEGER DEFAULT 0
                 )
             """)
             self.execute_query("""
@@ -158,14 +258,130 @@ class DuckDb(BaseDb):
                     keywords JSON,
                     content_type TEXT,
                     last_modified TIMESTAMP,
+                    chunk_hash TEXT,
+                    embedding_model TEXT,
                     FOREIGN KEY (baiss_id) REFERENCES BaissDocuments(id)
                 )
             """)
+            self._create_embedding_cache_table()
+            self._create_watched_roots_table()
+            self._create_vector_tables_registry()
+            self._create_index_migrations_table()
+            self._create_bm25_tables()
+            self._create_id_sequences()
+            self._table_columns = {}
 
             logging.info("Database and tables created or verified successfully.")
         except Exception as e:
             raise ValueError(f"Failed to create database and tables: {e}")
 
+    def _create_embedding_cache_table(self):
+        """Create the content-addressed embedding cache, keyed by (model, text_hash)."""
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS BaissEmbeddingCache (
+                model TEXT,
+                text_hash TEXT,
+                embedding FLOAT[],
+                last_used TIMESTAMP,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+
+    def _create_watched_roots_table(self):
+        """Create the table of root folders kept fresh by the filesystem watcher."""
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS BaissWatchedRoots (
+                path TEXT PRIMARY KEY,
+                extensions JSON,
+                embedding_url TEXT
+            )
+        """)
+
+    def _create_vector_tables_registry(self):
+        """Create the registry of the fixed-width vector tables, with the embedding model of their vectors."""
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS BaissVectorTables (
+                dim INTEGER PRIMARY KEY,
+                model TEXT
+            )
+        """)
+
+    def _create_index_migrations_table(self):
+        """
+        Create the table of the pending index migrations: 'vectors768' copies the embeddings of
+        the chunks written before the BaissChunkVectors768 table existed, 'bm25' adds the chunks
+        written before the BM25 inverted index existed to it. Chunks up to target_id
+        are migrated in id order and migrated_id records the progress; the row is deleted once done.
+        """
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS BaissIndexMigrations (
+                name TEXT PRIMARY KEY,
+                migrated_id BIGINT,
+                target_id BIGINT
+            )
+        """)
+
+    def _create_bm25_tables(self):
+        """
+        Create the BM25 inverted index: the vocabulary with the document frequency of every
+        term, the postings (term, chunk, term frequency, chunk length) and the token count of
+        every indexed chunk. baiss_tokenize splits text the same way for chunks and queries.
+        """
+        self.connection.execute(r"""
+            CREATE MACRO IF NOT EXISTS baiss_tokenize(text) AS
+            list_filter(regexp_split_to_array(lower(text), '[^\p{L}\p{N}]+'), lambda token: token <> '')
+        """)
+        self.connection.execute("CREATE SEQUENCE IF NOT EXISTS BaissTerms_id_seq START WITH 1")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS BaissTerms (
+                term TEXT PRIMARY KEY,
+                id BIGINT,
+                df BIGINT
+            )
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS BaissPostings (
+                term_id BIGINT,
+                chunk_id BIGINT,
+                tf INTEGER,
+                length INTEGER
+            )
+        """)
+        # Searches look up the postings of a few terms
+        self.connection.execute("CREATE INDEX IF NOT EXISTS BaissPostings_term_idx ON BaissPostings (term_id)")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS BaissChunkLengths (
+                chunk_id BIGINT,
+                length INTEGER
+            )
+        """)
+
+    def _create_id_sequences(self, check_existing: bool = False):
+        """
+        Create the sequences that allocate row ids, starting after the current maximum id.
+        Args:
+            check_existing (bool): Also recreate the sequences that fell behind their table (rows
+                written by an older version), for schema migrations. The next value of a sequence
+                is read from duckdb_sequences(), so checking it does not draw one.
+        """
+        tables = ["BaissDocuments", "BaissChunks"]
+        # A sequence loaded from disk starts at start_value; within the session last_value is the last value drawn
+        next_values = dict(self.connection.execute(
+            "SELECT sequence_name, greatest(start_value, coalesce(last_value, start_value)) FROM duckdb_sequences() "
+            "WHERE sequence_name IN (SELECT unnest(?::TEXT[]))",
+            [[f"{table}_id_seq" for table in tables]]
+        ).fetchall())
+        for table in tables:
+            sequence = f"{table}_id_seq"
+            if sequence in next_values and not check_existing:
+                continue
+            start = self._get_next_id(table)
+            if sequence in next_values:
+                if next_values[sequence] >= start:
+                    continue
+                self.connection.execute(f"DROP SEQUENCE {sequence}")
+            self.connection.execute(f"CREATE SEQUENCE {sequence} START WITH {start}")
+
     def _get_next_id(self, table: str) -> int:
         """Get the next available ID for the table."""
         try:
@@ -176,11 +392,379 @@ class DuckDb(BaseDb):
             # If table doesn't exist or is empty, start from 1
             return 1
 
-    def insert_rows(self, table: str, rows: List[Dict[str, Any]]):
+    def _allocate_ids(self, table: str, count: int) -> List[int]:
+        """Reserve count ids from the table sequence."""
+        result = self.connection.execute(
+            f"SELECT nextval('{table}_id_seq') FROM range(?)", [count]
+        ).fetchall()
+        return [row[0] for row in result]
+
+    def _get_table_columns(self, table: str) -> List[tuple]:
+        """Get the (column name, column type) pairs of a table, cached until the schema changes."""
+        columns = self._table_columns.get(table)
+        if columns is None:
+            column_info = self.connection.execute(f"DESCRIBE {table}").fetchall()
+            columns = [(col[0], col[1]) for col in column_info]
+            self._table_columns[table] = columns
+        return columns
+
+    @contextmanager
+    def _transaction(self):
+        """Run the enclosed statements in a transaction, joining the enclosing one if any."""
+        if self._in_transaction:
+            yield
+            return
+        with _write_lock:
+            self.connection.execute("BEGIN TRANSACTION;")
+            self._in_transaction = True
+            try:
+                yield
+                self.connection.execute("COMMIT;")
+            except BaseException:
+                self.connection.execute("ROLLBACK;")
+                self._vector_events = []
+                self._index_changed = False
+                raise
+            finally:
+                self._in_transaction = False
+        self._flush_vector_events()
+        self._publish_index_change()
+
+    def _queue_vector_event(self, *event):
+        """Queue an ("add", dim, ids, vectors) or ("remove", ids) change for the memmap vector store."""
+        self._vector_events.append(event)
+        if not self._in_transaction:
+            self._flush_vector_events()
+
+    def _mark_index_changed(self):
+        """Bump the index generation, invalidating cached search results, once the transaction commits."""
+        self._index_changed = True
+        if not self._in_transaction:
+            self._publish_index_change()
+
+    def _publish_index_change(self):
+        if self._index_changed:
+            self._index_changed = False
+            bump_index_generation()
+
+    def _flush_vector_events(self):
+        events, self._vector_events = self._vector_events, []
+        store = get_vector_store()
+        if store is None:
+            return
+        for event in events:
+            try:
+                if event[0] == "add":
+                    store.add(*event[1:])
+                else:
+                    store.remove(event[1])
+            except Exception as e:
+                # The store is rebuilt from the vector tables on the next open
+                logging.error(f"Failed to update the memmap vector store: {e}")
+
+    @staticmethod
+    def _vector_table(dim: int) -> str:
+        return f"BaissChunkVectors{dim}"
+
+    @staticmethod
+    def _normalized_vectors(dim: int, condition: str) -> str:
+        """SELECT of (id, L2-normalized FLOAT[dim] embedding) for the chunks matching condition."""
+        return f"""
+            SELECT id, list_transform(embedding, lambda x: x / norm)::FLOAT[{dim}]
+            FROM (
+                SELECT id, embedding, sqrt(list_dot_product(embedding, embedding)) AS norm
+                FROM BaissChunks WHERE {condition}
+            )
+            WHERE len(embedding) = {dim} AND norm > 0
+        """
+
+    def _get_vector_tables(self) -> Dict[int, bool]:
+        """
+        Get the registered vector tables as {dim: migration complete}, cached until the registry
+        changes or the index generation moves (writes and completed migrations of any client).
+        """
+        generation = index_generation()
+        if self._vector_tables is None or self._vector_tables_generation != generation:
+            self._vector_tables = dict(self.connection.execute("""
+                SELECT v.dim, m.name IS NULL FROM BaissVectorTables v
+                LEFT JOIN BaissIndexMigrations m ON m.name = 'vectors' || v.dim
+            """).fetchall())
+            self._vector_tables_generation = generation
+        return self._vector_tables
+
+    def _create_vector_table(self, dim: int):
+        """Create and register the fixed-width FLOAT[dim] table of the normalized chunk embeddings of this dimension."""
+        self.connection.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self._vector_table(dim)} (
+                id BIGINT,
+                embedding FLOAT[{dim}]
+            )
+        """)
+        self.connection.execute("INSERT OR IGNORE INTO BaissVectorTables VALUES (?, NULL)", [dim])
+        self._vector_tables = None
+
+    def _check_vector_model(self, dim: int, models: set):
+        """
+        Record the embedding model of a vector table with its first vectors, and refuse the vectors
+        of another model while it holds any: embeddings of two models of the same dimension do not compare.
+        Raises:
+            ValueError: If models holds another model than the one of the table.
+        """
+        if not models:
+            # Chunks written before the model was recorded
+            return
+        if len(models) > 1:
+            raise ValueError(f"Chunks embedded by several models ({', '.join(sorted(models))}) cannot share the {dim}-dimension vector table.")
+        model = next(iter(models))
+        registered = self.connection.execute("SELECT model FROM BaissVectorTables WHERE dim = ?", [dim]).fetchone()[0]
+        if registered == model:
+            return
+        empty = self.connection.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {self._vector_table(dim)})").fetchone()[0]
+        if registered is None or empty:
+            self.connection.execute("UPDATE BaissVectorTables SET model = ? WHERE dim = ?", [model, dim])
+        else:
+            raise ValueError(
+                f"Chunks embedded by {model} cannot be mixed with the {dim}-dimension vectors of {registered}: "
+                f"delete the documents embedded by {registered} first."
+            )
+
+    def _register_index_migration(self, name: str):
+        """Register the migration of the chunks written so far to an index (see migrate_indexes)."""
+        target = self.connection.execute("SELECT max(id) FROM BaissChunks").fetchone()[0]
+        if target is not None:
+            self.connection.execute("INSERT OR REPLACE INTO BaissIndexMigrations VALUES (?, -1, ?)", [name, target])
+        self._vector_tables = None
+
+    def _create_vector_index(self, dim: int, force_recreate: bool = False):
+        """Build the HNSW index of a vector table, or compact it after many deletes."""
+        table = self._vector_table(dim)
+        index = f"{table}_hnsw"
+        exists = self.connection.execute(
+            "SELECT COUNT(*) FROM duckdb_indexes() WHERE index_name = ?", [index]
+        ).fetchone()[0]
+        if exists and not force_recreate:
+            deletes = self._vector_deletes.get(dim, 0)
+            count = self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            if deletes > max(1000, count // 10):
+                # Deleted vectors are only marked in the graph until it is compacted
+                self.connection.execute(f"PRAGMA hnsw_compact_index('{index}');")
+                self._vector_deletes[dim] = 0
+                logging.info(f"Compacted HNSW index {index} after {deletes} deletes")
+            return
+        if exists:
+            self.connection.execute(f"DROP INDEX {index};")
+        start_time = time.time()
+        # Vectors are unit length, so the inner product ranks like cosine similarity
+        self.connection.execute(f"""
+            CREATE INDEX {index} ON {table}
+            USING HNSW (embedding)
+            WITH (metric = 'ip', M = {int(self.hnsw_m)}, ef_construction = {int(self.hnsw_ef_construction)}, ef_search = {int(self.hnsw_ef_search)});
+        """)
+        self._vector_deletes[dim] = 0
+        logging.info(f"Built HNSW index {index} (M={self.hnsw_m}, ef_construction={self.hnsw_ef_construction}) in {time.time() - start_time:.2f} seconds")
+
+    def _index_chunk_vectors(self, ids: List[int]) -> int:
+        """
+        Write the normalized embeddings of newly written chunks into the vector tables,
+        registering a table for each dimension seen for the first time. Chunks that a pending
+        migration of the table copies (see migrate_indexes) are left to it.
+        Raises:
+            ValueError: If chunks of another embedding model would be mixed into a vector table.
+        Returns:
+            int: The number of vectors added.
+        """
+        if not ids:
+            return 0
+        condition = "embedding IS NOT NULL AND id IN (SELECT unnest(?::BIGINT[]))"
+        params = [list(ids)]
+        models: Dict[int, set] = {}
+        for dim, model in self.connection.execute(
+            f"SELECT DISTINCT len(embedding), embedding_model FROM BaissChunks WHERE {condition}", params
+        ).fetchall():
+            models.setdefault(dim, set()).add(model)
+        added = 0
+        for dim, dim_models in models.items():
+            if dim not in self._get_vector_tables():
+                # First chunks of another embedding model
+                self._create_vector_table(dim)
+            self._check_vector_model(dim, dim_models - {None})
+            pending = self.connection.execute(
+                "SELECT migrated_id, target_id FROM BaissIndexMigrations WHERE name = ?", [f"vectors{dim}"]
+            ).fetchone()
+            if pending is not None:
+                added += self.connection.execute(
+                    f"INSERT INTO {self._vector_table(dim)} {self._normalized_vectors(dim, condition + ' AND NOT (id > ? AND id <= ?)')}",
+                    params + list(pending)
+                ).fetchone()[0]
+                # The matrix of the memmap vector store is built once the migration is complete
+                continue
+            added += self.connection.execute(
+                f"INSERT INTO {self._vector_table(dim)} {self._normalized_vectors(dim, condition)}", params
+            ).fetchone()[0]
+            if get_vector_store() is not None:
+                result = self.connection.execute(
+                    f"SELECT id, embedding FROM {self._vector_table(dim)} WHERE id IN (SELECT unnest(?::BIGINT[]))", params
+                ).fetchnumpy()
+                if len(result["id"]):
+                    self._queue_vector_event("add", dim, result["id"], np.stack(result["embedding"]))
+        return added
+
+    def _register_vector_migrations(self):
+        """
+        Register a vector table, and the migration copying the embeddings written so far into it,
+        for every embedding dimension of a database written before the vector tables existed.
+        Tables from before the vectors were normalized are not registered: they are rebuilt.
+        """
+        registered = self._get_vector_tables()
+        for (table,) in self.connection.execute(
+            "SELECT table_name FROM duckdb_tables() WHERE starts_with(table_name, 'BaissChunkVectors')"
+        ).fetchall():
+            if int(table[len("BaissChunkVectors"):]) not in registered:
+                self.connection.execute(f"DROP TABLE {table}")
+        for (dim,) in self.connection.execute(
+            "SELECT DISTINCT len(embedding) FROM BaissChunks WHERE embedding IS NOT NULL"
+        ).fetchall():
+            if dim not in registered:
+                self._create_vector_table(dim)
+                self._register_index_migration(f"vectors{dim}")
+
+    def migrate_indexes(self, batch_size: int = 5000) -> bool:
+        """
+        Runs one batch of the pending index migrations, which copy the chunks written before an
+        index existed into it. Each batch commits on its own and records its progress, so an
+        interrupted migration resumes where it stopped, and chunk writes go on between batches
+        (they index the chunks written since the migration was registered themselves). Searches
+        keep scanning BaissChunks for an index until its migration is complete.
+        Args:
+            batch_size (int): Chunks per batch.
+        Returns:
+            bool: Whether a batch ran, False once no migration is left.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        pending = self.connection.execute(
+            "SELECT name, migrated_id, target_id FROM BaissIndexMigrations ORDER BY name LIMIT 1"
+        ).fetchone()
+        if pending is None:
+            return False
+        name, lower, target = pending
+        upper = self.connection.execute(
+            "SELECT max(id) FROM (SELECT id FROM BaissChunks WHERE id > ? AND id <= ? ORDER BY id LIMIT ?)",
+            [lower, target, int(batch_size)]
+        ).fetchone()[0]
+        if upper is None:
+            # Writes wait for the matrix of the memmap vector store, which they add to from now on
+            with _write_lock:
+                with self._transaction():
+                    self.connection.execute("DELETE FROM BaissIndexMigrations WHERE name = ?", [name])
+                    # Searches switch to the index
+                    self._mark_index_changed()
+                self._vector_tables = None
+                store = get_vector_store()
+                if store is not None:
+                    store.open(self)
+            logging.info(f"Index migration {name} is complete")
+            return True
+        with self._transaction():
+            if name == "bm25":
+                migrated = self._index_chunk_terms("id > ? AND id <= ?", [lower, upper])
+            else:
+                dim = int(name[len("vectors"):])
+                migrated = self.connection.execute(
+                    f"INSERT INTO {self._vector_table(dim)} {self._normalized_vectors(dim, 'embedding IS NOT NULL AND id > ? AND id <= ?')}",
+                    [lower, upper]
+                ).fetchone()[0]
+            self.connection.execute("UPDATE BaissIndexMigrations SET migrated_id = ? WHERE name = ?", [upper, name])
+        logging.info(f"Index migration {name}: {migrated} rows up to chunk id {upper} of {target}")
+        return True
+
+    @staticmethod
+    def _chunk_terms(condition: str) -> str:
+        """SELECT of (chunk_id, term, tf) for the chunks matching condition."""
+        return f"""
+            SELECT chunk_id, term, count(*) AS tf
+            FROM (
+                SELECT id AS chunk_id, unnest(baiss_tokenize(chunk_content)) AS term
+                FROM BaissChunks WHERE {condition}
+            )
+            GROUP BY chunk_id, term
+        """
+
+    def _index_chunk_terms(self, condition: str, params: List[Any] = None) -> int:
+        """
+        Add the chunks matching condition to the BM25 inverted index: their token counts,
+        the document frequency of their terms (new terms get an id) and their postings.
+        Returns:
+            int: The number of postings added.
+        """
+        params = params or []
+        self.connection.execute(f"""
+            INSERT INTO BaissChunkLengths
+            SELECT id, coalesce(len(baiss_tokenize(chunk_content)), 0) FROM BaissChunks WHERE {condition}
+        """, params)
+        self.connection.execute(f"""
+            INSERT INTO BaissTerms
+            SELECT term, nextval('BaissTerms_id_seq'), count(*) FROM ({self._chunk_terms(condition)}) GROUP BY term
+            ON CONFLICT (term) DO UPDATE SET df = BaissTerms.df + EXCLUDED.df
+        """, params)
+        return self.connection.execute(f"""
+            INSERT INTO BaissPostings
+            SELECT t.id, ct.chunk_id, ct.tf, sum(ct.tf) OVER (PARTITION BY ct.chunk_id)
+            FROM ({self._chunk_terms(condition)}) ct
+            JOIN BaissTerms t ON t.term = ct.term
+        """, params).fetchone()[0]
+
+    def _unindex_chunk_terms(self, condition: str, params: List[Any] = None):
+        """
+        Remove the chunks matching condition from the BM25 inverted index. Terms whose
+        document frequency drops to zero are deleted, so the vocabulary does not grow with
+        every term ever indexed. Runs in the caller's transaction.
+        """
+        params = params or []
+        chunk_ids = f"SELECT id FROM BaissChunks WHERE {condition}"
+        self.connection.execute(f"""
+            UPDATE BaissTerms SET df = BaissTerms.df - removed.df
+            FROM (
+                SELECT term_id, count(*) AS df FROM BaissPostings
+                WHERE chunk_id IN ({chunk_ids}) GROUP BY term_id
+            ) removed
+            WHERE BaissTerms.id = removed.term_id
+        """, params)
+        self.connection.execute(f"DELETE FROM BaissPostings WHERE chunk_id IN ({chunk_ids})", params)
+        self.connection.execute(f"DELETE FROM BaissChunkLengths WHERE chunk_id IN ({chunk_ids})", params)
+        self.connection.execute("DELETE FROM BaissTerms WHERE df <= 0")
+
+    def _delete_chunks(self, condition: str, params: List[Any] = None) -> int:
+        """Delete the BaissChunks rows matching condition together with their vectors and postings.
+        Returns:
+            int: The number of deleted chunks.
+        """
+        ids = None
+        if get_vector_store() is not None:
+            ids = [row[0] for row in self.connection.execute(f"SELECT id FROM BaissChunks WHERE {condition}", params).fetchall()]
+        with self._transaction():
+            for dim in self._get_vector_tables():
+                deleted = self.connection.execute(
+                    f"DELETE FROM {self._vector_table(dim)} WHERE id IN (SELECT id FROM BaissChunks WHERE {condition})", params
+                ).fetchone()[0]
+                self._vector_deletes[dim] = self._vector_deletes.get(dim, 0) + deleted
+            self._unindex_chunk_terms(condition, params)
+            deleted = self.connection.execute(f"DELETE FROM BaissChunks WHERE {condition}", params).fetchone()[0]
+            if deleted:
+                self._mark_index_changed()
+            if ids:
+                self._queue_vector_event("remove", ids)
+        return deleted
+
+    def insert_rows(self, table: str, rows: List[Dict[str, Any]], bulk: bool = True) -> List[int]:
         """Insert multiple rows into the specified table.
         Args:
             table (str): The name of the table to insert rows into.
             rows (List[Dict[str, Any]]): A list of dictionaries representing the rows to insert.
+            bulk (bool): Stage the rows as a DataFrame and insert them with one INSERT ... SELECT.
+                When False, rows are inserted with executemany.
+        Returns:
+            List[int]: The ids of the inserted rows, in input order.
         Raises:
             ValueError: If the table name is not supported or if insertion fails.
         """
@@ -192,36 +776,56 @@ class DuckDb(BaseDb):
 
         if not rows:
             logging.warning("No rows provided for insertion.")
-            return
+            return []
 
         try:
-            # Get columns from the table schema
-            column_info = self.connection.execute(f"DESCRIBE {table}").fetchall()
-            columns = [col[0] for col in column_info]
-
-            # Get the next available ID
-            next_id = self._get_next_id(table)
-
-            # Generate unique IDs if 'id' column exists but no ID is provided
-            for i, row in enumerate(rows):
-                if 'id' in columns and (row.get('id') is None or row.get('id') == ''):
-                    row['id'] = next_id + i
+            columns = self._get_table_columns(table)
 
-            placeholders = ", ".join(["?"] * len(columns))
-            column_names = ", ".join(columns)
-            query = f"INSERT INTO {table} VALUES ({placeholders})"
-            try:
-                values = [[row.get(col) for col in columns] for row in rows]
-            except Exception as e:
-                logging.error(f"Error preparing values for insertion: {e}")
-                raise
+            # Generate unique IDs from the table sequence if no ID is provided
+            missing = [row for row in rows if row.get('id') is None or row.get('id') == '']
+            for row, row_id in zip(missing, self._allocate_ids(table, len(missing)) if missing else []):
+                row['id'] = row_id
 
-            self.connection.executemany(query, values)
+            with self._transaction():
+                if bulk:
+                    self._insert_staged(table, columns, rows)
+                else:
+                    placeholders = ", ".join(["?"] * len(columns))
+                    values = [[row.get(col) for col, _ in columns] for row in rows]
+                    self.connection.executemany(f"INSERT INTO {table} VALUES ({placeholders})", values)
+                if table == "BaissChunks":
+                    ids = [row['id'] for row in rows]
+                    self._index_chunk_vectors(ids)
+                    self._index_chunk_terms("id IN (SELECT unnest(?::BIGINT[]))", [ids])
+                    self._mark_index_changed()
             logging.info(f"Inserted {len(rows)} rows into {table}.")
+            return [row['id'] for row in rows]
         except Exception as e:
             logging.error(f"Failed to insert rows into {table}: {e}")
             raise
-    
+
+    def _insert_staged(self, table: str, columns: List[tuple], rows: List[Dict[str, Any]]):
+        """Register the rows as a DataFrame and insert them with a single INSERT ... SELECT."""
+        def to_json(value):
+            if value is None or isinstance(value, str):
+                return value
+            return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+        staged = pd.DataFrame({
+            col: pd.Series(
+                [to_json(row.get(col)) for row in rows] if col_type == "JSON" else [row.get(col) for row in rows],
+                dtype=object
+            )
+            for col, col_type in columns
+        })
+        view = f"_staged_{table}"
+        self.connection.register(view, staged)
+        try:
+            select = ", ".join(f'CAST("{col}" AS {col_type})' for col, col_type in columns)
+            self.connection.execute(f"INSERT INTO {table} SELECT {select} FROM {view}")
+        finally:
+            self.connection.unregister(view)
+
     def check_if_paths_exists(self, paths: List[str]):
         """Check if any of the given paths exist in the BaissDocuments table.
         Args:
@@ -265,8 +869,11 @@ class DuckDb(BaseDb):
             logging.error(f"Failed to check path existence or hash change: {e}")
             return False
 
-    def retrieve_unprocessed_files(self, extensions: List[str]) -> List[tuple]:
+    def retrieve_unprocessed_files(self, extensions: List[str], paths: List[str] = None) -> List[tuple]:
         """Retrieve files that have not been processed (i.e., no corresponding chunks).
+        Args:
+            extensions (List[str]): The content types to retrieve.
+            paths (List[str]): Only retrieve files at or below these paths (all files if None).
         Returns:
             List[tuple]: A list of tuples representing unprocessed files.
         Raises:
@@ -285,8 +892,18 @@ class DuckDb(BaseDb):
                 SELECT bd.path, bd.id, bd.content_type FROM BaissDocuments bd
                 WHERE bd.content_type IN ({placeholders}) and bd.processed is FALSE
             """
+            parameters = list(extensions)
+            if paths is not None:
+                roots = self._path_forms(paths)
+                query += """
+                    AND EXISTS (
+                        SELECT 1 FROM (SELECT unnest(?::TEXT[]) AS root)
+                        WHERE bd.path = root OR starts_with(bd.path, root || '/') OR starts_with(bd.path, root || '\\')
+                    )
+                """
+                parameters.append(sorted(roots))
 
-            result = self.connection.execute(query, extensions).fetchall()
+            result = self.connection.execute(query, parameters).fetchall()
             paths = [(row[0], row[1], row[2]) for row in result]
             logging.info(f"Retrieved {paths} unprocessed files for extensions: {extensions}")
             return paths
@@ -308,7 +925,8 @@ class DuckDb(BaseDb):
         try:
 
             # First delete chunks (to avoid foreign key constraint issues)
-            self.connection.executemany("DELETE FROM BaissChunks WHERE path LIKE ?", [[f"%{path}%"] for path in paths])
+            for path in paths:
+                self._delete_chunks("path LIKE ?", [f"%{path}%"])
 
             # Then delete documents
             self.connection.executemany("DELETE FROM BaissDocuments WHERE path LIKE ?", [[f"%{path}%"] for path in paths])
@@ -335,7 +953,7 @@ class DuckDb(BaseDb):
             placeholders = ", ".join(["?"] * len(extensions))
 
             # First delete chunks (to avoid foreign key constraint issues)
-            self.connection.execute(f"DELETE FROM BaissChunks WHERE content_type IN ({placeholders})", extensions)
+            self._delete_chunks(f"content_type IN ({placeholders})", extensions)
 
             # Then delete documents
             self.connection.execute(f"DELETE FROM BaissDocuments WHERE content_type IN ({placeholders})", extensions)
@@ -383,6 +1001,149 @@ class DuckDb(BaseDb):
             logging.error(f"Failed to retrieve chunks for paths {paths}: {e}")
             raise
     
+    def get_chunks_by_ids(self, ids: List[int]) -> List[tuple]:
+        """Get the content of chunks by id, for results ranked outside of DuckDB.
+        Args:
+            ids (List[int]): The chunk ids.
+        Returns:
+            List[tuple]: (chunk_content, path, id, metadata) tuples, in no particular order.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        if not ids:
+            return []
+        try:
+            return self.connection.execute(
+                "SELECT chunk_content, path, id, metadata FROM BaissChunks WHERE id IN (SELECT unnest(?::BIGINT[]))",
+                [list(ids)]
+            ).fetchall()
+        except Exception as e:
+            logging.error(f"Failed to retrieve {len(ids)} chunks by id: {e}")
+            raise
+
+    @staticmethod
+    def _path_forms(paths: List[str]) -> List[str]:
+        """
+        The stored forms of document paths: walked documents are stored with a file:// prefix,
+        single files as given, while callers (search results, chat attachments) use either.
+        """
+        forms = set()
+        for path in paths:
+            path = path.rstrip("/\\") or path
+            forms.add(path)
+            forms.add(path[len("file://"):] if path.startswith("file://") else "file://" + path)
+        return sorted(forms)
+
+    def _chunk_filter(self, filters: Optional[SearchFilters]) -> Tuple[str, List[Any]]:
+        """
+        Condition on BaissChunks selecting the chunks that pass filters, and its parameters.
+        Path prefixes are resolved to document ids first (DuckDB does not use an index for
+        prefix matches on TEXT), the chunks of these documents are then found through the
+        index of the baiss_id foreign key. last_modified follows the insertion order of the
+        chunks, so the min/max statistics of the row groups prune its range.
+        """
+        if filters is None or filters.is_empty():
+            return "TRUE", []
+        conditions, params = [], []
+        document_ids = set(int(id) for id in filters.document_ids) if filters.document_ids else None
+        if filters.path_prefixes:
+            prefixes = self._path_forms(filters.path_prefixes)
+            rows = self.connection.execute(
+                """
+                SELECT id FROM BaissDocuments
+                WHERE path IN (SELECT unnest(?::TEXT[]))
+                   OR EXISTS (SELECT 1 FROM (SELECT unnest(?::TEXT[]) AS prefix) WHERE starts_with(path, prefix))
+                """,
+                [prefixes, [path + sep for path in prefixes for sep in ("/", "\\")]]
+            ).fetchall()
+            matched = {row[0] for row in rows}
+            document_ids = matched if document_ids is None else document_ids & matched
+        if document_ids is not None:
+            conditions.append("baiss_id IN (SELECT unnest(?::BIGINT[]))")
+            params.append(sorted(document_ids))
+        if filters.content_types:
+            conditions.append("content_type IN (SELECT unnest(?::TEXT[]))")
+            params.append(list(filters.content_types))
+        if filters.modified_after is not None:
+            conditions.append("last_modified >= ?")
+            params.append(filters.modified_after)
+        if filters.modified_before is not None:
+            conditions.append("last_modified <= ?")
+            params.append(filters.modified_before)
+        return " AND ".join(conditions), params
+
+    def _chunk_scope(self, column: str, filters: Optional[SearchFilters]) -> Tuple[str, List[Any]]:
+        """
+        Condition restricting a chunk id column of a table written in chunk id order (postings,
+        vector tables) to the chunks passing filters, and its parameters; "" without filters.
+        The id range of these chunks is checked before the semi-join, so the min/max statistics
+        of the row groups skip the ones outside of it (chunks of a document or folder are mostly
+        contiguous).
+        """
+        condition, params = self._chunk_filter(filters)
+        if not params:
+            return "", []
+        low, high = self.connection.execute(f"SELECT min(id), max(id) FROM BaissChunks WHERE {condition}", params).fetchone()
+        if low is None:
+            return "FALSE", []
+        return f"{column} BETWEEN ? AND ? AND {column} IN (SELECT id FROM BaissChunks WHERE {condition})", [low, high] + params
+
+    def get_chunk_ids(self, filters: SearchFilters) -> List[int]:
+        """Get the ids of the chunks that pass the search filters, for searches ranking outside of DuckDB.
+        Args:
+            filters (SearchFilters): The metadata filters.
+        Returns:
+            List[int]: The chunk ids, in no particular order.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        try:
+            condition, params = self._chunk_filter(filters)
+            return [row[0] for row in self.connection.execute(f"SELECT id FROM BaissChunks WHERE {condition}", params).fetchall()]
+        except Exception as e:
+            logging.error(f"Failed to retrieve the chunk ids of {filters}: {e}")
+            raise
+
+    def get_vector_stats(self) -> Dict[int, tuple]:
+        """Get the number of vectors and the sum of their chunk ids per vector table, to check copies of them.
+        Returns:
+            Dict[int, tuple]: {dim: (count, sum of ids)} for the vector tables whose migration is complete.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        try:
+            stats = {}
+            for dim, complete in self._get_vector_tables().items():
+                if complete:
+                    count, id_sum = self.connection.execute(
+                        f"SELECT COUNT(*), COALESCE(SUM(id), 0) FROM {self._vector_table(dim)}"
+                    ).fetchone()
+                    stats[dim] = (count, int(id_sum))
+            return stats
+        except Exception as e:
+            logging.error(f"Failed to retrieve vector table stats: {e}")
+            raise
+
+    def iter_chunk_vectors(self, dim: int, batch_size: int = 50000):
+        """Stream the normalized vectors of one dimension in id order.
+        Args:
+            dim (int): The embedding dimension.
+            batch_size (int): Rows per batch.
+        Yields:
+            tuple: (ids, vectors) numpy arrays of shape (n,) and (n, dim).
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        lower = -1
+        while True:
+            result = self.connection.execute(
+                f"SELECT id, embedding FROM {self._vector_table(dim)} WHERE id > ? ORDER BY id LIMIT ?", [lower, batch_size]
+            ).fetchnumpy()
+            if not len(result["id"]):
+                return
+            yield result["id"].astype(np.int64), np.stack(result["embedding"]).astype(np.float32)
+            lower = int(result["id"][-1])
+
     def check_if_path_in_chunks_and_delete(self, path: str):
         """Check if the given path exists in the BaissChunks table and delete corresponding chunks if found.
         Args:
@@ -395,7 +1156,7 @@ class DuckDb(BaseDb):
             result = self.connection.execute(query, [path]).fetchone()
             count = result[0] if result else 0
             if count > 0:
-                self.connection.execute("DELETE FROM BaissChunks WHERE path = ?", [path])
+                self._delete_chunks("path = ?", [path])
                 logging.info(f"Deleted {count} chunks for path: {path}")
         except Exception as e:
             logging.error(f"Failed to check and delete chunks for path {path}: {e}")
@@ -414,12 +1175,87 @@ class DuckDb(BaseDb):
             # Convert embedding to float32 to match FLOAT[] column type (avoids DOUBLE[] cast error)
             embedding_float32 = [float(x) for x in embedding]
             query = "UPDATE BaissChunks SET embedding = ? WHERE id = ? AND embedding IS NULL"
-            self.connection.execute(query, [embedding_float32, id])
+            with self._transaction():
+                if self.connection.execute(query, [embedding_float32, id]).fetchone()[0]:
+                    self._index_chunk_vectors([id])
+                    self._mark_index_changed()
             logging.info(f"Filled missing embeddings for id: {id}")
         except Exception as e:
             logging.error(f"Failed to fill missing embeddings for id {id}: {e}")
             raise
     
+    def get_cached_embeddings(self, model: str, text_hashes: List[str]) -> Dict[str, List[float]]:
+        """Look up cached embeddings in one batch and mark the hits as recently used.
+        Args:
+            model (str): The embedding model id the embeddings were produced with.
+            text_hashes (List[str]): Hashes of the chunk texts.
+        Returns:
+            Dict[str, List[float]]: The cached embeddings, keyed by text hash.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        if not text_hashes:
+            return {}
+        try:
+            result = self.connection.execute("""
+                SELECT text_hash, embedding FROM BaissEmbeddingCache
+                WHERE model = ? AND text_hash IN (SELECT unnest(?::TEXT[]))
+            """, [model, list(text_hashes)]).fetchall()
+            cached = {row[0]: row[1] for row in result}
+            if cached:
+                self.connection.execute("""
+                    UPDATE BaissEmbeddingCache SET last_used = now()
+                    WHERE model = ? AND text_hash IN (SELECT unnest(?::TEXT[]))
+                """, [model, list(cached.keys())])
+            return cached
+        except Exception as e:
+            logging.error(f"Failed to read embedding cache: {e}")
+            raise
+
+    def put_cached_embeddings(self, model: str, embeddings: Dict[str, List[float]]):
+        """Store embeddings in the cache with a single set-based statement.
+        Args:
+            model (str): The embedding model id the embeddings were produced with.
+            embeddings (Dict[str, List[float]]): Embeddings keyed by text hash.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        items = [(text_hash, embedding) for text_hash, embedding in embeddings.items() if embedding]
+        if not items:
+            return
+        try:
+            self.connection.execute("""
+                INSERT OR REPLACE INTO BaissEmbeddingCache
+                SELECT ?, unnest(?::TEXT[]), unnest(?::FLOAT[][]), now()
+            """, [model, [item[0] for item in items], [[float(x) for x in item[1]] for item in items]])
+        except Exception as e:
+            logging.error(f"Failed to write embedding cache: {e}")
+            raise
+
+    def evict_embedding_cache(self, max_entries: int) -> int:
+        """Evict the least recently used cache entries beyond max_entries.
+        Args:
+            max_entries (int): The maximum number of entries to keep.
+        Returns:
+            int: The number of evicted entries.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        try:
+            count = self.connection.execute("SELECT COUNT(*) FROM BaissEmbeddingCache").fetchone()[0]
+            if count <= max_entries:
+                return 0
+            self.connection.execute("""
+                DELETE FROM BaissEmbeddingCache WHERE rowid IN (
+                    SELECT rowid FROM BaissEmbeddingCache ORDER BY last_used DESC OFFSET ?
+                )
+            """, [max_entries])
+            logging.info(f"Evicted {count - max_entries} entries from the embedding cache")
+            return count - max_entries
+        except Exception as e:
+            logging.error(f"Failed to evict embedding cache entries: {e}")
+            raise
+
     def get_all_paths(self) -> List[str]:
         """Get all paths from the BaissDocuments table.
         Returns:
@@ -436,6 +1272,189 @@ class DuckDb(BaseDb):
             logging.error(f"Failed to retrieve all document paths: {e}")
             raise
 
+    def get_document_stats(self, paths: List[str] = None) -> List[tuple]:
+        """Get the stored hash and stat signature of documents.
+        Args:
+            paths (List[str]): Restrict the lookup to these paths (all documents if None).
+        Returns:
+            List[tuple]: (path, hash, size, mtime_ns, inode) tuples.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        try:
+            if paths is None:
+                return self.connection.execute(
+                    "SELECT path, hash, size, mtime_ns, inode FROM BaissDocuments"
+                ).fetchall()
+            if not paths:
+                return []
+            return self.connection.execute("""
+                SELECT path, hash, size, mtime_ns, inode FROM BaissDocuments
+                WHERE path IN (SELECT unnest(?::TEXT[]))
+            """, [list(paths)]).fetchall()
+        except Exception as e:
+            logging.error(f"Failed to retrieve document stats: {e}")
+            raise
+
+    def insert_documents(self, rows: List[Dict[str, Any]]):
+        """Insert document records with a single set-based statement.
+        Args:
+            rows (List[Dict[str, Any]]): BaissDocuments rows; ids are assigned here.
+        """
+        self.insert_rows("BaissDocuments", rows)
+
+    def update_document_stats(self, documents: List[tuple]):
+        """Update hashes and stat signatures with one set-based statement.
+        Documents whose hash changed are marked as unprocessed.
+        Args:
+            documents (List[tuple]): (path, hash, size, mtime_ns, inode) tuples.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        if not documents:
+            return
+        try:
+            columns = list(zip(*documents))
+            self.connection.execute("""
+                UPDATE BaissDocuments SET
+                    processed = CASE WHEN BaissDocuments.hash IS DISTINCT FROM u.hash THEN FALSE ELSE BaissDocuments.processed END,
+                    hash      = u.hash,
+                    size      = u.size,
+                    mtime_ns  = u.mtime_ns,
+                    inode     = u.inode
+                FROM (
+                    SELECT
+                        unnest(?::TEXT[])    AS path,
+                        unnest(?::TEXT[])    AS hash,
+                        unnest(?::BIGINT[])  AS size,
+                        unnest(?::BIGINT[])  AS mtime_ns,
+                        unnest(?::UBIGINT[]) AS inode
+                ) u
+                WHERE BaissDocuments.path = u.path
+            """, [list(column) for column in columns])
+            logging.info(f"Updated stats for {len(documents)} documents")
+        except Exception as e:
+            logging.error(f"Failed to update document stats: {e}")
+            raise
+
+    def delete_documents(self, paths: List[str], recursive: bool = False):
+        """Delete documents and their chunks, matching paths exactly.
+        Args:
+            paths (List[str]): The document paths to delete.
+            recursive (bool): Also delete every document below these paths, treating them as folders.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        if not paths:
+            return
+        try:
+            forms = self._path_forms(paths)
+            condition = "path IN (SELECT unnest(?::TEXT[]))"
+            params = [forms]
+            if recursive:
+                condition += " OR EXISTS (SELECT 1 FROM (SELECT unnest(?::TEXT[]) AS prefix) WHERE starts_with(path, prefix))"
+                params.append([path + sep for path in forms for sep in ("/", "\\")])
+            # DuckDB cannot delete referenced documents in the transaction that deletes their chunks
+            self._delete_chunks(condition, params)
+            self.connection.execute(f"DELETE FROM BaissDocuments WHERE {condition}", params)
+            logging.info(f"Deleted {len(paths)} documents")
+        except Exception as e:
+            logging.error(f"Failed to delete documents: {e}")
+            raise
+
+    def move_documents(self, moves: List[tuple]):
+        """Rename documents in place, keeping their chunks and embeddings.
+        Moving a folder moves every document below it.
+        Args:
+            moves (List[tuple]): (source path, destination path, destination depth) tuples, the depth
+                being the one of the destination below its root; the documents below a moved folder
+                get it plus their depth below the folder.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        if not moves:
+            return
+        try:
+            sources      = [source.rstrip("/\\") for source, _, _ in moves]
+            destinations = [destination.rstrip("/\\") for _, destination, _ in moves]
+            depths       = [depth for _, _, depth in moves]
+            names        = [os.path.basename(destination) for destination in destinations]
+            # Separators in the part of the path below the moved folder
+            below = "length(t.path) - length(m.src) - length(replace(replace(t.path[length(m.src) + 1:], '/', ''), '\\', ''))"
+            with self._transaction():
+                for table, rename in [
+                    ("BaissDocuments", f", name = CASE WHEN t.path = m.src THEN m.name ELSE t.name END, depth = m.depth + {below}"),
+                    ("BaissChunks", "")
+                ]:
+                    self.connection.execute(f"""
+                        UPDATE {table} AS t SET path = m.dest || t.path[length(m.src) + 1:]{rename}
+                        FROM (
+                            SELECT unnest(?::TEXT[]) AS src, unnest(?::TEXT[]) AS dest, unnest(?::TEXT[]) AS name, unnest(?::INTEGER[]) AS depth
+                        ) m
+                        WHERE t.path = m.src OR starts_with(t.path, m.src || '/') OR starts_with(t.path, m.src || '\\')
+                    """, [sources, destinations, names, depths])
+                self._mark_index_changed()
+            logging.info(f"Moved {len(moves)} documents")
+        except Exception as e:
+            logging.error(f"Failed to move documents: {e}")
+            raise
+
+    def get_watched_roots(self) -> List[Dict[str, Any]]:
+        """Get the root folders registered for filesystem watching.
+        Returns:
+            List[Dict[str, Any]]: Roots with their path, extensions and embedding_url.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        try:
+            result = self.connection.execute(
+                "SELECT path, extensions, embedding_url FROM BaissWatchedRoots"
+            ).fetchall()
+            return [
+                {"path": row[0], "extensions": json.loads(row[1]) if row[1] else [], "embedding_url": row[2]}
+                for row in result
+            ]
+        except Exception as e:
+            logging.error(f"Failed to retrieve watched roots: {e}")
+            raise
+
+    def add_watched_roots(self, paths: List[str], extensions: List[str], embedding_url: str = None):
+        """Register (or update) root folders for filesystem watching.
+        Args:
+            paths (List[str]): The root folder paths.
+            extensions (List[str]): The file extensions indexed under these roots.
+            embedding_url (str): The embedding service used to index them.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        if not paths:
+            return
+        try:
+            self.connection.execute("""
+                INSERT OR REPLACE INTO BaissWatchedRoots
+                SELECT unnest(?::TEXT[]), ?::JSON, ?
+            """, [list(paths), json.dumps(list(extensions or [])), embedding_url])
+        except Exception as e:
+            logging.error(f"Failed to register watched roots: {e}")
+            raise
+
+    def remove_watched_roots(self, paths: List[str]):
+        """Unregister root folders from filesystem watching.
+        Args:
+            paths (List[str]): The root folder paths.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        if not paths:
+            return
+        try:
+            self.connection.execute(
+                "DELETE FROM BaissWatchedRoots WHERE path IN (SELECT unnest(?::TEXT[]))", [list(paths)]
+            )
+        except Exception as e:
+            logging.error(f"Failed to unregister watched roots: {e}")
+            raise
+
     def update_document_processed_status(self, path: str, processed: bool):
         """Update the processed status of a document.
         Args:
@@ -452,6 +1471,64 @@ class DuckDb(BaseDb):
             logging.error(f"Failed to update processed status for path {path}: {e}")
             raise
 
+    def get_chunk_hashes(self, paths: List[str]) -> Dict[str, Dict[Optional[str], List[int]]]:
+        """Get the ids of the stored chunks of documents, grouped by chunk hash.
+        Args:
+            paths (List[str]): The document paths.
+        Returns:
+            Dict[str, Dict[Optional[str], List[int]]]: {path: {chunk_hash: [chunk ids]}}; chunks without a hash are under None.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        if not paths:
+            return {}
+        try:
+            result = self.connection.execute(
+                "SELECT path, chunk_hash, id FROM BaissChunks WHERE path IN (SELECT unnest(?::TEXT[])) ORDER BY id",
+                [list(paths)]
+            ).fetchall()
+            hashes: Dict[str, Dict[Optional[str], List[int]]] = {}
+            for path, chunk_hash, id in result:
+                hashes.setdefault(path, {}).setdefault(chunk_hash, []).append(id)
+            return hashes
+        except Exception as e:
+            logging.error(f"Failed to retrieve chunk hashes for {len(paths)} documents: {e}")
+            raise
+
+    def write_document_chunks(self, paths: List[str], rows: List[Dict[str, Any]], processed_paths: List[str], removed_chunk_ids: List[int] = None,
+                              failed_parts: Dict[str, int] = None):
+        """Write the chunks of several documents and update their processed status in one transaction.
+        Args:
+            paths (List[str]): Document paths whose existing chunks are all replaced.
+            rows (List[Dict[str, Any]]): The new BaissChunks rows for these documents.
+            processed_paths (List[str]): Document paths to mark as processed.
+            removed_chunk_ids (List[int]): Ids of individual chunks to delete (chunk-level re-ingest).
+            failed_parts (Dict[str, int]): Parts that could not be parsed, by processed path (0 for the others).
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        if not paths and not rows and not processed_paths and not removed_chunk_ids:
+            return
+        try:
+            with self._transaction():
+                if paths:
+                    self._delete_chunks("path IN (SELECT unnest(?::TEXT[]))", [list(paths)])
+                if removed_chunk_ids:
+                    self._delete_chunks("id IN (SELECT unnest(?::BIGINT[]))", [list(removed_chunk_ids)])
+                if rows:
+                    self.insert_rows("BaissChunks", rows)
+                if processed_paths:
+                    failed = [(failed_parts or {}).get(path, 0) for path in processed_paths]
+                    self.connection.execute("""
+                        UPDATE BaissDocuments SET processed = TRUE, failed_parts = p.failed
+                        FROM (SELECT unnest(?::TEXT[]) AS path, unnest(?::INTEGER[]) AS failed) p
+                        WHERE BaissDocuments.path = p.path
+                    """, [list(processed_paths), failed])
+            logging.info(f"Wrote {len(rows)} chunks and removed {len(removed_chunk_ids or [])} chunks for {len(processed_paths)} documents")
+        except Exception as e:
+            logging.error(f"Failed to write chunks for {len(paths)} documents: {e}")
+            raise
+
     def setup_extensions(self):
         """Setup required DuckDB extensions for similarity search."""
         if not self.connection:
@@ -461,95 +1538,151 @@ class DuckDb(BaseDb):
             # Enable experimental HNSW persistence FIRST
             self.connection.execute("SET hnsw_enable_experimental_persistence = true;")
             
-            
-            # Install and load FTS extension for BM25
-            self.connection.execute("INSTALL fts;")
-            self.connection.execute("LOAD fts;")
-            
-            logging.info("Extensions (vss, fts) loaded successfully with HNSW persistence enabled")
+            logging.info("Extensions (vss) loaded successfully with HNSW persistence enabled")
         except Exception as e:
             logging.error(f"Failed to load extensions: {e}")
             raise
 
     def create_hnsw_index(self, force_recreate=False):
-        """Create HNSW index on embeddings for faster similarity search."""
+        """
+        Create the HNSW indexes used by similarity_search_cosine, one per BaissChunkVectors{dim}
+        table (fixed-width, L2-normalized embeddings, kept in sync by the chunk write and delete
+        paths). Existing indexes are kept, so this is cheap to call before searches.
+        Args:
+            force_recreate (bool): Rebuild the indexes, e.g. after changing hnsw_m or hnsw_ef_construction.
+        """
         if not self.connection:
             raise ConnectionError("Database connection is not established.")
         
         try:
-            # Check if index already exists
-            #indexes = self.connection.execute("SELECT index_name FROM duckdb_indexes() WHERE index_name = 'hnsw_embedding_idx';").fetchall()
-            
-            #if indexes and not force_recreate:
-            #    logging.info("HNSW index already exists")
-            #    return
-                
-            #if indexes and force_recreate:
-            #    self.connection.execute("DROP INDEX IF EXISTS hnsw_embedding_idx;")
-            
-            # Create HNSW index with cosine distance
-            #self.connection.execute("""
-            #    CREATE INDEX hnsw_embedding_idx 
-            #    ON BaissChunks 
-            #    USING HNSW (embedding) 
-            #    WITH (metric = 'cosine');
-            #""")
-            logging.info("Skipping HNSW index creation (using direct vector similarity)")
+            for dim, complete in self._get_vector_tables().items():
+                if complete:
+                    self._create_vector_index(dim, force_recreate)
+            # Runtime override of the ef_search the indexes were built with
+            self.connection.execute(f"SET hnsw_ef_search = {int(self.hnsw_ef_search)};")
         except Exception as e:
             logging.error(f"Failed to create HNSW index: {e}")
             raise
 
     def create_fts_index(self, force_recreate=False):
-        """Create FTS index on chunk content for BM25 search."""
+        """
+        Validate the BM25 inverted index used by similarity_search_bm25 (BaissTerms, BaissPostings,
+        BaissChunkLengths). It is kept up to date by the chunk write and delete paths, so nothing
+        is rebuilt here unless asked; the index of the DuckDB fts extension it replaced is dropped.
+        Args:
+            force_recreate (bool): Rebuild the inverted index from BaissChunks, in the background:
+                the index is emptied and its migration registered (see migrate_indexes).
+        """
         if not self.connection:
             raise ConnectionError("Database connection is not established.")
         
         try:
-            # Check if FTS index already exists
-            index_exists = False
-            try:
-                self.connection.execute("SELECT 1 FROM fts_main_BaissChunks.docs LIMIT 1;")
-                index_exists = True
-            except:
-                pass  # Index doesn't exist
-
-            if index_exists and not force_recreate:
-                # Validate the index works with the current DuckDB version
-                try:
-                    # Try a dummy BM25 search to ensure macro and table references are correct
-                    self.connection.execute("SELECT fts_main_BaissChunks.match_bm25(id, 'test', fields := 'chunk_content') FROM BaissChunks LIMIT 1;")
-                    logging.info("FTS index already exists and is valid")
-                    return
-                except Exception as e:
-                    logging.warning(f"FTS index exists but validation failed: {e}. Recreating index...")
-                    force_recreate = True
-            
+            legacy = self.connection.execute(
+                "SELECT COUNT(*) FROM duckdb_schemas() WHERE schema_name = 'fts_main_BaissChunks'"
+            ).fetchone()[0]
+            if legacy:
+                self.connection.execute("DROP SCHEMA fts_main_BaissChunks CASCADE;")
+                logging.info("Dropped the legacy FTS index of BaissChunks")
             if force_recreate:
-                try:
-                    self.connection.execute("PRAGMA drop_fts_index('BaissChunks');")
-                except Exception as e:
-                    logging.warning(f"Failed to drop FTS index during recreation: {e}")
-            
-            # Create FTS index on chunk_content
-            self.connection.execute("""
-                PRAGMA create_fts_index(
-                    'BaissChunks', 'id', 'chunk_content',
-                    stemmer = 'none',
-                    stopwords = 'none',
-                    ignore = '',
-                    strip_accents = 0,
-                    lower = 1,
-                    overwrite = 0
-                );
-            """)
-            logging.info("FTS index created successfully")
+                with self._transaction():
+                    for table in ["BaissPostings", "BaissChunkLengths", "BaissTerms"]:
+                        self.connection.execute(f"DELETE FROM {table}")
+                    self._register_index_migration("bm25")
+                    self._mark_index_changed()
+            logging.info("BM25 index is valid")
         except Exception as e:
-            logging.error(f"Failed to create FTS index: {e}")
+            logging.error(f"Failed to validate the BM25 index: {e}")
             raise
 
-    def similarity_search_bm25(self, query: str, top_k: int = 5, score_threshold: float = 0.0):
+    def _bm25_ranking(self, query: str, filters: SearchFilters = None) -> Tuple[str, List[Any]]:
+        """
+        SELECT of (id, bm25_score) of the best chunks passing filters, and its parameters but the
+        limit. Postings of filtered out chunks are dropped before they are scored.
         """
-        Perform BM25 text similarity search using FTS index.
+        pending = self.connection.execute("SELECT count(*) FROM BaissIndexMigrations WHERE name = 'bm25'").fetchone()[0]
+        if pending:
+            return self._bm25_scan_ranking(query, filters)
+        k1, b = float(self.bm25_k1), float(self.bm25_b)
+        scope, params = self._chunk_scope("p.chunk_id", filters)
+        where = f"WHERE {scope}" if scope else ""
+        return f"""
+            SELECT
+                p.chunk_id AS id,
+                sum(
+                    ln(1 + (stats.n - t.df + 0.5) / (t.df + 0.5))
+                    * p.tf * ({k1} + 1) / (p.tf + {k1} * (1 - {b} + {b} * p.length / stats.avgdl))
+                ) AS bm25_score
+            FROM (SELECT DISTINCT unnest(baiss_tokenize(?)) AS term) q
+            JOIN BaissTerms t ON t.term = q.term
+            JOIN BaissPostings p ON p.term_id = t.id
+            CROSS JOIN (SELECT COUNT(*) AS n, avg(length) AS avgdl FROM BaissChunkLengths) stats
+            {where}
+            GROUP BY p.chunk_id
+            ORDER BY bm25_score DESC
+            LIMIT ?
+        """, [query] + params
+
+    def _bm25_scan_ranking(self, query: str, filters: SearchFilters = None) -> Tuple[str, List[Any]]:
+        """
+        _bm25_ranking computed from BaissChunks, tokenizing every chunk, while the inverted index
+        is built (see migrate_indexes). Scores are those the index gives.
+        """
+        k1, b = float(self.bm25_k1), float(self.bm25_b)
+        scope, params = self._chunk_scope("ct.chunk_id", filters)
+        where = f"WHERE {scope}" if scope else ""
+        return f"""
+            WITH q AS (SELECT DISTINCT unnest(baiss_tokenize(?)) AS term),
+            lengths AS (SELECT id, coalesce(len(baiss_tokenize(chunk_content)), 0) AS length FROM BaissChunks),
+            ct AS (
+                SELECT chunk_id, term, count(*) AS tf
+                FROM (SELECT id AS chunk_id, unnest(baiss_tokenize(chunk_content)) AS term FROM BaissChunks)
+                WHERE term IN (SELECT term FROM q)
+                GROUP BY chunk_id, term
+            ),
+            t AS (SELECT term, count(*) AS df FROM ct GROUP BY term)
+            SELECT
+                ct.chunk_id AS id,
+                sum(
+                    ln(1 + (stats.n - t.df + 0.5) / (t.df + 0.5))
+                    * ct.tf * ({k1} + 1) / (ct.tf + {k1} * (1 - {b} + {b} * l.length / stats.avgdl))
+                ) AS bm25_score
+            FROM ct
+            JOIN t ON t.term = ct.term
+            JOIN lengths l ON l.id = ct.chunk_id
+            CROSS JOIN (SELECT COUNT(*) AS n, avg(length) AS avgdl FROM lengths) stats
+            {where}
+            GROUP BY ct.chunk_id
+            ORDER BY bm25_score DESC
+            LIMIT ?
+        """, [query] + params
+
+    def rank_bm25(self, query: str, top_k: int = 5, filters: SearchFilters = None) -> List[tuple]:
+        """BM25 ranking without the chunk content, see similarity_search_bm25.
+        Args:
+            query (str): The query text.
+            top_k (int): Number of chunks to rank.
+            filters (SearchFilters): Metadata filters the ranked chunks must pass.
+        Returns:
+            List[tuple]: (chunk id, BM25 score) pairs, best first.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        try:
+            ranking, params = self._bm25_ranking(query, filters)
+            result = self.connection.execute(
+                f"SELECT id, bm25_score FROM ({ranking}) ORDER BY bm25_score DESC", params + [int(top_k)]
+            ).fetchall()
+            return [(id, float(score)) for id, score in result]
+        except Exception as e:
+            logging.error(f"Failed to rank chunks by BM25: {e}")
+            raise
+
+    def similarity_search_bm25(self, query: str, top_k: int = 5, score_threshold: float = 0.0, filters: SearchFilters = None):
+        """
+        Perform BM25 text similarity search over the inverted index maintained by the chunk write paths.
+        The postings of the query terms are fetched through the term index, scored in SQL and only
+        the top_k chunks are joined back to BaissChunks. With filters, only the chunks passing them
+        are scored (see SearchFilters).
         """
         if not self.connection:
             raise ConnectionError("Database connection is not established.")
@@ -557,24 +1690,21 @@ class DuckDb(BaseDb):
         start_time = time.time()
         
         try:
-            # Escape single quotes in query to prevent SQL injection and syntax errors
-            escaped_query = query.replace("'", "''").lower()
-            
+            ranking, params = self._bm25_ranking(query, filters)
             search_query = f"""
+                WITH top_chunks AS ({ranking})
                 SELECT 
                     bc.chunk_content,
                     bc.path,
-                    fts_main_BaissChunks.match_bm25(id, '{escaped_query}', fields := 'chunk_content') as bm25_score,
+                    tc.bm25_score,
                     bc.id,
                     bc.metadata
-                FROM BaissChunks bc
-                WHERE bm25_score IS NOT NULL AND bm25_score > 0
-                ORDER BY bm25_score DESC
-                LIMIT {top_k};
+                FROM top_chunks tc
+                JOIN BaissChunks bc ON bc.id = tc.id
+                ORDER BY tc.bm25_score DESC;
             """
-            logging.info(f"Executing BM25 search query: {escaped_query}")
-            # execute_query returns a list directly
-            result = self.execute_query(search_query)
+            logging.info(f"Executing BM25 search query: {query}")
+            result = self.connection.execute(search_query, params + [int(top_k)]).fetchall()
     
             logging.info(f"BM25 search returned {len(result)} results")
             
@@ -614,10 +1744,102 @@ class DuckDb(BaseDb):
             logging.error(f"Failed to perform BM25 search: {e}")
             raise
 
-    def similarity_search_cosine(self, query_embedding: List[float], top_k: int = 5, score_threshold: float = 0.0):
+    def _cosine_ranking(self, query_embedding: List[float], filters: SearchFilters = None) -> Tuple[str, List[Any]]:
+        """
+        SELECT of (id, similarity_score) of the chunks passing filters closest to the query, and
+        its parameters but the limit: the query embedding adjusted to the database dimension and
+        the filter parameters.
+        """
+        # 1. Dimension Caching Strategy
+        if self.embedding_dim is None:
+            # Try to detect dimension from existing data
+            sample_result = self.connection.execute("""
+                SELECT len(embedding) as dim
+                FROM BaissChunks 
+                WHERE embedding IS NOT NULL 
+                LIMIT 1;
+            """).fetchall()
+            
+            if sample_result:
+                self.embedding_dim = sample_result[0][0]
+            else:
+                # Fallback: use query dimension if DB is empty
+                self.embedding_dim = len(query_embedding)
+        
+        db_dimension = self.embedding_dim
+        query_dimension = len(query_embedding)
+        
+        # Adjust query embedding to match database dimension
+        if query_dimension != db_dimension:
+            if query_dimension > db_dimension:
+                query_embedding = query_embedding[:db_dimension]
+                logging.info(f"Truncated query embedding from {query_dimension} to {db_dimension}")
+            else:
+                query_embedding = query_embedding + [0.0] * (db_dimension - query_dimension)
+                logging.info(f"Padded query embedding from {query_dimension} to {db_dimension}")
+        
+        if self._get_vector_tables().get(db_dimension):
+            # Stored vectors are unit length: normalize the query once and rank by inner product.
+            # ORDER BY distance LIMIT k over the vector table is answered by its HNSW index if any.
+            # Filtered searches scan the vectors of the chunks passing the filters exactly instead,
+            # the index could only return k chunks before they are filtered.
+            norm = math.sqrt(sum(x * x for x in query_embedding))
+            if norm > 0:
+                query_embedding = [x / norm for x in query_embedding]
+            scope, params = self._chunk_scope("id", filters)
+            where = f"WHERE {scope}" if scope else ""
+            return f"""
+                SELECT id, -distance AS similarity_score
+                FROM (
+                    SELECT 
+                        id,
+                        array_negative_inner_product(embedding, ?::FLOAT[{db_dimension}]) as distance
+                    FROM {self._vector_table(db_dimension)}
+                    {where}
+                    ORDER BY distance
+                    LIMIT ?
+                )
+            """, [query_embedding] + params
+        condition, params = self._chunk_filter(filters)
+        return f"""
+            SELECT 
+                id,
+                (1.0 - array_cosine_distance(embedding::FLOAT[{db_dimension}], ?::FLOAT[{db_dimension}])) as similarity_score
+            FROM BaissChunks 
+            WHERE embedding IS NOT NULL AND {condition}
+            ORDER BY similarity_score DESC
+            LIMIT ?
+        """, [query_embedding] + params
+
+    def rank_cosine(self, query_embedding: List[float], top_k: int = 5, filters: SearchFilters = None) -> List[tuple]:
+        """Cosine ranking without the chunk content, see similarity_search_cosine.
+        Args:
+            query_embedding (List[float]): The query embedding.
+            top_k (int): Number of chunks to rank.
+            filters (SearchFilters): Metadata filters the ranked chunks must pass.
+        Returns:
+            List[tuple]: (chunk id, cosine similarity) pairs, best first.
+        """
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
+        try:
+            ranking, params = self._cosine_ranking(query_embedding, filters)
+            result = self.connection.execute(
+                f"SELECT id, similarity_score FROM ({ranking}) ORDER BY similarity_score DESC", params + [int(top_k)]
+            ).fetchall()
+            return [(id, float(score)) for id, score in result]
+        except Exception as e:
+            logging.error(f"Failed to rank chunks by cosine similarity: {e}")
+            raise
+
+    def similarity_search_cosine(self, query_embedding: List[float], top_k: int = 5, score_threshold: float = 0.0, filters: SearchFilters = None):
         """
         Perform cosine similarity search using direct vector operations.
         Uses DuckDB's VSS extension with array_cosine_distance for proper similarity scoring.
+        Embeddings are read from the fixed-width, normalized BaissChunkVectors table of their
+        dimension, so similarity is a plain inner product; once create_hnsw_index has run, the
+        top ids come from the approximate HNSW index instead of a full scan. With filters, only
+        the chunks passing them are scored (see SearchFilters).
         Optimized with Late Materialization and Dimension Caching.
         """
         if not self.connection:
@@ -626,61 +1848,27 @@ class DuckDb(BaseDb):
         start_time = time.time()
         
         try:
-            # 1. Dimension Caching Strategy
-            if self.embedding_dim is None:
-                # Try to detect dimension from existing data
-                sample_result = self.connection.execute("""
-                    SELECT len(embedding) as dim
-                    FROM BaissChunks 
-                    WHERE embedding IS NOT NULL 
-                    LIMIT 1;
-                """).fetchall()
-                
-                if sample_result:
-                    self.embedding_dim = sample_result[0][0]
-                else:
-                    # Fallback: use query dimension if DB is empty
-                    self.embedding_dim = len(query_embedding)
-            
-            db_dimension = self.embedding_dim
-            query_dimension = len(query_embedding)
-            
-            # Adjust query embedding to match database dimension
-            if query_dimension != db_dimension:
-                if query_dimension > db_dimension:
-                    query_embedding = query_embedding[:db_dimension]
-                    logging.info(f"Truncated query embedding from {query_dimension} to {db_dimension}")
-                else:
-                    query_embedding = query_embedding + [0.0] * (db_dimension - query_dimension)
-                    logging.info(f"Padded query embedding from {query_dimension} to {db_dimension}")
+            ranking, params = self._cosine_ranking(query_embedding, filters)
             
             # 2. Late Materialization Query
             # Step A: Calculate scores and find top IDs (Lightweight)
             # Step B: Join to get content for winners only (Heavy)
             search_query = f"""
-                WITH TopChunks AS (
-                    SELECT 
-                        id,
-                        (1.0 - array_cosine_distance(embedding::FLOAT[{db_dimension}], ?::FLOAT[{db_dimension}])) as similarity_score
-                    FROM BaissChunks 
-                    WHERE embedding IS NOT NULL
-                    ORDER BY similarity_score DESC
-                    LIMIT ?
-                )
-                SELECT 
-                    bc.chunk_content,
-                    bc.path,
-                    tc.similarity_score,
-                    bc.id,
-                    bc.metadata
-                FROM TopChunks tc
-                JOIN BaissChunks bc ON tc.id = bc.id
-                WHERE tc.similarity_score >= ?
-                ORDER BY tc.similarity_score DESC;
+            WITH TopChunks AS ({ranking})
+            SELECT 
+                bc.chunk_content,
+                bc.path,
+                tc.similarity_score,
+                bc.id,
+                bc.metadata
+            FROM TopChunks tc
+            JOIN BaissChunks bc ON tc.id = bc.id
+            WHERE tc.similarity_score >= ?
+            ORDER BY tc.similarity_score DESC;
             """
             
-            # Execute with parameters: embedding, top_k, score_threshold
-            result = self.connection.execute(search_query, [query_embedding, top_k, score_threshold]).fetchall()
+            # Execute with parameters: embedding, filter parameters, top_k, score_threshold
+            result = self.connection.execute(search_query, params + [top_k, score_threshold]).fetchall()
             
             # Process results
             filtered_results = []
@@ -715,11 +1903,15 @@ class DuckDb(BaseDb):
             raise
 
     def hybrid_similarity_search(self, query_text: str, query_embedding: List[float], top_k: int = 5, 
-                            cosine_weight: float = 0.3, score_threshold: float = 0.0, k: int = 60):
+                            cosine_weight: float = 0.3, score_threshold: float = 0.0, k: int = 60,
+                            fusion: str = "zscore", rrf_k: int = 60, filters: SearchFilters = None):
         """
-        Perform hybrid similarity search using Z-Score Normalization with Sigmoid.
-        This method improves upon Min-Max normalization by being more robust to outliers
-        and score distribution differences between BM25 and Cosine similarity.
+        Perform hybrid similarity search, fusing the cosine and BM25 rankings.
+        Both retrievers only return (id, score) pairs, the scores are normalized and fused with
+        numpy (see fusion.py) and the content is fetched for the top_k fused chunks only.
+        "zscore" fusion uses Z-Score Normalization with Sigmoid, which is more robust to outliers
+        and score distribution differences between BM25 and Cosine similarity than Min-Max;
+        "rrf" (reciprocal rank fusion) only looks at the ranks.
         
         Args:
             query_text: Text query for BM25 search
@@ -728,96 +1920,20 @@ class DuckDb(BaseDb):
             cosine_weight: Weight for cosine similarity (0.0 to 1.0). BM25 weight will be (1.0 - cosine_weight).
             score_threshold: Minimum hybrid score threshold for filtering results
             k: Multiplier for fetching candidates (default 60)
+            fusion: "zscore" or "rrf"
+            rrf_k: Rank offset of the reciprocal rank fusion (default 60)
+            filters: Metadata filters (SearchFilters) both retrievers apply before scoring
             
         Returns:
             List of tuples: (content, path, hybrid_score, chunk_id, metadata, cosine_score, bm25_score)
         """
-        start_time = time.time()
+        if not self.connection:
+            raise ConnectionError("Database connection is not established.")
         try:
-            # Fetch a larger pool of candidates to calculate statistics
-            limit = top_k * k
-            cosine_results = self.similarity_search_cosine(query_embedding, limit, 0.0)
-            bm25_results = self.similarity_search_bm25(query_text, limit, 0.0)
-            
-            cosine_scores_map = {chunk_id: score for _, _, score, chunk_id, _ in cosine_results}
-            bm25_scores_map = {chunk_id: score for _, _, score, chunk_id, _ in bm25_results}
-            
-            all_chunk_ids = set(cosine_scores_map.keys()) | set(bm25_scores_map.keys())
-            
-            if not all_chunk_ids:
-                return []
-
-            def get_stats(scores):
-                if not scores:
-                    return 0.0, 1.0
-                mean = sum(scores) / len(scores)
-                variance = sum((x - mean) ** 2 for x in scores) / len(scores)
-                std_dev = math.sqrt(variance)
-                return mean, std_dev
-
-            def sigmoid(x):
-                return 1 / (1 + math.exp(-x))
-
-            c_scores = list(cosine_scores_map.values())
-            b_scores = list(bm25_scores_map.values())
-            
-            c_mean, c_std = get_stats(c_scores)
-            b_mean, b_std = get_stats(b_scores)
-            
-            min_c = min(c_scores) if c_scores else 0.0
-            min_b = min(b_scores) if b_scores else 0.0
-            
-            doc_data = {}
-            for content, path, _, chunk_id, metadata in cosine_results:
-                doc_data[chunk_id] = {'content': content, 'path': path, 'metadata': metadata}
-            for content, path, _, chunk_id, metadata in bm25_results:
-                if chunk_id not in doc_data:
-                    doc_data[chunk_id] = {'content': content, 'path': path, 'metadata': metadata}
-            
-            results = []
-            
-            for chunk_id in all_chunk_ids:
-                c_raw = cosine_scores_map.get(chunk_id, min_c)
-                b_raw = bm25_scores_map.get(chunk_id, min_b)
-                
-                # Normalize Cosine Score (Z-Score + Sigmoid)
-                if c_std > 1e-6:
-                    c_norm = sigmoid((c_raw - c_mean) / c_std)
-                else:
-                    c_norm = 0.5 
-                
-                # Normalize BM25 Score (Z-Score + Sigmoid)
-                if b_std > 1e-6:
-                    b_norm = sigmoid((b_raw - b_mean) / b_std)
-                else:
-                    b_norm = 0.5
-                
-                hybrid_score = (cosine_weight * c_norm) + ((1.0 - cosine_weight) * b_norm)
-                
-                if hybrid_score >= score_threshold:
-                    results.append((
-                        doc_data[chunk_id]['content'],
-                        doc_data[chunk_id]['path'],
-                        hybrid_score,
-                        chunk_id,
-                        doc_data[chunk_id]['metadata'],
-                        c_raw,
-                        b_raw
-                    ))
-            
-            results.sort(key=lambda x: x[2], reverse=True)
-            
-            logging.info(f"Hybrid search (Z-Score) returned {len(results[:top_k])} results")
-            
-            end_time = time.time()
-            logging.info(f"Hybrid similarity search took {end_time - start_time:.4f} seconds")
-            
-            return results[:top_k]
-            
+            return fused_search(self, query_text, query_embedding, top_k, cosine_weight, score_threshold, k, fusion, rrf_k, filters)
         except Exception as e:
             logging.error(f"Failed to perform hybrid similarity search: {e}")
             raise
 
-
 if __name__ == "__main__":
     pass
\ No newline at end of file
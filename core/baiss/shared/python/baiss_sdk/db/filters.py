@@ -0,0 +1,34 @@
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+
+from datetime    import datetime
+from typing      import Any, Dict, List, Optional
+from dataclasses import dataclass, fields
+
+
+@dataclass(frozen = True)
+class SearchFilters:
+    """
+    Metadata filters of the similarity searches, applied to the candidate chunks before they are
+    scored. A chunk must match every given filter; None or an empty list does not filter.
+    """
+    # Document paths, matched exactly or as folders (every document below them)
+    path_prefixes: Optional[List[str]] = None
+    # BaissDocuments ids
+    document_ids: Optional[List[int]] = None
+    # Chunk content types, as stored by the tree structures (e.g. "pdf" or "text/plain")
+    content_types: Optional[List[str]] = None
+    # Range of the chunk last_modified (ingestion) time, bounds included
+    modified_after: Optional[datetime] = None
+    modified_before: Optional[datetime] = None
+
+    def is_empty(self) -> bool:
+        return not any(getattr(self, field.name) for field in fields(self))
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> Optional["SearchFilters"]:
+        """SearchFilters of the given fields (unknown keys are ignored), None if nothing filters."""
+        if not data:
+            return None
+        filters = cls(**{field.name: data.get(field.name) for field in fields(cls)})
+        return None if filters.is_empty() else filters
@@ -0,0 +1,91 @@
+import time
+import logging
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from typing import List, Tuple
+import numpy as np
+from baiss_sdk.db.filters import SearchFilters
+
+# Score fusions of hybrid_similarity_search
+FUSION_METHODS = ("zscore", "rrf")
+
+
+def _ranked_arrays(ranked: List[Tuple[int, float]]) -> Tuple[np.ndarray, np.ndarray]:
+    ids = np.fromiter((id for id, _ in ranked), dtype = np.int64, count = len(ranked))
+    scores = np.fromiter((score for _, score in ranked), dtype = np.float64, count = len(ranked))
+    return ids, scores
+
+
+def _align(union: np.ndarray, ids: np.ndarray, values: np.ndarray, fill: float) -> np.ndarray:
+    """values of ids spread over the sorted union of ids, fill where an id was not retrieved."""
+    aligned = np.full(len(union), fill, dtype = np.float64)
+    aligned[np.searchsorted(union, ids)] = values
+    return aligned
+
+
+def _zscore_sigmoid(scores: np.ndarray, retrieved: np.ndarray) -> np.ndarray:
+    """Z-score normalization over the retrieved scores, squashed to (0, 1) with a sigmoid."""
+    mean, std = (retrieved.mean(), retrieved.std()) if len(retrieved) else (0.0, 1.0)
+    if std <= 1e-6:
+        return np.full(len(scores), 0.5)
+    return 1.0 / (1.0 + np.exp(-(scores - mean) / std))
+
+
+def fuse_scores(cosine: List[Tuple[int, float]], bm25: List[Tuple[int, float]], fusion: str = "zscore",
+                cosine_weight: float = 0.3, rrf_k: int = 60) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fuses the rankings of the two retrievers over the union of their ids.
+    "zscore": weighted sum of the z-score/sigmoid normalized scores, an id missing from one
+    ranking gets that ranking's lowest score. "rrf": weighted reciprocal rank fusion,
+    cosine_weight / (rrf_k + rank) summed over the rankings an id appears in.
+    Args:
+        cosine (List[Tuple[int, float]]): (chunk id, cosine similarity) pairs, best first.
+        bm25 (List[Tuple[int, float]]): (chunk id, BM25 score) pairs, best first.
+        fusion (str): "zscore" or "rrf".
+        cosine_weight (float): Weight of the cosine ranking, BM25 gets 1 - cosine_weight.
+        rrf_k (int): Rank offset of the reciprocal rank fusion.
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: ids, fused scores, cosine scores and
+            BM25 scores (lowest score of the ranking where missing), sorted by fused score.
+    """
+    if fusion not in FUSION_METHODS:
+        raise ValueError(f"Unsupported fusion: {fusion}. Must be one of {FUSION_METHODS}")
+    c_ids, c_scores = _ranked_arrays(cosine)
+    b_ids, b_scores = _ranked_arrays(bm25)
+    union = np.union1d(c_ids, b_ids)
+    c_raw = _align(union, c_ids, c_scores, c_scores.min() if len(c_scores) else 0.0)
+    b_raw = _align(union, b_ids, b_scores, b_scores.min() if len(b_scores) else 0.0)
+    if fusion == "zscore":
+        fused = cosine_weight * _zscore_sigmoid(c_raw, c_scores) + (1.0 - cosine_weight) * _zscore_sigmoid(b_raw, b_scores)
+    else:
+        fused = (_align(union, c_ids, cosine_weight / (rrf_k + np.arange(1, len(c_ids) + 1)), 0.0)
+                 + _align(union, b_ids, (1.0 - cosine_weight) / (rrf_k + np.arange(1, len(b_ids) + 1)), 0.0))
+    order = np.argsort(-fused, kind = "stable")
+    return union[order], fused[order], c_raw[order], b_raw[order]
+
+
+def fused_search(db_client, query_text: str, query_embedding: List[float], top_k: int = 5, cosine_weight: float = 0.3,
+                 score_threshold: float = 0.0, k: int = 60, fusion: str = "zscore", rrf_k: int = 60,
+                 filters: SearchFilters = None) -> List[tuple]:
+    """
+    Hybrid retrieval: both retrievers return (id, score) pairs only, the scores are fused with
+    numpy and the content of the top_k chunks is fetched last (see hybrid_similarity_search).
+    Both retrievers only rank the chunks passing filters.
+    Returns:
+        List[tuple]: (content, path, hybrid_score, chunk_id, metadata, cosine_score, bm25_score) tuples.
+    """
+    start_time = time.time()
+    limit = top_k * k
+    # Chunks with a negative similarity or BM25 score are not candidates
+    cosine = [(id, score) for id, score in db_client.rank_cosine(query_embedding, limit, filters) if score >= 0.0]
+    bm25 = [(id, score) for id, score in db_client.rank_bm25(query_text, limit, filters) if score >= 0.0]
+    ids, fused, c_raw, b_raw = fuse_scores(cosine, bm25, fusion, cosine_weight, rrf_k)
+    keep = np.flatnonzero(fused >= score_threshold)[:top_k]
+    chunks = {row[2]: row for row in db_client.get_chunks_by_ids(ids[keep].tolist())}
+    results = []
+    for i in keep.tolist():
+        chunk = chunks.get(int(ids[i]))
+        if chunk is not None:
+            results.append((chunk[0], chunk[1], float(fused[i]), chunk[2], chunk[3], float(c_raw[i]), float(b_raw[i])))
+    logging.info(f"Hybrid search ({fusion}) fused {len(cosine)} cosine and {len(bm25)} BM25 candidates into {len(results)} results in {time.time() - start_time:.4f} seconds")
+    return results
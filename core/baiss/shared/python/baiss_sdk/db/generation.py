@@ -0,0 +1,19 @@
+import threading
+
+# Bumped by DuckDb after every committed change to the searchable chunks (ingestion, deletes,
+# moves, migrations). Cached search results are keyed by it, so they are never served stale.
+# DuckDB lets a single process open the database for writing, so a per-process counter sees
+# every write made while this process holds the database.
+_generation = 0
+_lock = threading.Lock()
+
+
+def index_generation() -> int:
+    return _generation
+
+
+def bump_index_generation() -> int:
+    global _generation
+    with _lock:
+        _generation += 1
+        return _generation
@@ -0,0 +1,283 @@
+import os
+import json
+import glob
+import time
+import logging
+import threading
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from baiss_sdk import get_baiss_project_path
+
+logger = logging.getLogger(__name__)
+
+# Tombstoned rows are marked with this id until the next compaction
+TOMBSTONE = -1
+
+
+class EmbeddingMatrix:
+    """
+    Contiguous float32 matrix of the normalized embeddings of one dimension, with the chunk id
+    of every row, stored as two .npy files opened with np.memmap. Rows are appended in place
+    (the files are preallocated and grow by doubling); deleted rows are tombstoned and dropped
+    by compact(). Every rewrite goes to files of a new generation, so searches that are still
+    reading the previous memmaps are not affected.
+    """
+
+    def __init__(self, directory: str, dim: int):
+        self.directory  = directory
+        self.dim        = dim
+        self.generation = 0
+        self.count      = 0
+        self.tombstones = 0
+        self.vectors: Optional[np.memmap] = None
+        self.ids: Optional[np.memmap] = None
+        self._positions: Dict[int, int] = {}
+
+    def _path(self, name: str, generation: int = None) -> str:
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.directory, f"{name}_{self.dim}_{generation}.npy")
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, f"meta_{self.dim}.json")
+
+    @property
+    def live(self) -> int:
+        return self.count - self.tombstones
+
+    def open(self) -> bool:
+        """Opens the files of the current generation. Returns False if there are none."""
+        if not os.path.exists(self._meta_path):
+            return False
+        try:
+            with open(self._meta_path, "r", encoding = "utf-8") as f:
+                meta = json.load(f)
+            self.generation = meta["generation"]
+            self.count      = meta["count"]
+            self.vectors    = np.load(self._path("vectors"), mmap_mode = "r+")
+            self.ids        = np.load(self._path("ids"), mmap_mode = "r+")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Cannot open the {self.dim}-dimension embedding matrix, it will be rebuilt: {e}")
+            return False
+        ids = np.asarray(self.ids[:self.count])
+        self.tombstones = int(np.count_nonzero(ids == TOMBSTONE))
+        self._positions = {int(id): position for position, id in enumerate(ids.tolist()) if id != TOMBSTONE}
+        return True
+
+    def _allocate(self, capacity: int, generation: int) -> Tuple[np.memmap, np.memmap]:
+        vectors = np.lib.format.open_memmap(self._path("vectors", generation), mode = "w+", dtype = np.float32, shape = (capacity, self.dim))
+        ids = np.lib.format.open_memmap(self._path("ids", generation), mode = "w+", dtype = np.int64, shape = (capacity,))
+        ids[:] = TOMBSTONE
+        return vectors, ids
+
+    def _save_meta(self):
+        temporary = self._meta_path + ".tmp"
+        with open(temporary, "w", encoding = "utf-8") as f:
+            json.dump({"generation": self.generation, "count": self.count, "dim": self.dim}, f)
+        os.replace(temporary, self._meta_path)
+
+    def _rewrite(self, capacity: int, rows: Optional[np.ndarray] = None):
+        """Copies the rows (all of them, or the given positions) into the files of a new generation."""
+        generation = self.generation + 1
+        vectors, ids = self._allocate(capacity, generation)
+        if self.vectors is not None:
+            rows = np.arange(self.count) if rows is None else rows
+            for start in range(0, len(rows), 65536):
+                batch = rows[start:start + 65536]
+                vectors[start:start + len(batch)] = self.vectors[batch]
+                ids[start:start + len(batch)] = self.ids[batch]
+            count = len(rows)
+        else:
+            count = 0
+        vectors.flush()
+        ids.flush()
+        previous = self.generation
+        self.vectors, self.ids, self.generation, self.count = vectors, ids, generation, count
+        self.tombstones = 0
+        self._positions = {int(id): position for position, id in enumerate(np.asarray(ids[:count]).tolist())}
+        self._save_meta()
+        self._remove_generation(previous)
+
+    def _remove_generation(self, generation: int):
+        for name in ["vectors", "ids"]:
+            try:
+                os.remove(self._path(name, generation))
+            except OSError:
+                # Still mapped by a search (Windows), or never written; cleaned up on the next open
+                pass
+
+    def cleanup(self):
+        """Deletes the files of older generations."""
+        for path in glob.glob(os.path.join(self.directory, f"*_{self.dim}_*.npy")):
+            if not path.endswith(f"_{self.dim}_{self.generation}.npy"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def reset(self, capacity: int = 1024):
+        self.vectors = None
+        self.ids = None
+        self._rewrite(capacity)
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray):
+        """Appends rows; ids already present are tombstoned first, so they are replaced."""
+        self.remove([id for id in ids.tolist() if id in self._positions])
+        if self.vectors is None or self.count + len(ids) > len(self.ids):
+            self._rewrite(max(1024, 2 * (self.count + len(ids))))
+        start, end = self.count, self.count + len(ids)
+        self.vectors[start:end] = vectors
+        self.ids[start:end] = ids
+        self.vectors.flush()
+        self.ids.flush()
+        for offset, id in enumerate(ids.tolist()):
+            self._positions[int(id)] = start + offset
+        self.count = end
+        self._save_meta()
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """Tombstones the rows of these ids. Returns the number of rows removed."""
+        positions = [self._positions.pop(int(id)) for id in ids if int(id) in self._positions]
+        if positions:
+            self.ids[positions] = TOMBSTONE
+            self.ids.flush()
+            self.tombstones += len(positions)
+        return len(positions)
+
+    def compact(self):
+        """Rewrites the matrix without its tombstoned rows."""
+        if self.vectors is None:
+            return
+        started = time.time()
+        rows = np.flatnonzero(np.asarray(self.ids[:self.count]) != TOMBSTONE)
+        removed = self.count - len(rows)
+        self._rewrite(max(1024, 2 * len(rows)), rows)
+        logger.info(f"Compacted the {self.dim}-dimension embedding matrix: {removed} tombstones dropped in {time.time() - started:.2f} seconds")
+
+    def search(self, query: np.ndarray, top_k: int, ids: Iterable[int] = None) -> List[Tuple[int, float]]:
+        """
+        Exact top-k by inner product: one matrix-vector product and an argpartition.
+        With ids, only the rows of these chunk ids are scored.
+        """
+        vectors, row_ids, count = self.vectors, self.ids, self.count
+        if vectors is None or count == 0 or top_k <= 0:
+            return []
+        if ids is None:
+            rows = None
+            scores = vectors[:count] @ query
+            scores[np.asarray(row_ids[:count]) == TOMBSTONE] = -np.inf
+        else:
+            rows = np.fromiter((self._positions[int(id)] for id in ids if int(id) in self._positions), dtype = np.int64)
+            if len(rows) == 0:
+                return []
+            rows.sort()
+            scores = vectors[rows] @ query
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        positions = top if rows is None else rows[top]
+        return [(int(row_ids[p]), float(s)) for p, s in zip(positions.tolist(), scores[top].tolist()) if np.isfinite(s)]
+
+
+class MemmapVectorStore:
+    """
+    Optional search backend keeping one EmbeddingMatrix per embedding dimension under
+    local-data/vectors. It mirrors the BaissChunkVectors tables: DuckDb forwards the vectors
+    it writes and the chunk ids it deletes once the transaction commits, and open() rebuilds
+    a matrix whose rows do not match its table (e.g. after a crash or a write made while the
+    store was closed).
+    """
+
+    def __init__(self, directory: str = None, compact_ratio: float = 0.25):
+        self.directory     = directory or get_baiss_project_path("local-data", "vectors")
+        self.compact_ratio = compact_ratio
+        self.matrices: Dict[int, EmbeddingMatrix] = {}
+        self._lock         = threading.RLock()
+
+    def open(self, db_client, batch_size: int = 50000):
+        """Opens the matrices, rebuilding the ones that are out of sync with the database."""
+        os.makedirs(self.directory, exist_ok = True)
+        stats = db_client.get_vector_stats()
+        with self._lock:
+            for dim, (count, id_sum) in stats.items():
+                matrix = EmbeddingMatrix(self.directory, dim)
+                if matrix.open():
+                    live = np.asarray(matrix.ids[:matrix.count])
+                    live = live[live != TOMBSTONE]
+                    if len(live) == count and int(live.sum()) == id_sum:
+                        matrix.cleanup()
+                        self.matrices[dim] = matrix
+                        logger.info(f"Opened the {dim}-dimension embedding matrix ({count} vectors)")
+                        continue
+                started = time.time()
+                matrix.reset(max(1024, 2 * count))
+                for ids, vectors in db_client.iter_chunk_vectors(dim, batch_size):
+                    matrix.append(ids, vectors)
+                matrix.cleanup()
+                self.matrices[dim] = matrix
+                logger.info(f"Rebuilt the {dim}-dimension embedding matrix ({count} vectors) in {time.time() - started:.2f} seconds")
+
+    def has(self, dim: int) -> bool:
+        return dim in self.matrices
+
+    def add(self, dim: int, ids: np.ndarray, vectors: np.ndarray):
+        """Appends normalized vectors of newly written chunks."""
+        if len(ids) == 0:
+            return
+        with self._lock:
+            matrix = self.matrices.get(dim)
+            if matrix is None:
+                matrix = EmbeddingMatrix(self.directory, dim)
+                matrix.reset()
+                self.matrices[dim] = matrix
+            matrix.append(np.asarray(ids, dtype = np.int64), np.asarray(vectors, dtype = np.float32))
+
+    def remove(self, ids: List[int]):
+        """Tombstones deleted chunks, compacting a matrix once compact_ratio of its rows are tombstones."""
+        if not ids:
+            return
+        with self._lock:
+            for matrix in self.matrices.values():
+                if matrix.remove(ids) and matrix.tombstones > max(1024, self.compact_ratio * matrix.count):
+                    matrix.compact()
+
+    def compact(self):
+        with self._lock:
+            for matrix in self.matrices.values():
+                if matrix.tombstones:
+                    matrix.compact()
+
+    def search(self, query_embedding: List[float], top_k: int, ids: Iterable[int] = None) -> List[Tuple[int, float]]:
+        """Returns the (chunk id, cosine similarity) pairs of the top_k chunks (among ids if given), best first."""
+        matrix = self.matrices.get(len(query_embedding))
+        if matrix is None:
+            return []
+        query = np.asarray(query_embedding, dtype = np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        return matrix.search(query, top_k, ids)
+
+
+# The store opened at server start, shared by every DbProxyClient of the process
+_vector_store: Optional[MemmapVectorStore] = None
+
+
+def get_vector_store() -> Optional[MemmapVectorStore]:
+    return _vector_store
+
+
+def open_vector_store(db_client, directory: str = None) -> MemmapVectorStore:
+    """Opens the process-wide memmap vector store (see MemmapVectorStore.open)."""
+    global _vector_store
+    store = MemmapVectorStore(directory)
+    store.open(db_client)
+    _vector_store = store
+    return store
+
+
+def close_vector_store():
+    global _vector_store
+    _vector_store = None
@@ -1,28 +1,212 @@
 import httpx
+import asyncio
+import hashlib
 import logging
+import weakref
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache backed by the BaissEmbeddingCache table.
+    Entries are keyed by (embedding model id, hash of the exact chunk text), so unchanged
+    chunks are never sent to the embedding server again; a chunk that changed in any way,
+    whitespace included, is embedded again.
+    """
+
+    def __init__(self, db_client, max_entries: int = 100000):
+        self.db_client   = db_client
+        self.max_entries = max_entries
+        self.hits        = 0
+        self.misses      = 0
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, text_hashes: List[str]) -> Dict[str, list]:
+        """Returns the cached embeddings for the given hashes, updating hit/miss counters."""
+        unique_hashes = list(dict.fromkeys(text_hashes))
+        try:
+            cached = self.db_client.get_cached_embeddings(model, unique_hashes)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            cached = {}
+        self.hits   += sum(1 for text_hash in text_hashes if text_hash in cached)
+        self.misses += sum(1 for text_hash in text_hashes if text_hash not in cached)
+        return cached
+
+    def put_many(self, model: str, embeddings: Dict[str, list]):
+        """Stores freshly computed embeddings and evicts the least recently used entries."""
+        if not embeddings:
+            return
+        try:
+            self.db_client.put_cached_embeddings(model, embeddings)
+            self.db_client.evict_embedding_cache(self.max_entries)
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits"    : self.hits,
+            "misses"  : self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
 
 class Embeddings:
 
-    def __init__(self, url: str):
+    # Pooled clients are bound to the event loop that created them, so they are
+    # kept per loop and per embedding URL: {loop: {url: (client, semaphore, limit)}}
+    _pools: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+    # Concurrent requests allowed per embedding URL: the largest max_concurrency asked for it
+    _limits: Dict[str, int] = {}
+    # Embedding model id reported by each embedding server, used as the cache key
+    _model_ids: Dict[str, str] = {}
+
+    def __init__(self, url: str, batch_size: int = 32, max_concurrency: int = 4):
         """Initializes the Embeddings class with the given URL."""
         if url is None:
             raise ValueError("URL must be provided for embeddings service.")
         if not url.startswith("http"):
             url = "http://" + url
+        self.base_url = url.rstrip("/")
         self.url = url + "/embedding"
+        self.batch_size = max(1, int(batch_size))
+        self.max_concurrency = max(1, int(max_concurrency))
+        Embeddings._limits[self.url] = max(Embeddings._limits.get(self.url, 0), self.max_concurrency)
 
-    async def embed(self, input_text: str) -> list:
-        """Generates embeddings for the given input text using the specified URL."""
+    def _pool(self):
+        """
+        Returns the long-lived (client, semaphore) pair for this URL on the running loop.
+        The semaphore bounds the requests to the URL's limit (see _limits), it is widened
+        when an instance asking for more concurrency was created since.
+        """
+        loop = asyncio.get_running_loop()
+        pools: Dict[str, tuple] = Embeddings._pools.setdefault(loop, {})
+        pool  = pools.get(self.url)
+        limit = Embeddings._limits[self.url]
+        if pool is None or pool[0].is_closed:
+            # The semaphore bounds the connections in use, the client never makes a request wait
+            client = httpx.AsyncClient(
+                timeout = 60.0,
+                limits  = httpx.Limits(max_connections = None, max_keepalive_connections = None)
+            )
+            pool = (client, asyncio.Semaphore(limit), limit)
+            pools[self.url] = pool
+        elif pool[2] < limit:
+            for _ in range(limit - pool[2]):
+                pool[1].release()
+            pool = (pool[0], pool[1], limit)
+            pools[self.url] = pool
+        return pool[0], pool[1]
+
+    @classmethod
+    async def aclose(cls):
+        """Closes every pooled client that belongs to the running event loop."""
+        loop  = asyncio.get_running_loop()
+        pools = cls._pools.pop(loop, {})
+        for client, _, _ in pools.values():
+            await client.aclose()
+
+    async def model_id(self) -> str:
+        """Returns the id of the model served at this URL, falling back to the URL itself."""
+        if self.base_url in Embeddings._model_ids:
+            return Embeddings._model_ids[self.base_url]
+        model_id = self.base_url
+        client, _ = self._pool()
+        try:
+            response = await client.get(self.base_url + "/v1/models")
+            response.raise_for_status()
+            models = response.json().get("data") or []
+            if models and models[0].get("id"):
+                model_id = models[0]["id"]
+        except (httpx.HTTPError, ValueError, AttributeError) as e:
+            logger.warning(f"Could not read embedding model id from {self.base_url}: {e}")
+        Embeddings._model_ids[self.base_url] = model_id
+        return model_id
+
+    @staticmethod
+    def _parse_response(embedding_data, count: int) -> List[Optional[list]]:
+        """Maps a llama.cpp /embedding response back to the input order."""
+        results = [None] * count
+        if isinstance(embedding_data, dict):
+            embedding_data = [embedding_data]
+        for position, item in enumerate(embedding_data):
+            index = item.get("index", position)
+            embedding = item.get("embedding")
+            # Pooled embeddings are returned as [[...]], un-pooled ones as [...]
+            if embedding and isinstance(embedding[0], list):
+                embedding = embedding[0]
+            if embedding and embedding[0] is not None and 0 <= index < count:
+                results[index] = embedding
+        return results
+
+    async def _post_batch(self, texts: List[str]) -> List[Optional[list]]:
+        """Posts one array payload to the embedding server, falling back to single items on failure."""
+        client, semaphore = self._pool()
         for attempt in range(2):
             try:
-                async with httpx.AsyncClient(timeout=60.0) as client:
-
-                    response = await client.post(self.url, json={"content": input_text})
-                    response.raise_for_status()
-                    embedding_data = response.json()
-                    # logging.info(f"Embedding response: {embedding_data}")
-                    if embedding_data[0]["embedding"][0] is not None:
-                        return embedding_data[0]["embedding"][0]
+                async with semaphore:
+                    response = await client.post(self.url, json={"content": texts})
+                response.raise_for_status()
+                return self._parse_response(response.json(), len(texts))
             except httpx.HTTPError as e:
-                print(f"Error generating embeddings: {e}")
-        return None
\ No newline at end of file
+                logger.warning(f"Error generating embeddings for a batch of {len(texts)}: {e}")
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                logger.warning(f"Invalid embeddings response for a batch of {len(texts)}: {e}")
+                break
+        if len(texts) == 1:
+            return [None]
+        # One oversized or malformed input must not fail the whole batch
+        results = []
+        for text in texts:
+            results.extend(await self._post_batch([text]))
+        return results
+
+    async def embed_many(self, texts: List[str], batch_size: int = None, cache: EmbeddingCache = None) -> List[Optional[list]]:
+        """
+        Generates embeddings for many texts using batched array payloads.
+        Args:
+            texts (List[str]): The texts to embed.
+            batch_size (int): Number of texts per request (defaults to the instance batch size).
+            cache (EmbeddingCache): Optional cache consulted before calling the embedding server.
+        Returns:
+            List[Optional[list]]: One embedding per input text, in input order (None on failure).
+        """
+        if not texts:
+            return []
+        batch_size = max(1, int(batch_size or self.batch_size))
+        results: List[Optional[list]] = [None] * len(texts)
+        # Empty texts are rejected by the server, never send them
+        indexes = [i for i, text in enumerate(texts) if isinstance(text, str) and text.strip()]
+
+        text_hashes = {}
+        if cache is not None and indexes:
+            model  = await self.model_id()
+            text_hashes = {i: EmbeddingCache.text_hash(texts[i]) for i in indexes}
+            cached = cache.get_many(model, [text_hashes[i] for i in indexes])
+            for i in indexes:
+                results[i] = cached.get(text_hashes[i])
+            indexes = [i for i in indexes if results[i] is None]
+
+        async def run(batch_indexes: List[int]):
+            embeddings = await self._post_batch([texts[i] for i in batch_indexes])
+            for i, embedding in zip(batch_indexes, embeddings):
+                results[i] = embedding
+
+        await asyncio.gather(*(
+            run(indexes[start:start + batch_size])
+            for start in range(0, len(indexes), batch_size)
+        ))
+        if cache is not None and indexes:
+            cache.put_many(model, {
+                text_hashes[i]: results[i] for i in indexes if results[i] is not None
+            })
+        return results
+
+    async def embed(self, input_text: str) -> list:
+        """Generates embeddings for the given input text using the specified URL."""
+        return (await self.embed_many([input_text]))[0]
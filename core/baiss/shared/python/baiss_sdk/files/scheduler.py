@@ -0,0 +1,246 @@
+import time
+import uuid
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Lower values run first
+INTERACTIVE_PRIORITY = 0
+BACKGROUND_PRIORITY  = 10
+# Index migrations, which yield to every ingestion
+MAINTENANCE_PRIORITY = 20
+
+class IngestionCancelled(Exception):
+    """Raised at the checkpoints of an ingestion that was cancelled (or whose watcher is stopping)."""
+
+class IngestionJob:
+    """
+    One ingestion request (scan + parse + embed of a set of paths) with its own
+    cancellation token, embedding endpoint and progress counters.
+    A job may bring its own runner instead of the scheduler's (e.g. the file watcher's batches).
+    Apart from is_cancelled(), which worker threads poll, methods must be called
+    on the event loop thread.
+    """
+
+    def __init__(self, paths: List[str], extensions: List[str], embedding_url: str, priority: int = BACKGROUND_PRIORITY,
+                 runner: Optional[Callable[["IngestionJob"], Awaitable[None]]] = None):
+        self.id            = uuid.uuid4().hex
+        self.paths         = paths
+        self.extensions    = extensions
+        self.embedding_url = embedding_url
+        self.priority      = priority
+        self.runner        = runner
+        self.state         = "queued"
+        self.error         = None
+        self.progress: Dict[str, Any] = {
+            "stage"    : None,
+            "total"    : 0,
+            "documents": 0,
+            "chunks"   : 0,
+            "unchanged": 0,
+            "removed"  : 0,
+            "failed"   : 0,
+        }
+        self.created_at    = time.time()
+        self.started_at    = None
+        self.finished_at   = None
+        self._cancelled    = threading.Event()
+        self._resumed      = asyncio.Event()
+        self._resumed.set()
+        self._changed      = asyncio.Event()
+        self._finished     = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._finished.is_set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Requests cancellation; a paused job wakes up to abort."""
+        if self.done:
+            return
+        self._cancelled.set()
+        self._resumed.set()
+        self._notify()
+
+    def _check_cancelled(self):
+        if self.is_cancelled():
+            raise IngestionCancelled(f"Ingestion job {self.id} was cancelled, operation aborted.")
+
+    async def checkpoint(self):
+        """Awaited between units of work: raises if the job was cancelled, waits while it is paused."""
+        self._check_cancelled()
+        if not self._resumed.is_set():
+            await self._resumed.wait()
+            self._check_cancelled()
+
+    def pause(self):
+        if self._resumed.is_set() and not self.done:
+            self._resumed.clear()
+            self.state = "paused"
+            self._notify()
+
+    def resume(self):
+        if not self._resumed.is_set():
+            self._resumed.set()
+            self.state = "running"
+            self._notify()
+
+    def update(self, **progress):
+        """Updates progress counters (e.g. stage, documents, chunks)."""
+        self.progress.update(progress)
+        self._notify()
+
+    def _notify(self):
+        # Every watcher holds the event that was current when it last looked
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def _finish(self, state: str, error: str = None):
+        self.state       = state
+        self.error       = error
+        self.finished_at = time.time()
+        self._resumed.set()
+        self._finished.set()
+        self._notify()
+
+    async def wait(self):
+        await self._finished.wait()
+
+    async def watch(self, interval: float = 0.5):
+        """Yields progress snapshots as the job advances, at most one per interval, ending with the final one."""
+        while True:
+            changed = self._changed
+            yield self.snapshot()
+            if self.done:
+                return
+            await changed.wait()
+            if not self.done:
+                await asyncio.sleep(interval)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "job_id"     : self.id,
+            "state"      : self.state,
+            "priority"   : self.priority,
+            "progress"   : dict(self.progress),
+            "error"      : self.error,
+            "created_at" : self.created_at,
+            "started_at" : self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestionScheduler:
+    """
+    Priority queue of ingestion jobs. One job runs per priority level: a job with a
+    higher priority (lower value) starts right away and pauses the running lower
+    priority jobs at their next checkpoint; they resume once it is finished.
+    Jobs of the same priority run one after the other, in submission order.
+    """
+
+    def __init__(self, runner: Callable[[IngestionJob], Awaitable[None]], history: int = 100):
+        self.runner   = runner
+        self.history  = history
+        self._queue: List[tuple] = []
+        self._running: Dict[str, IngestionJob] = {}
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._counter = itertools.count()
+
+    def submit(self, paths: List[str], extensions: List[str], embedding_url: str, priority: int = BACKGROUND_PRIORITY,
+               runner: Optional[Callable[[IngestionJob], Awaitable[None]]] = None) -> IngestionJob:
+        """Queues a job and starts it if nothing of the same or a higher priority is running.
+        The job is run by runner if given, else by the scheduler's runner."""
+        job = IngestionJob(paths, extensions, embedding_url, priority, runner)
+        self._jobs[job.id] = job
+        heapq.heappush(self._queue, (priority, next(self._counter), job))
+        logger.info(f"Queued ingestion job {job.id} (priority {priority}) for {len(paths)} paths")
+        self._dispatch()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        return [job.snapshot() for job in self._jobs.values()]
+
+    def cancel(self, job_id: str = None) -> List[str]:
+        """Cancels one job, or every unfinished job if job_id is None. Returns the cancelled job ids."""
+        if job_id is not None:
+            jobs = [self._jobs[job_id]] if job_id in self._jobs else []
+        else:
+            jobs = list(self._jobs.values())
+        cancelled = []
+        for job in jobs:
+            if job.done:
+                continue
+            job.cancel()
+            cancelled.append(job.id)
+            if job.state == "queued":
+                job._finish("cancelled")
+        self._dispatch()
+        return cancelled
+
+    def _dispatch(self):
+        while self._queue:
+            priority, _, job = self._queue[0]
+            if job.done:
+                heapq.heappop(self._queue)
+                continue
+            if self._running and priority >= min(running.priority for running in self._running.values()):
+                break
+            heapq.heappop(self._queue)
+            self._running[job.id] = job
+            self._tasks[job.id] = asyncio.create_task(self._run(job))
+        if self._running:
+            top = min(job.priority for job in self._running.values())
+            for job in self._running.values():
+                if job.priority == top:
+                    job.resume()
+                else:
+                    job.pause()
+        self._trim_history()
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    async def _run(self, job: IngestionJob):
+        job.state      = "running"
+        job.started_at = time.time()
+        job._notify()
+        try:
+            await (job.runner or self.runner)(job)
+            job._finish("completed")
+        except asyncio.CancelledError:
+            job._finish("cancelled")
+            raise
+        except IngestionCancelled as e:
+            job._finish("cancelled", str(e))
+        except Exception as e:
+            if job.is_cancelled():
+                job._finish("cancelled", str(e))
+            else:
+                logger.error(f"Ingestion job {job.id} failed: {e}")
+                job._finish("failed", str(e))
+        finally:
+            self._running.pop(job.id, None)
+            self._tasks.pop(job.id, None)
+            logger.info(f"Ingestion job {job.id} {job.state}: {job.progress}")
+            self._dispatch()
+
+    async def shutdown(self):
+        """Cancels every job and waits for the running ones to stop."""
+        self.cancel()
+        tasks = list(self._tasks.values())
+        await asyncio.gather(*tasks, return_exceptions = True)
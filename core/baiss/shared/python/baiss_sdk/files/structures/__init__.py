@@ -8,9 +8,10 @@ import json
 import time
 import logging
 import mimetypes
+import stat
 from baiss_sdk import get_baiss_project_path
 from baisstools.files import findpath
-from typing                               import Dict, List
+from typing                               import Callable, Dict, List
 from baiss_sdk.utils                      import get_local_data_dir, load_system_prompt
 from baiss_sdk.files                      import file_reader
 from baiss_sdk.files                      import file_writer
@@ -19,8 +20,10 @@ from baiss_sdk.algorithms.beam            import Beam
 from baiss_sdk.algorithms.mcts            import MCTS
 import hashlib
 from baiss_sdk.db                         import DbProxyClient
+from baiss_sdk.files.scheduler            import IngestionCancelled
 # from baiss_sdk.algorithms.bfs             import Bfs
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 #TO DO : ADD field "file_hash" to the structure that has the hash of the file and can help to identify when the file has changed or duplications
 encoder = tiktoken.get_encoding("cl100k_base")
@@ -34,32 +37,163 @@ class TreeStructure:
         ) -> None:
         """
         Update file hashes in the database and clean up records for deleted files.
+        Only files whose (size, mtime_ns, inode) stat signature changed since the
+        last scan are re-hashed; everything else is skipped without being read.
         """
-        all_paths = db_client.get_all_paths()
-        for path in all_paths:
+        deleted_paths = []
+        changed_files = []
+        for path, file_hash, size, mtime_ns, inode in db_client.get_document_stats():
             local_path = path
             if path.startswith("file://"):
                 local_path = path[len("file://"):]
-            if not os.path.exists(local_path):
+            try:
+                file_stat = os.stat(local_path)
+            except (FileNotFoundError, NotADirectoryError):
                 logger.info(f"File no longer exists, deleting from database: {path}")
-                db_client.delete_by_paths([path])
+                deleted_paths.append(path)
                 continue
-            try:
-                current_hash = TreeStructure._calculate_file_hash(local_path)
-                if current_hash is None:
-                    continue
+            except OSError as e:
+                logger.warning(f"Failed to stat {path}: {e}")
+                continue
+            if stat.S_ISDIR(file_stat.st_mode):
+                continue
+            signature = TreeStructure._stat_signature(file_stat)
+            if file_hash and signature == (size, mtime_ns, inode):
+                continue
+            changed_files.append((path, local_path, signature))
 
-                if db_client.check_if_path_exist_or_changed(path, current_hash):
+        if deleted_paths:
+            db_client.delete_documents(deleted_paths)
+
+        if not changed_files:
+            return
+        # hashlib releases the GIL on large buffers, so hashing scales across threads
+        with ThreadPoolExecutor() as executor:
+            hashes = list(executor.map(
+                TreeStructure._calculate_file_hash, [local_path for _, local_path, _ in changed_files]
+            ))
+        updates = [
+            (path, current_hash, *signature)
+            for (path, _, signature), current_hash in zip(changed_files, hashes)
+            if current_hash is not None
+        ]
+        try:
+            db_client.update_document_stats(updates)
+            logger.info(f"Re-hashed {len(updates)} files with a changed stat signature")
+        except Exception as e:
+            logger.warning(f"Failed to update hashes: {e}")
+
+    @staticmethod
+    def _stat_signature(file_stat: os.stat_result, inode: int = None) -> tuple:
+        """Returns the (size, mtime_ns, inode) tuple used to detect changed files without reading them."""
+        if inode is None:
+            inode = file_stat.st_ino
+        # Some filesystems report 128-bit file ids, keep them within UBIGINT
+        return (file_stat.st_size, file_stat.st_mtime_ns, inode & 0xFFFFFFFFFFFFFFFF)
+
+    @staticmethod
+    def _scan_directory(
+            path               : str,
+            depth              : int,
+            extensions         : list[str],
+            excluded_extensions: list[str],
+            excluded_names     : list[str],
+            ignore_hidden      : bool,
+        ) -> tuple:
+        """
+        Lists one directory with os.scandir, reusing the stat data cached on each DirEntry.
+        Returns:
+            tuple: (files, subdirectories, children names), where files are
+                (local path, name, depth, stat signature) tuples at depth + 1.
+        """
+        files, subdirectories, children = [], [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                child_name = entry.name
+                if excluded_names and (child_name in excluded_names):
                     continue
+                if ignore_hidden and child_name.startswith('.'):
+                    continue
+                if entry.is_symlink(): # ignore symlinks
+                    continue
+                children.append(child_name)
+                if entry.is_dir(follow_symlinks = False):
+                    subdirectories.append(entry.path)
+                    continue
+                file_ext = TreeStructure.get_file_extension(child_name)
+                if extensions and (file_ext not in extensions):
+                    continue
+                if excluded_extensions and (file_ext in excluded_extensions):
+                    continue
+                try:
+                    # On Windows the scandir stat has no file id, inode() fetches it
+                    signature = TreeStructure._stat_signature(entry.stat(follow_symlinks = False), entry.inode())
+                except OSError as e:
+                    logger.warning(f"Could not stat {entry.path}: {e}")
+                    continue
+                files.append((entry.path, child_name, depth + 1, signature))
+        return files, subdirectories, children
 
-                # Update hash in database
-                db_client.execute_query(
-                    f"UPDATE BaissDocuments SET hash = '{current_hash}', processed = FALSE WHERE path = '{path}'"
-                )
-                logger.info(f"Updated hash for {path}")
-            except Exception as e:
-                logger.warning(f"Failed to update hash for {path}: {e}")
+    @staticmethod
+    def _db_path(local_path: str, path_scheme: str) -> str:
+        """Maintains the original path scheme for walked paths."""
+        return ("file://" + local_path) if path_scheme == "file://" else local_path
 
+    @staticmethod
+    def _flush_documents(
+            db_client  : DbProxyClient,
+            files      : list[tuple],
+            folders    : list[dict],
+            path_scheme: str,
+            executor   : ThreadPoolExecutor,
+        ) -> None:
+        """
+        Diffs a batch of walked files against BaissDocuments with one query, hashes only
+        the new or changed ones and writes them with one set-based statement each.
+        """
+        paths = [TreeStructure._db_path(local_path, path_scheme) for local_path, _, _, _ in files] + [folder["path"] for folder in folders]
+        existing = {row[0]: row[1:] for row in db_client.get_document_stats(paths)}
+
+        candidates = []
+        for (local_path, name, depth, signature), path in zip(files, paths):
+            stored = existing.get(path)
+            if stored is not None and stored[0] and tuple(stored[1:]) == signature:
+                continue
+            candidates.append((path, local_path, name, depth, signature, stored is not None))
+        hashes = list(executor.map(
+            TreeStructure._calculate_file_hash, [candidate[1] for candidate in candidates]
+        ))
+
+        new_rows, changed = [], []
+        for (path, local_path, name, depth, signature, exists), file_hash in zip(candidates, hashes):
+            if file_hash is None:
+                continue
+            if exists:
+                changed.append((path, file_hash, *signature))
+                continue
+            size, mtime_ns, inode = signature
+            new_rows.append({
+                "path"         : path,
+                "hash"         : file_hash,
+                "depth"        : depth,
+                "name"         : name,
+                "type"         : "file",
+                "keywords"     : "[]",  # Empty JSON array as string
+                "content_type" : TreeStructure.content_type(local_path),
+                "last_modified": datetime.now(),
+                "processed"    : False,
+                "size"         : size,
+                "mtime_ns"     : mtime_ns,
+                "inode"        : inode
+            })
+        new_rows.extend(folder for folder in folders if folder["path"] not in existing)
+
+        if new_rows:
+            db_client.insert_documents(new_rows)
+            logger.info(f"Inserted {len(new_rows)} document records")
+        if changed:
+            db_client.update_document_stats(changed)
+            logger.info(f"Updated {len(changed)} changed document records")
 
     @staticmethod
     def _generate_db(
@@ -72,23 +206,26 @@ class TreeStructure:
             max_depth          : int            = 5,
             depth              : int            = 0,
             db_client         : DbProxyClient = None,
+            batch_size         : int            = 5000,
+            max_workers        : int            = None,
+            is_cancelled       : Callable[[], bool] = None,
         ) -> None:
         """
-        Internal recursive function for database generation.
+        Walks a file or directory tree and records new or changed documents in the database.
+        Directories are listed iteratively with os.scandir, in parallel across subdirectories
+        on a thread pool, and documents are diffed and inserted in batches of batch_size.
+        is_cancelled is polled between directory listings to abort the walk.
         """
-        # Stop recursion if max depth is reached
-        if depth > max_depth:
-            return
-
         if db_client is None:
             raise ValueError("Db client cannot be None.")
-        from baiss_agents.app.core.config import global_token
-        if global_token == True:
-            raise Exception("Global token set to True, operation aborted.")
+        is_cancelled = is_cancelled or (lambda: False)
+        if is_cancelled():
+            raise IngestionCancelled("Scan cancelled, operation aborted.")
+        if depth > max_depth:
+            return
 
         original_path = path
         extensions = TreeStructure.norm_extensions(extensions)
-        # logging.info(f"Normalized extensions: {extensions}")
         excluded_extensions = TreeStructure.norm_extensions(excluded_extensions)
         path_scheme = TreeStructure.get_path_scheme(original_path)
 
@@ -105,132 +242,78 @@ class TreeStructure:
 
         basename = original_path.split("/")[-1]
         logger.info(f"Processing basename: {basename}")
-        # Handle single file
-        if not os.path.isdir(path):
-            if global_token == True:
-                raise Exception("Global token set to True, operation aborted.")
-            file_ext = TreeStructure.get_file_extension(basename)
-            if excluded_names and (basename in excluded_names):
-                # logging.info(f"Excluded file: {basename}")
-                return
-            if ignore_hidden and basename.startswith('.'):
-                # logging.info(f"Ignored hidden file: {basename}")
-                return
-            # TODO: Update this part later
-            if extensions and (file_ext not in extensions):
-                # logging.info(f"Excluded file by extension: {basename} ({file_ext})")
-                return
-            if excluded_extensions and (file_ext in excluded_extensions):
-                # logging.info(f"Excluded file by excluded extension: {basename} ({file_ext})")
-                return
-
-
-            logger.info(f"Processing file: {original_path} with extension: {file_ext}")
-
-            file_hash = None
-            try:
-                file_hash = TreeStructure._calculate_file_hash(path)
-            except Exception as e:
-                logging.warning(f"Could not calculate hash for {path}: {e}")
-                file_hash = None
-
-            # Insert into database
-            try:
-                # Check if file already exists in database
-                existing_files = db_client.check_if_path_exist_or_changed(original_path, file_hash)
-                logging.info(f"Existing files check for {original_path}: {existing_files}")
-                if not existing_files and file_hash is not None:
-                    logging.info(f"Inserting new file record for: {original_path}")
-
-                    db_row = {
-                        "path": original_path,
-                        "hash": file_hash,
-                        "depth": depth,
-                        "name": basename,
-                        "type": "file",
-                        "keywords": "[]",  # Empty JSON array as string
-                        "content_type": TreeStructure.content_type(path),
-                        "last_modified": datetime.now(),
-                        "processed": False
-                    }
-                    db_client.insert_rows("BaissDocuments", [db_row])
-                    logging.info(f"Inserted file record for: {original_path}")
-                elif file_hash is None:
-                    logging.info(f"File already exists in database: {original_path}")
 
-            except Exception as e:
-                logging.warning(f"Failed to insert file record for {original_path}: {e}")
-            return
-
-        # Handle directory
-        children = []
-        try:
-            for child_name in os.listdir(path):
-                child_path = os.path.realpath(os.path.join(path, child_name))
-                if global_token == True:
-                    raise Exception("Global token set to True, operation aborted.")
-                if child_path != os.path.join(path, child_name): # ignore symlinks
-                    continue
-                if excluded_names and (child_name in excluded_names):
-                    continue
-                if ignore_hidden and child_name.startswith('.'):
-                    continue
-                children.append(child_name)
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            # Handle single file
+            if not os.path.isdir(path):
+                file_ext = TreeStructure.get_file_extension(basename)
+                if excluded_names and (basename in excluded_names):
+                    return
+                if ignore_hidden and basename.startswith('.'):
+                    return
+                if extensions and (file_ext not in extensions):
+                    return
+                if excluded_extensions and (file_ext in excluded_extensions):
+                    return
+                signature = TreeStructure._stat_signature(os.stat(path))
+                # A single file keeps the path it was given
+                single_file_scheme = "file://" if original_path.startswith("file://") else None
+                TreeStructure._flush_documents(
+                    db_client, [(path, basename, depth, signature)], [], single_file_scheme, executor
+                )
+                return
 
-                # Maintain original path scheme for recursive calls
-                if path_scheme == "file://":
-                    recursive_path = "file://" + child_path
-                else:
-                    recursive_path = child_path
-
-                TreeStructure._generate_db(
-                    path=recursive_path,
-                    extensions=extensions,
-                    excluded_extensions=excluded_extensions,
-                    excluded_names=excluded_names,
-                    ignore_hidden=ignore_hidden,
-                    ignore_folders=ignore_folders,
-                    max_depth=max_depth,
-                    depth=depth + 1,
-                    db_client=db_client
+            # Handle directory
+            files, folders = [], []
+            pending = {}
+            def scan(dir_path: str, dir_depth: int):
+                if dir_depth + 1 > max_depth:
+                    return
+                future = executor.submit(
+                    TreeStructure._scan_directory,
+                    dir_path, dir_depth, extensions, excluded_extensions, excluded_names, ignore_hidden
                 )
-        except PermissionError as e:
-            logger.warning(f"Permission denied accessing directory {path}: {e}")
-            return
-        except Exception as e:
-            logger.error(f"Error processing directory {path}: {e}")
-            return
+                pending[future] = (dir_path, dir_depth)
 
-        # Insert folder record if not ignoring folders
-        if not ignore_folders:
+            scan(path, depth)
             try:
-                # Check if folder already exists in database
-                existing_folders = db_client.execute_query(f"SELECT path FROM BaissDocuments WHERE path = '{original_path}'")
-                if not existing_folders:
-                    # Calculate directory hash differently (based on contents)
-                    dir_hash = None
-                    try:
-                        dir_hash = hashlib.sha256(str(sorted(children)).encode()).hexdigest()
-                    except Exception as e:
-                        logger.warning(f"Could not calculate hash for directory {path}: {e}")
-                        dir_hash = ""
-
-                    db_row = {
-                        "path": original_path,
-                        "hash": dir_hash,
-                        "depth": depth,
-                        "name": basename,
-                        "type": "folder",
-                        "keywords": "[]",
-                        "content_type": None,
-                        "last_modified": datetime.datetime.now()
-                    }
-                    db_client.insert_rows("BaissDocuments", [db_row])
-                    logging.info(f"Inserted folder record for: {original_path}")
-                else:
-                    logging.info(f"Folder already exists in database: {original_path}")
-            except Exception as e:
-                logger.warning(f"Failed to insert folder record for {original_path}: {e}")
+                while pending:
+                    done, _ = wait(list(pending), return_when = FIRST_COMPLETED)
+                    if is_cancelled():
+                        raise IngestionCancelled("Scan cancelled, operation aborted.")
+                    for future in done:
+                        dir_path, dir_depth = pending.pop(future)
+                        try:
+                            dir_files, subdirectories, children = future.result()
+                        except PermissionError as e:
+                            logger.warning(f"Permission denied accessing directory {dir_path}: {e}")
+                            continue
+                        except OSError as e:
+                            logger.error(f"Error processing directory {dir_path}: {e}")
+                            continue
+                        files.extend(dir_files)
+                        for subdirectory in subdirectories:
+                            scan(subdirectory, dir_depth + 1)
+                        if not ignore_folders:
+                            # Folder hash is based on its contents
+                            folders.append({
+                                "path"         : original_path if dir_path == path else TreeStructure._db_path(dir_path, path_scheme),
+                                "hash"         : hashlib.sha256(str(sorted(children)).encode()).hexdigest(),
+                                "depth"        : dir_depth,
+                                "name"         : os.path.basename(dir_path.rstrip("/\\")),
+                                "type"         : "folder",
+                                "keywords"     : "[]",
+                                "content_type" : None,
+                                "last_modified": datetime.now()
+                            })
+                    if len(files) + len(folders) >= batch_size:
+                        TreeStructure._flush_documents(db_client, files, folders, path_scheme, executor)
+                        files, folders = [], []
+                TreeStructure._flush_documents(db_client, files, folders, path_scheme, executor)
+            finally:
+                for future in pending:
+                    future.cancel()
+
     @staticmethod
     def generate(
             path               : str,
@@ -359,8 +442,8 @@ class TreeStructure:
         sha256_hash = hashlib.sha256()
         try:
             with open(file_path, "rb") as f:
-                # Read and update hash in chunks of 4K
-                for byte_block in iter(lambda: f.read(4096), b""):
+                # Read and update hash in chunks of 1M
+                for byte_block in iter(lambda: f.read(1024 * 1024), b""):
                     sha256_hash.update(byte_block)
             return sha256_hash.hexdigest()
         except (IOError, FileNotFoundError) as e:
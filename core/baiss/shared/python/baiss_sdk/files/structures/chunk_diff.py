@@ -0,0 +1,62 @@
+import json
+import hashlib
+import logging
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def chunk_hash(row: Dict[str, Any]) -> str:
+    """Hashes the chunk text together with its metadata (page number, row range, ...)."""
+    metadata = json.dumps(row.get("metadata"), sort_keys = True, default = str)
+    return hashlib.sha256(f"{row['chunk_content']}\x00{metadata}".encode("utf-8")).hexdigest()
+
+class ChunkDiff:
+    """
+    Incremental form of diff_chunks, for documents whose chunks arrive in parts
+    (e.g. PDF page ranges): add() each part, then removed_ids() once all parts are in.
+    """
+
+    def __init__(self, stored: Dict[Optional[str], List[int]]):
+        self.stored    = stored
+        self.available = {key: list(ids) for key, ids in stored.items() if key is not None}
+
+    def add(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Sets "chunk_hash" on every row and returns the rows that are not stored yet."""
+        new_rows = []
+        for row in rows:
+            row["chunk_hash"] = chunk_hash(row)
+            ids = self.available.get(row["chunk_hash"])
+            if ids:
+                ids.pop()
+            else:
+                new_rows.append(row)
+        return new_rows
+
+    def removed_ids(self) -> List[int]:
+        # Chunks written before chunk hashes existed (None key) are always replaced
+        return [id for key, ids in self.stored.items() for id in (ids if key is None else self.available[key])]
+
+def diff_chunks(rows: List[Dict[str, Any]], stored: Dict[Optional[str], List[int]]) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """
+    Diffs freshly parsed chunk rows against the chunks stored for the same document.
+    Sets "chunk_hash" on every row. Identical chunks may repeat within a document,
+    so each stored id is matched at most once.
+    Args:
+        rows (List[Dict[str, Any]]): The parsed BaissChunks rows of the document.
+        stored (Dict[Optional[str], List[int]]): Stored chunk ids keyed by chunk hash, as returned by get_chunk_hashes.
+    Returns:
+        Tuple[List[Dict[str, Any]], List[int]]: The rows to embed and insert, and the ids of the stored chunks to delete.
+    """
+    diff = ChunkDiff(stored)
+    new_rows = diff.add(rows)
+    return new_rows, diff.removed_ids()
+
+def diff_document_chunks(db_client, path: str, rows: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """Loads the stored chunk hashes of one document and diffs them against rows, see diff_chunks."""
+    stored = db_client.get_chunk_hashes([path]).get(path, {})
+    new_rows, removed_ids = diff_chunks(rows, stored)
+    if stored:
+        logger.info(f"Chunk diff for {path}: {len(rows) - len(new_rows)} unchanged, {len(new_rows)} new, {len(removed_ids)} removed")
+    return new_rows, removed_ids
@@ -10,8 +10,6 @@ baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
 from typing import Optional, List, Dict
 # Import the ExcelParser from its assumed location
 from baiss_sdk.parsers.excel_extractor import ExcelParser
-from baiss_sdk.db import DbProxyClient
-from baiss_sdk.files.embeddings import Embeddings
 from datetime import datetime
 
 class ExcelTreeStructure:
@@ -84,38 +82,35 @@ class ExcelTreeStructure:
         structure["files"] = files_structure
         return structure
 
-    @staticmethod
-    async def update_excel_tree_structure_v2(path: str, id: str, content_type: str, db_client: DbProxyClient):
+    # Documents without any row are still marked as processed
+    processed_when_empty = True
 
+    @staticmethod
+    def parse_rows(path: str, id: str, content_type: str) -> Optional[List[Dict]]:
+        """
+        Parses a Excel file into BaissChunks rows, without embeddings.
+        This runs in the ingestion worker processes, so it must not touch the database.
+        Returns None if the document cannot be parsed.
+        """
         rows = []
-        from baiss_agents.app.core.config import global_token,  embedding_url
-        if global_token == True:
-            raise Exception("Global token set to True, operation aborted.")
-        db_client.check_if_path_in_chunks_and_delete(path)
+        excel_parser = ExcelParser()
         try:
-            excel_parser = ExcelParser()
-            embedding = Embeddings(url=embedding_url)
-            try:
-                parsed_document = excel_parser.parse(path)
-            except Exception as e:
-                print(f"Error parsing Excel document at {path}: {e}")
-                db_client.update_document_processed_status(path, True)
-                return
-            for row in parsed_document:
-                rows.append({
-                    "baiss_id": id,
-                    "chunk_content": row["content"],
-                    "embedding": await embedding.embed(row["content"]),
-                    "metadata": row["metadata"],
-                    "path": path,
-                    "keywords": None,  # TODO: add function to extract keywords
-                    "content_type": content_type,
-                    "last_modified": datetime.now()
-                    })
-            db_client.insert_rows("BaissChunks", rows)
-            db_client.update_document_processed_status(path, True)
+            parsed_document = excel_parser.parse(path)
         except Exception as e:
-            print(f"Error updating Excel tree structure for file {path}: {e}")
+            print(f"Error parsing Excel document at {path}: {e}")
+            return None
+        for row in parsed_document:
+            rows.append({
+                "baiss_id": id,
+                "chunk_content": row["content"],
+                "embedding": None,
+                "metadata": row["metadata"],
+                "path": path,
+                "keywords": None,  # TODO: add function to extract keywords
+                "content_type": content_type,
+                "last_modified": datetime.now()
+                })
+        return rows
 
 
 if __name__ == "__main__":
@@ -5,10 +5,11 @@ import baisstools
 baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
 from typing import Optional, List, Dict
 from baiss_sdk.parsers.pdf_extractor import PDFParser
-from baiss_sdk.db import DbProxyClient
-from baiss_sdk.files.embeddings import Embeddings
 from datetime import datetime
 import logging
+
+logger = logging.getLogger(__name__)
+
 class PdfTreeStructure:
 
     @staticmethod
@@ -37,45 +38,64 @@ class PdfTreeStructure:
         return True
 
 
+    # Documents without any chunk stay unprocessed so the next scan retries them
+    processed_when_empty = False
+
+    # Documents with more pages are parsed in page ranges spread over the ingestion workers
+    pages_per_range = 32
+
+    @staticmethod
+    def _page_rows(page: Dict, path: str, id: str, content_type: str) -> List[Dict]:
+        rows = []
+        for chunk in page["chunks"]:
+            metadata = {
+                    "page_number": page["page_number"],
+                    "token_count": chunk["token_count"]
+                }
+            rows.append({
+                    "baiss_id": id,
+                    "chunk_content": chunk["full_text"],
+                    "embedding": None,
+                    "metadata": metadata,
+                    "path": path,
+                    "keywords": None, # TODO: add function to extract keywords
+                    "content_type": content_type,
+                    "last_modified": datetime.now()
+                })
+        return rows
+
+    @staticmethod
+    def parse_rows(path: str, id: str, content_type: str) -> Optional[List[Dict]]:
+        """
+        Parses a PDF into BaissChunks rows, without embeddings.
+        This runs in the ingestion worker processes, so it must not touch the database.
+        Returns None if the document cannot be parsed.
+        """
+        return PdfTreeStructure.parse_range_rows(path, id, content_type, 1, None)
+
     @staticmethod
-    async def update_pdf_tree_structure_v2(path: str, id: str, content_type: str, db_client: DbProxyClient):
+    def parse_ranges(path: str) -> Optional[List[tuple]]:
+        """
+        Returns the (first, last) page ranges the ingestion pipeline parses in parallel,
+        or None when the document fits in a single range.
+        """
+        ranges = PDFParser.page_ranges(PDFParser.page_count(path), PdfTreeStructure.pages_per_range)
+        return ranges if len(ranges) > 1 else None
 
+    @staticmethod
+    def parse_range_rows(path: str, id: str, content_type: str, first_page: int, last_page: Optional[int]) -> Optional[List[Dict]]:
+        """
+        Parses an inclusive page range into BaissChunks rows (to the last page if last_page is None).
+        Returns None if the range cannot be parsed.
+        """
         rows = []
-        from baiss_agents.app.core.config import global_token,  embedding_url
-        if global_token == True:
-            raise Exception("Global token set to True, operation aborted.")
-        db_client.check_if_path_in_chunks_and_delete(path)
         try:
-            pdf_parser = PDFParser()
-            embedding = Embeddings(url = embedding_url)
-            try:
-                parsed_document = pdf_parser.parse_pdf(path)
-            except Exception as e:
-                print(f"Error parsing PDF document at {path}: {e}")
-                db_client.update_document_processed_status(path, True)
-                return
-            for page in parsed_document:
-                # logging.info(f"page content: {page.keys()}")
-                for chunk in page["chunks"]:
-                    metadata = {
-                            "page_number": page["page_number"],
-                            "token_count": chunk["token_count"]
-                        }
-                    rows.append({
-                            "baiss_id": id,
-                            "chunk_content": chunk["full_text"],
-                            "embedding": await embedding.embed(chunk["full_text"]),
-                            "metadata": metadata,
-                            "path": path,
-                            "keywords": None, # TODO: add function to extract keywords
-                            "content_type": content_type,
-                            "last_modified": datetime.now()
-                        })
-            if rows:
-                db_client.insert_rows("BaissChunks", rows)
-                db_client.update_document_processed_status(path, True)
+            for page in PDFParser().iter_pages(path, first_page, last_page):
+                rows.extend(PdfTreeStructure._page_rows(page, path, id, content_type))
         except Exception as e:
-            print(f"Error updating PDF tree structure for file {path}: {e}")
+            logger.error(f"Error parsing PDF document at {path}: {e}")
+            return None
+        return rows
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,387 @@
+import os
+import asyncio
+import logging
+import threading
+import multiprocessing
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from baiss_sdk.db import DbProxyClient
+from baiss_sdk.files.embeddings import Embeddings, EmbeddingCache
+from baiss_sdk.files.scheduler import IngestionCancelled
+from baiss_sdk.files.structures.chunk_diff import ChunkDiff, diff_document_chunks
+from baiss_sdk.files.structures.pdf_tree_structure   import PdfTreeStructure
+from baiss_sdk.files.structures.csv_tree_structure   import CsvTreeStructure
+from baiss_sdk.files.structures.excel_tree_structure import ExcelTreeStructure
+from baiss_sdk.files.structures.text_tree_structure  import TextTreeStructure
+from baiss_sdk.files.structures.md_tree_structure    import MdTreeStructure
+
+logger = logging.getLogger(__name__)
+
+STRUCTURES_BY_CONTENT_TYPE = {
+    "md"                                                                : MdTreeStructure,
+    "csv"                                                               : CsvTreeStructure,
+    "text/csv"                                                          : CsvTreeStructure,
+    "pdf"                                                               : PdfTreeStructure,
+    "application/pdf"                                                   : PdfTreeStructure,
+    "txt"                                                               : TextTreeStructure,
+    "docx"                                                              : TextTreeStructure,
+    "text/plain"                                                        : TextTreeStructure,
+    "xls"                                                               : ExcelTreeStructure,
+    "xlsx"                                                              : ExcelTreeStructure,
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" : ExcelTreeStructure,
+}
+
+def get_structure(content_type: str):
+    """Returns the tree structure class that ingests the given content type."""
+    if content_type == "google-drive":
+        raise NotImplementedError("Google Drive structure processing is not implemented yet.")
+    structure = STRUCTURES_BY_CONTENT_TYPE.get(content_type)
+    if structure is None:
+        raise ValueError(f"Unknown structure type: {content_type}")
+    return structure
+
+_parse_executor: Optional[ProcessPoolExecutor] = None
+_parse_executor_lock = threading.Lock()
+
+def parse_executor() -> ProcessPoolExecutor:
+    """
+    The process pool the pipelines parse documents on, one per process: created on first use
+    with a worker per CPU and kept until shutdown_parse_executor (app lifespan, see main.py).
+    Spawned workers do not inherit the server threads or the open database connection, and
+    are started on demand.
+    """
+    global _parse_executor
+    with _parse_executor_lock:
+        # A worker that died (e.g. killed for its memory) breaks the whole pool
+        if _parse_executor is None or _parse_executor._broken:
+            _parse_executor = ProcessPoolExecutor(
+                max_workers = os.cpu_count() or 1,
+                mp_context  = multiprocessing.get_context("spawn")
+            )
+        return _parse_executor
+
+def shutdown_parse_executor():
+    """Stops the parse workers; parses still queued are cancelled."""
+    global _parse_executor
+    with _parse_executor_lock:
+        executor, _parse_executor = _parse_executor, None
+    if executor is not None:
+        executor.shutdown(wait = False, cancel_futures = True)
+
+def _parse_document(path: str, id: str, content_type: str) -> Optional[List[Dict[str, Any]]]:
+    """Worker process entry point: parses one document into chunk rows."""
+    return get_structure(content_type).parse_rows(path, id, content_type)
+
+def _document_ranges(path: str, content_type: str) -> Optional[List[tuple]]:
+    """Worker process entry point: splits a large document into ranges parsed in parallel, None to parse it whole."""
+    structure = get_structure(content_type)
+    if not hasattr(structure, "parse_ranges"):
+        return None
+    return structure.parse_ranges(path)
+
+def _parse_document_range(path: str, id: str, content_type: str, first: int, last: int) -> Optional[List[Dict[str, Any]]]:
+    """Worker process entry point: parses one range (e.g. PDF pages first..last) into chunk rows."""
+    return get_structure(content_type).parse_range_rows(path, id, content_type, first, last)
+
+class _PartedDocument:
+    """A large document parsed in ranges: each part is diffed, embedded and written as soon as it is parsed."""
+
+    def __init__(self, parts: int):
+        self.parts     = parts
+        self.written   = 0
+        self.failed    = 0
+        # Parts whose chunks could not be written
+        self.unwritten = 0
+        self.rows      = 0
+        self.diff: Optional[ChunkDiff] = None
+
+class IngestionPipeline:
+    """
+    Staged ingestion of unprocessed documents:
+        parse (process pool shared by the pipelines) -> embed (async workers) -> write (single batched writer)
+    Stages are connected by bounded queues, so parsing, embedding and database
+    writes overlap instead of running one document at a time.
+    Re-ingested documents are diffed chunk by chunk against the stored chunk
+    hashes, so only new chunks are embedded and written.
+    Large documents whose structure defines parse_ranges (PDFs) are split into
+    ranges parsed by several workers; the first pages are embedded and written
+    while the rest of the document is still being parsed.
+    All database access happens on the event loop thread, in the embed stage
+    (chunk diff, embedding cache) and in the writer.
+    """
+
+    def __init__(
+            self,
+            db_client       : DbProxyClient,
+            embedding       : Embeddings,
+            cache           : EmbeddingCache = None,
+            parse_workers   : int = None,
+            embed_workers   : int = None,
+            queue_size      : int = None,
+            write_batch_rows: int = 2000,
+            is_cancelled    : Callable[[], bool] = None,
+            checkpoint      : Callable[[], Awaitable[None]] = None,
+            on_progress     : Callable[[Dict[str, int]], None] = None
+        ):
+        self.db_client        = db_client
+        self.embedding        = embedding
+        self.cache            = cache
+        # Parses the pipeline keeps in flight on the shared pool (see parse_executor)
+        self.parse_workers    = max(1, int(parse_workers or os.cpu_count() or 1))
+        self.embed_workers    = max(1, int(embed_workers or embedding.max_concurrency))
+        self.queue_size       = max(1, int(queue_size or 2 * self.parse_workers))
+        self.write_batch_rows = max(1, int(write_batch_rows))
+        self.is_cancelled     = is_cancelled or (lambda: False)
+        # Awaited before each document is parsed and embedded, lets a scheduler pause the pipeline
+        self.checkpoint       = checkpoint
+        self.on_progress      = on_progress
+        self.stats            = {"documents": 0, "chunks": 0, "unchanged": 0, "removed": 0, "failed": 0}
+
+    def _check_cancelled(self):
+        if self.is_cancelled():
+            raise IngestionCancelled("Ingestion cancelled, operation aborted.")
+
+    async def _wait_turn(self):
+        self._check_cancelled()
+        if self.checkpoint is not None:
+            await self.checkpoint()
+
+    def _report(self):
+        if self.on_progress is not None:
+            self.on_progress(dict(self.stats))
+
+    async def _parse_stage(self, documents: List[tuple], executor: ProcessPoolExecutor, parsed_queue: asyncio.Queue):
+        loop      = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(self.queue_size)
+
+        async def parse_one(path: str, id: str, content_type: str):
+            try:
+                try:
+                    ranges = await loop.run_in_executor(executor, _document_ranges, path, content_type)
+                except Exception as e:
+                    # Parsing it whole reports the error the usual way
+                    logger.warning(f"Cannot split document {path}: {e}")
+                    ranges = None
+                if ranges:
+                    await parse_parts(path, id, content_type, ranges)
+                    return
+                try:
+                    rows = await loop.run_in_executor(executor, _parse_document, path, id, content_type)
+                except Exception as e:
+                    logger.error(f"Error parsing document {path}: {e}")
+                    self.stats["failed"] += 1
+                    self._report()
+                    return
+                await parsed_queue.put((path, content_type, rows, None))
+            finally:
+                in_flight.release()
+
+        async def parse_parts(path: str, id: str, content_type: str, ranges: List[tuple]):
+            document = _PartedDocument(len(ranges))
+            futures  = [
+                loop.run_in_executor(executor, _parse_document_range, path, id, content_type, first, last)
+                for first, last in ranges
+            ]
+            try:
+                for future in asyncio.as_completed(futures):
+                    try:
+                        rows = await future
+                    except Exception as e:
+                        logger.error(f"Error parsing part of document {path}: {e}")
+                        rows = None
+                    await parsed_queue.put((path, content_type, rows, document))
+            finally:
+                # The pool is shared: parts still queued must not outlive the run
+                for future in futures:
+                    future.cancel()
+
+        tasks = []
+        try:
+            for path, id, content_type in documents:
+                await in_flight.acquire()
+                await self._wait_turn()
+                tasks.append(asyncio.create_task(parse_one(path, id, content_type)))
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for _ in range(self.embed_workers):
+            await parsed_queue.put(None)
+
+    async def _embed_stage(self, parsed_queue: asyncio.Queue, write_queue: asyncio.Queue):
+        while True:
+            item = await parsed_queue.get()
+            if item is None:
+                break
+            await self._wait_turn()
+            path, content_type, rows, document = item
+            new_rows, removed_ids = [], []
+            # Unchanged chunks keep their ids and embeddings
+            if document is not None:
+                if document.diff is None:
+                    document.diff = ChunkDiff(self.db_client.get_chunk_hashes([path]).get(path, {}))
+                if rows is not None:
+                    new_rows = document.diff.add(rows)
+            elif rows is not None:
+                new_rows, removed_ids = diff_document_chunks(self.db_client, path, rows)
+            if new_rows:
+                embeddings = await self.embedding.embed_many(
+                    [row["chunk_content"] for row in new_rows], cache = self.cache
+                )
+                model = await self.embedding.model_id()
+                if model == self.embedding.base_url:
+                    # The server did not report its model, the URL identifies none
+                    model = None
+                for row, row_embedding in zip(new_rows, embeddings):
+                    row["embedding"] = row_embedding
+                    row["embedding_model"] = model
+            await write_queue.put((path, content_type, rows, new_rows, removed_ids, document))
+        await write_queue.put(None)
+
+    @staticmethod
+    def _settle_part(item: tuple) -> bool:
+        """Counts a part of a parted document handed to the writer, returns whether it is the last one."""
+        document_rows, document = item[2], item[5]
+        document.written += 1
+        document.failed  += document_rows is None
+        document.rows    += len(document_rows or [])
+        return document.written == document.parts
+
+    def _plan(self, item: tuple, settles: bool) -> Dict[str, Any]:
+        """What writing one item of the write queue changes; settles tells whether it completes its document."""
+        path, content_type, document_rows, new_rows, document_removed_ids, document = item
+        plan = {
+            "paths"    : [],
+            "rows"     : list(new_rows),
+            "processed": [],
+            "removed"  : list(document_removed_ids),
+            "unchanged": len(document_rows or []) - len(new_rows),
+            "failed"   : 0,
+            # Parts that could not be parsed, by processed path
+            "parts"    : {},
+        }
+        if document is None:
+            parsed, has_rows = document_rows is not None, bool(document_rows)
+        elif not settles:
+            # Parts are written as they come, the document is settled with its last part
+            return plan
+        else:
+            parsed, has_rows = document.failed < document.parts, document.rows > 0
+            if parsed and document.unwritten:
+                # The stored chunks are kept and the next scan ingests the document again
+                logger.warning(f"{document.unwritten} of {document.parts} parts of {path} could not be written, leaving it unprocessed")
+                plan["failed"] = 1
+                return plan
+            if parsed and document.failed:
+                # Stale chunks cannot be told apart from those of the failed parts, so all stored chunks
+                # are kept. Parsing it again would fail the same way: the document is processed with its
+                # number of failed parts, and only ingested again once it changes
+                logger.warning(f"{document.failed} of {document.parts} parts of {path} could not be parsed, keeping its stored chunks")
+                plan["processed"].append(path)
+                plan["parts"][path] = document.failed
+                return plan
+            if parsed:
+                plan["removed"].extend(document.diff.removed_ids())
+        if not parsed:
+            # The document could not be parsed, drop its chunks and do not retry it on every scan
+            plan["paths"].append(path)
+            plan["processed"].append(path)
+        elif has_rows or get_structure(content_type).processed_when_empty:
+            plan["processed"].append(path)
+        else:
+            logger.warning(f"No chunks were extracted from file: {path}")
+        return plan
+
+    def _write_plans(self, plans: List[Dict[str, Any]]):
+        self.db_client.write_document_chunks(
+            [path for plan in plans for path in plan["paths"]],
+            [row for plan in plans for row in plan["rows"]],
+            [path for plan in plans for path in plan["processed"]],
+            [id for plan in plans for id in plan["removed"]],
+            {path: failed for plan in plans for path, failed in plan["parts"].items()}
+        )
+        for plan in plans:
+            self.stats["documents"] += len(plan["processed"])
+            self.stats["chunks"]    += len(plan["rows"])
+            self.stats["removed"]   += len(plan["removed"])
+            self.stats["unchanged"] += plan["unchanged"]
+            self.stats["failed"]    += plan["failed"]
+        self._report()
+
+    def _write_failed(self, item: tuple, settles: bool, error: Exception):
+        path, document = item[0], item[5]
+        logger.error(f"Error writing document {path}: {error}")
+        if document is not None:
+            document.unwritten += 1
+        if document is None or settles:
+            self.stats["failed"] += 1
+        self._report()
+
+    def _write_batch(self, batch: List[tuple]):
+        """
+        Writes a batch of the write queue in one transaction. If it fails, its documents are
+        written one by one, so that a document that cannot be written does not take the others
+        (or the rest of the run) down with it; it stays unprocessed and is counted as failed.
+        """
+        settles = [item[5] is None or self._settle_part(item) for item in batch]
+        try:
+            self._write_plans([self._plan(item, last) for item, last in zip(batch, settles)])
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                self._write_failed(batch[0], settles[0], e)
+                return
+            logger.error(f"Error writing a batch of {len(batch)} documents, writing them one by one: {e}")
+        for item, last in zip(batch, settles):
+            try:
+                # Planned again: a part of the same document that failed meanwhile keeps it unprocessed
+                self._write_plans([self._plan(item, last)])
+            except Exception as e:
+                self._write_failed(item, last, e)
+
+    async def _write_stage(self, write_queue: asyncio.Queue):
+        running = self.embed_workers
+        while running:
+            batch = [await write_queue.get()]
+            # Drain whatever is already waiting, up to the batch size
+            while write_queue.qsize() and sum(len(item[3]) for item in batch if item) < self.write_batch_rows:
+                batch.append(write_queue.get_nowait())
+            running -= sum(1 for item in batch if item is None)
+            batch = [item for item in batch if item is not None]
+            if batch:
+                self._check_cancelled()
+                self._write_batch(batch)
+
+    async def run(self, documents: List[tuple]) -> Dict[str, int]:
+        """
+        Ingests documents through the pipeline.
+        Args:
+            documents (List[tuple]): (path, id, content_type) tuples, as returned by retrieve_unprocessed_files.
+        Returns:
+            Dict[str, int]: Number of documents written, chunks written, kept unchanged and removed, and documents that failed.
+        """
+        if not documents:
+            return self.stats
+        for _, _, content_type in documents:
+            get_structure(content_type)
+
+        parsed_queue = asyncio.Queue(maxsize = self.queue_size)
+        write_queue  = asyncio.Queue(maxsize = self.queue_size)
+        # Large documents use several workers of the shared pool
+        executor = parse_executor()
+        tasks = [
+            asyncio.create_task(self._parse_stage(documents, executor, parsed_queue)),
+            *(asyncio.create_task(self._embed_stage(parsed_queue, write_queue)) for _ in range(self.embed_workers)),
+            asyncio.create_task(self._write_stage(write_queue)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions = True)
+            raise
+        logger.info(f"Ingestion pipeline stats: {self.stats}")
+        return self.stats
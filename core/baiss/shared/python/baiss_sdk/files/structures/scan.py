@@ -50,6 +50,7 @@ chunks: [
 """
 import os
 import json
+import asyncio
 import logging
 import baisstools
 from typing import List, Dict, Any
@@ -69,7 +70,9 @@ from baiss_sdk.files.structures.md_tree_structure           import MdTreeStructu
 # from baiss_sdk.parsers.keywords_extractor                   import KeywordsExtractor
 from baiss_sdk.parsers import extract_chunks as extract_chunks_from_plain_txt
 from baiss_sdk.db                         import DbProxyClient
-from baiss_sdk.files.embeddings import Embeddings
+from baiss_sdk.files.embeddings import Embeddings, EmbeddingCache
+from baiss_sdk.files.structures.pipeline import IngestionPipeline
+from baiss_sdk.files.scheduler import IngestionJob, IngestionCancelled
 def findpath(*args, **kwargs):
 	res=baistools_findpath(*args, *kwargs)
 	if not res:
@@ -253,7 +256,7 @@ class TreeStructureScanner:
 			FileWriter(processed_jsonfile).write_json(structure)
 
 	@staticmethod
-	def _generate_raw_tree_structure(paths: List[str], extensions: List[str] = None, db_client: DbProxyClient = None):
+	def _generate_raw_tree_structure(paths: List[str], extensions: List[str] = None, db_client: DbProxyClient = None, is_cancelled = None):
 
 		if not extensions:
 			raise ValueError("Extensions list cannot be empty.")
@@ -283,8 +286,9 @@ class TreeStructureScanner:
 							path       = path,
 							# dest       = dest_path,
 							# result     = structure,
-							extensions = extensions,
-							db_client  = db_client
+							extensions   = extensions,
+							db_client    = db_client,
+							is_cancelled = is_cancelled
 						)
 					
 				else:
@@ -306,55 +310,57 @@ class TreeStructureScanner:
 						path       = path,
 						# dest       = dest_path,
 						# result     = structure,
-						extensions = extensions,
-						db_client  = db_client
+						extensions   = extensions,
+						db_client    = db_client,
+						is_cancelled = is_cancelled
 					)
 					
 
 	@staticmethod
-	async def _process_json_files(db_client: DbProxyClient = None, extensions: List[str] = None, token = None):
+	async def _process_json_files(db_client: DbProxyClient = None, extensions: List[str] = None, job: IngestionJob = None):
 		if db_client is None:
 			raise ValueError("Db client cannot be None.")
 		if extensions is None:
 			raise ValueError("Extensions list cannot be None.")
-		raw_data = db_client.retrieve_unprocessed_files(extensions = extensions)
+		if job is None:
+			raise ValueError("Ingestion job cannot be None.")
+		# Only the documents below the job's paths, other jobs ingest their own
+		raw_data = db_client.retrieve_unprocessed_files(extensions = extensions, paths = job.paths)
 		logger.info(f"Retrieved {raw_data} unprocessed files for extensions: {extensions}")
-		for path, id, content_type in raw_data:
-			from baiss_agents.app.core.config import global_token
-			if global_token == True:
-				raise Exception("Global token set to True, operation aborted.")
-
-			if content_type == "google-drive":
-				raise NotImplementedError("Google Drive structure processing is not implemented yet.")
-			elif content_type == "md":
-				await MdTreeStructure.update_md_tree_structure_v2(path, id, content_type, db_client)
-			elif content_type == "text/csv" or content_type == "csv":
-				await CsvTreeStructure.update_csv_tree_structure_v2(path, id, content_type, db_client)
-			elif content_type == "application/pdf" or content_type == "pdf":
-				await PdfTreeStructure.update_pdf_tree_structure_v2(path, id, content_type, db_client)
-			elif content_type == "txt" or content_type == "text/plain" or content_type == "docx":
-				await TextTreeStructure.update_text_tree_structure(path, id, content_type, db_client)
-			elif content_type == "xlsx" or content_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" or content_type == "xls":
-				await ExcelTreeStructure.update_excel_tree_structure_v2(path, id, content_type,  db_client)
-			else:
-				raise ValueError(f"Unknown structure type: {content_type}")
+		job.update(stage = "ingest", total = len(raw_data))
+		cache    = EmbeddingCache(db_client)
+		pipeline = IngestionPipeline(
+			db_client    = db_client,
+			embedding    = Embeddings(url = job.embedding_url),
+			cache        = cache,
+			is_cancelled = job.is_cancelled,
+			checkpoint   = job.checkpoint,
+			on_progress  = lambda stats: job.update(**stats)
+		)
+		await pipeline.run(raw_data)
+		logger.info(f"Embedding cache stats: {cache.stats}")
 			
 	@staticmethod
-	async def _process_files_fallback(db_client: DbProxyClient = None):
+	async def _process_files_fallback(db_client: DbProxyClient = None, job: IngestionJob = None):
 		if db_client is None:
 			raise ValueError("Db client cannot be None.")
+		if job is None:
+			raise ValueError("Ingestion job cannot be None.")
 		try:
 			chunks = db_client.get_all_paths_wo_embeddings()
-			for id, content in chunks:
-				from baiss_agents.app.core.config import global_token, embedding_url
-				if global_token == True:
-					raise Exception("Global token set to True, operation aborted.")
-				embedding = Embeddings(url= embedding_url)
-				embedded_content = await embedding.embed(content)
-				if embedded_content is None:
-					logger.info(f"Filling in missing embeddings for id: {id}")
-					continue
-				else:
+			job.update(stage = "fallback")
+			embedding = Embeddings(url= job.embedding_url)
+			cache = EmbeddingCache(db_client)
+			# Embed in bounded groups so a stop request (or a higher priority job) is honoured between groups
+			group_size = embedding.batch_size * embedding.max_concurrency
+			for start in range(0, len(chunks), group_size):
+				await job.checkpoint()
+				group = chunks[start:start + group_size]
+				embedded_contents = await embedding.embed_many([content for _, content in group], cache = cache)
+				for (id, _), embedded_content in zip(group, embedded_contents):
+					if embedded_content is None:
+						logger.info(f"Filling in missing embeddings for id: {id}")
+						continue
 					db_client.fill_in_missing_embeddings(id=id, embedding=embedded_content)
 		except Exception as e:
 			raise e
@@ -406,29 +412,39 @@ class TreeStructureScanner:
 					break
 			FileWriter(processed_jsonfile).write_json(structure)
 
-async def generate_full_tree_structures(paths, extensions: List[str] = None):
-
+async def generate_full_tree_structures(job: IngestionJob):
+	"""Scans and ingests the paths of an ingestion job, honouring its cancellation token and priority."""
+	paths, extensions = job.paths, job.extensions
+	db_client = DbProxyClient()
 	try:
-		db_client = DbProxyClient()
 		db_client.connect()
 		db_client.create_db_and_tables()
 
-
-		TreeStructureScanner._generate_raw_tree_structure(paths = paths, extensions = extensions, db_client = db_client)
+		job.update(stage = "scan")
+		# The walk blocks, keep the event loop free for other jobs and progress updates
+		await asyncio.to_thread(
+			TreeStructureScanner._generate_raw_tree_structure,
+			paths = paths, extensions = extensions, db_client = db_client, is_cancelled = job.is_cancelled
+		)
 		logger.info(f"Generating full tree structures for paths: {paths} with extensions: {extensions}")
-		await TreeStructureScanner._process_json_files(db_client=db_client, extensions = extensions)
+		await TreeStructureScanner._process_json_files(db_client=db_client, extensions = extensions, job = job)
 		logger.info(f"Completed processing json files for paths: {paths} with extensions: {extensions}")
-		await TreeStructureScanner._process_files_fallback(db_client=db_client)
+		await TreeStructureScanner._process_files_fallback(db_client=db_client, job = job)
 		logger.info(f"Completed processing files fallback for paths: {paths} with extensions: {extensions}")
 
 		# TODO ( Abdelmathin) : generate keywords for files
 		# TreeStructureScanner._generate_keywords_for_files()
-		db_client.disconnect()
 	# TODO ( Abdelmathin): generate keywords for folders
 	# TreeStructureScanner._generate_keywords_for_folders()
+	except IngestionCancelled as e:
+		logger.info(f"Generating full tree structures stopped: {e}")
+		raise
 	except Exception as e:
 		logger.error(f"Error generating full tree structures: {e}")
 		raise e
+	finally:
+		# Cancelled jobs must not leak their connection
+		db_client.disconnect()
 
 if __name__ == "__main__":
 	pass
@@ -0,0 +1,415 @@
+import os
+import asyncio
+import logging
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from typing import Any, Dict, Iterator, List, Optional
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from baiss_sdk.db import DbProxyClient
+from baiss_sdk.files.embeddings import Embeddings, EmbeddingCache
+from baiss_sdk.files.structures import TreeStructure
+from baiss_sdk.files.structures.pipeline import IngestionPipeline
+from baiss_sdk.files.scheduler import IngestionScheduler, IngestionJob, BACKGROUND_PRIORITY
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    # Without watchdog every root is polled
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = logging.getLogger(__name__)
+
+class _WatchdogHandler(FileSystemEventHandler):
+    """Forwards watchdog events (received on the observer thread) to the FileWatcher."""
+
+    def __init__(self, watcher: "FileWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        self.watcher.notify("upsert", event.src_path, is_directory = event.is_directory)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.notify("upsert", event.src_path)
+
+    def on_deleted(self, event):
+        self.watcher.notify("delete", event.src_path, is_directory = event.is_directory)
+
+    def on_moved(self, event):
+        self.watcher.notify("move", event.src_path, event.dest_path, is_directory = event.is_directory)
+
+
+class FileWatcher:
+    """
+    Keeps the index of the registered root folders fresh without full rescans.
+    Filesystem events come from watchdog (inotify, FSEvents, ReadDirectoryChangesW) or,
+    when it is unavailable or a root cannot be watched, from periodic stat snapshots.
+    Events are debounced, then the changes of each root are submitted to the ingestion
+    scheduler as a background job, so interactive ingestions pause it: moves rename documents
+    in place so their chunks and embeddings are kept, and only the touched files go through
+    the ingestion pipeline, embedded with the endpoint of their root.
+    The database is only connected while changes are applied: DuckDB locks the file for the
+    process holding a connection, and the sandbox processes open their own.
+    """
+
+    def __init__(self, scheduler: IngestionScheduler, debounce_seconds: float = 2.0, poll_interval: float = 30.0, max_depth: int = 5, use_polling: bool = False):
+        self.scheduler        = scheduler
+        self.debounce_seconds = debounce_seconds
+        self.poll_interval    = poll_interval
+        self.max_depth        = max_depth
+        self.use_polling      = use_polling or Observer is None
+        self._roots: Dict[str, Dict[str, Any]] = {}
+        self._polled_roots    = set()
+        self._snapshots: Dict[str, Dict[str, tuple]] = {}
+        self._watches         = {}
+        self._observer        = None
+        self._loop            = None
+        self._tasks           = []
+        self._stopping        = False
+        self._jobs: List[IngestionJob] = []
+        # Pending changes, only touched on the event loop thread
+        self._operations: List[tuple] = []
+        self._upserts         = set()
+        self._scans           = set()
+        self._last_event      = 0.0
+        self._wakeup          = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @staticmethod
+    def _local_path(path: str) -> str:
+        if path.startswith("file://"):
+            path = path[len("file://"):]
+        return path.rstrip("/\\") or path
+
+    @staticmethod
+    @contextmanager
+    def _connection() -> Iterator[DbProxyClient]:
+        """A database connection, closed on exit."""
+        db = DbProxyClient()
+        db.connect()
+        try:
+            yield db
+        finally:
+            db.disconnect()
+
+    @staticmethod
+    def _watched_roots() -> List[Dict[str, Any]]:
+        with FileWatcher._connection() as db:
+            return db.get_watched_roots()
+
+    async def start(self):
+        """Starts watching the roots registered in the database."""
+        if self.running:
+            return
+        self._loop     = asyncio.get_running_loop()
+        self._wakeup   = asyncio.Event()
+        self._stopping = False
+        roots = await asyncio.to_thread(self._watched_roots)
+        if not self.use_polling:
+            self._observer = Observer()
+            self._observer.start()
+        for root in roots:
+            self._watch(self._local_path(root["path"]), root["extensions"], root["embedding_url"])
+        self._tasks = [
+            asyncio.create_task(self._run()),
+            asyncio.create_task(self._poll()),
+        ]
+        logger.info(f"File watcher started ({'polling' if self.use_polling else 'watchdog'}) for {len(self._roots)} roots")
+
+    async def stop(self):
+        """Stops watching and discards pending changes; the next scan picks them up."""
+        self._stopping = True
+        for job in self._jobs:
+            self.scheduler.cancel(job.id)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions = True)
+        self._tasks = []
+        if self._observer is not None:
+            self._observer.stop()
+            await asyncio.to_thread(self._observer.join)
+            self._observer = None
+        self._watches = {}
+        logger.info("File watcher stopped")
+
+    def _persist_roots(self, add: List[str] = None, remove: List[str] = None, extensions: List[str] = None, embedding_url: str = None):
+        with self._connection() as db:
+            if add:
+                db.add_watched_roots(add, extensions, embedding_url)
+            if remove:
+                db.remove_watched_roots(remove)
+
+    async def add_roots(self, paths: List[str], extensions: List[str], embedding_url: str = None):
+        """Registers root folders to keep fresh, persisting them for the next start."""
+        roots = [path for path in paths if os.path.isdir(self._local_path(path))]
+        if not roots or not self.running:
+            return
+        await asyncio.to_thread(self._persist_roots, add = roots, extensions = extensions, embedding_url = embedding_url)
+        for root in roots:
+            self._watch(self._local_path(root), extensions, embedding_url)
+
+    async def remove_roots(self, paths: List[str]):
+        """Stops watching the given root folders."""
+        if not self.running:
+            return
+        await asyncio.to_thread(self._persist_roots, remove = paths)
+        for path in paths:
+            root = self._local_path(path)
+            self._roots.pop(root, None)
+            self._polled_roots.discard(root)
+            self._snapshots.pop(root, None)
+            watch = self._watches.pop(root, None)
+            if watch is not None:
+                self._observer.unschedule(watch)
+
+    def _watch(self, root: str, extensions: List[str], embedding_url: str):
+        self._roots[root] = {
+            "extensions"   : TreeStructure.norm_extensions(extensions),
+            "embedding_url": embedding_url,
+        }
+        if root in self._watches:
+            return
+        if self.use_polling:
+            self._polled_roots.add(root)
+            return
+        try:
+            self._watches[root] = self._observer.schedule(_WatchdogHandler(self), root, recursive = True)
+        except OSError as e:
+            # e.g. the inotify watch limit is exhausted
+            logger.warning(f"Cannot watch {root} ({e}), polling it every {self.poll_interval}s instead")
+            self._polled_roots.add(root)
+
+    def _root_for(self, path: str) -> Optional[str]:
+        for root in self._roots:
+            if path == root or path.startswith(root + os.sep) or path.startswith(root + "/"):
+                return root
+        return None
+
+    def _accepts(self, path: str) -> Optional[tuple]:
+        """Returns (root, depth) if the file belongs to a watched root and is indexed, else None."""
+        root = self._root_for(path)
+        if root is None:
+            return None
+        depth = len(os.path.relpath(path, root).split(os.sep))
+        if depth > self.max_depth:
+            return None
+        extensions = self._roots[root]["extensions"]
+        if extensions and TreeStructure.get_file_extension(os.path.basename(path)) not in extensions:
+            return None
+        return root, depth
+
+    def notify(self, kind: str, path: str, dest: str = None, is_directory: bool = False):
+        """Records a filesystem event; safe to call from any thread."""
+        if self._loop is None or self._stopping:
+            return
+        self._loop.call_soon_threadsafe(self._record, kind, path, dest, is_directory)
+
+    def _record(self, kind: str, path: str, dest: str = None, is_directory: bool = False):
+        if kind == "move":
+            self._operations.append(("move", path, dest, is_directory))
+            if path in self._upserts:
+                # Created and moved within the debounce window, it was never indexed
+                self._upserts.discard(path)
+            if is_directory:
+                self._scans.discard(path)
+            else:
+                self._upserts.add(dest)
+        elif kind == "delete":
+            self._operations.append(("delete", path))
+            self._upserts.discard(path)
+            self._scans.discard(path)
+        elif is_directory:
+            self._scans.add(path)
+        else:
+            self._upserts.add(path)
+        self._last_event = self._loop.time()
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            await self._wakeup.wait()
+            # Debounce: wait until no event arrived for debounce_seconds
+            while (quiet := self._loop.time() - self._last_event) < self.debounce_seconds:
+                await asyncio.sleep(self.debounce_seconds - quiet)
+            self._wakeup.clear()
+            operations, upserts, scans = self._operations, self._upserts, self._scans
+            self._operations, self._upserts, self._scans = [], set(), set()
+            batches = self._batches(operations, upserts, scans)
+            self._jobs = [
+                self.scheduler.submit(
+                    paths         = sorted(batch[1] | batch[2]),
+                    extensions    = self._roots[root]["extensions"],
+                    embedding_url = self._roots[root]["embedding_url"],
+                    priority      = BACKGROUND_PRIORITY,
+                    runner        = lambda job, batch = batch: self._apply(job, *batch)
+                )
+                for root, batch in batches.items()
+            ]
+            await asyncio.gather(*(job.wait() for job in self._jobs))
+            failed = [batch for job, batch in zip(self._jobs, batches.values()) if job.state == "failed"]
+            for job in self._jobs:
+                if job.state == "cancelled" and not self._stopping:
+                    logger.warning(f"File watcher job {job.id} was cancelled, the next scan picks up its changes")
+            self._jobs = []
+            if failed:
+                # Keep the changes for the next round
+                for batch_operations, batch_upserts, batch_scans in failed:
+                    self._operations = batch_operations + self._operations
+                    self._upserts   |= batch_upserts
+                    self._scans     |= batch_scans
+                await asyncio.sleep(self.poll_interval)
+                self._last_event = self._loop.time()
+                self._wakeup.set()
+
+    def _batches(self, operations: List[tuple], upserts: set, scans: set) -> Dict[str, tuple]:
+        """Splits changes by root as (operations, upserts, scans); a move belongs to the root of its source, else of its destination."""
+        batches = {}
+        def batch(path: str) -> Optional[tuple]:
+            root = self._root_for(path)
+            return None if root is None else batches.setdefault(root, ([], set(), set()))
+        for operation in operations:
+            target = batch(operation[1])
+            if target is None and operation[0] == "move":
+                target = batch(operation[2])
+            if target is not None:
+                target[0].append(operation)
+        for path in upserts:
+            if (target := batch(path)) is not None:
+                target[1].add(path)
+        for path in scans:
+            if (target := batch(path)) is not None:
+                target[2].add(path)
+        return batches
+
+    async def _apply(self, job: IngestionJob, operations: List[tuple], upserts: set, scans: set):
+        """Runs one root's changes as a scheduler job; the database calls run on worker threads."""
+        db = DbProxyClient()
+        await asyncio.to_thread(db.connect)
+        try:
+            job.update(stage = "watch")
+            changed = await asyncio.to_thread(self._apply_changes, db, operations, upserts, scans)
+            if not changed or not job.embedding_url or not job.extensions:
+                return
+            # Only the checked files, other unprocessed documents belong to their scans
+            documents = await asyncio.to_thread(db.retrieve_unprocessed_files, job.extensions, changed)
+            job.update(stage = "ingest", total = len(documents))
+            if not documents:
+                return
+            cache = EmbeddingCache(db)
+            pipeline = IngestionPipeline(
+                db_client    = db,
+                embedding    = Embeddings(url = job.embedding_url),
+                cache        = cache,
+                is_cancelled = job.is_cancelled,
+                checkpoint   = job.checkpoint,
+                on_progress  = lambda stats: job.update(**stats)
+            )
+            await pipeline.run(documents)
+            logger.info(f"File watcher indexed {len(documents)} documents, embedding cache stats: {cache.stats}")
+        finally:
+            await asyncio.to_thread(db.disconnect)
+
+    def _apply_changes(self, db: DbProxyClient, operations: List[tuple], upserts: set, scans: set) -> List[str]:
+        """Applies debounced changes to BaissDocuments. Runs on a worker thread.
+        Returns:
+            List[str]: The database paths of the checked files and folders.
+        """
+        def db_path(path: str) -> str:
+            return TreeStructure._db_path(path, "file://")
+
+        for operation in operations:
+            if operation[0] == "delete":
+                db.delete_documents([db_path(operation[1])], recursive = True)
+                continue
+            _, source, destination, is_directory = operation
+            root = self._root_for(destination)
+            if root is None:
+                # Moved out of the watched roots
+                db.delete_documents([db_path(source)], recursive = True)
+            elif is_directory or db.get_document_stats([db_path(source)]):
+                if not is_directory:
+                    # The destination file is replaced by the moved one
+                    db.delete_documents([db_path(destination)])
+                depth = len(os.path.relpath(destination, root).split(os.sep)) if destination != root else 0
+                db.move_documents([(db_path(source), db_path(destination), depth)])
+
+        # By local path: a file below a created folder is also reported on its own
+        files: Dict[str, tuple] = {}
+        checked = []
+        for path in upserts:
+            accepted = self._accepts(path)
+            if accepted is None:
+                continue
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path):
+                continue
+            files[path] = (path, os.path.basename(path), accepted[1], TreeStructure._stat_signature(file_stat))
+            checked.append(db_path(path))
+        for path in scans:
+            root = self._root_for(path)
+            if root is not None:
+                depth = len(os.path.relpath(path, root).split(os.sep)) if path != root else 0
+                files.update((file[0], file) for file in self._walk(path, depth, self._roots[root]["extensions"]))
+                checked.append(db_path(path))
+
+        with ThreadPoolExecutor() as executor:
+            TreeStructure._flush_documents(db, list(files.values()), [], "file://", executor)
+        logger.info(f"File watcher applied {len(operations)} moves/deletes and checked {len(files)} files")
+        return checked if files else []
+
+    def _walk(self, path: str, depth: int, extensions: List[str]) -> List[tuple]:
+        """Lists indexed files below path as (local path, name, depth, stat signature) tuples."""
+        files = []
+        pending = [(path, depth)]
+        while pending:
+            dir_path, dir_depth = pending.pop()
+            if dir_depth + 1 > self.max_depth:
+                continue
+            try:
+                dir_files, subdirectories, _ = TreeStructure._scan_directory(
+                    dir_path, dir_depth, extensions, None, None, False
+                )
+            except OSError as e:
+                logger.warning(f"File watcher cannot list {dir_path}: {e}")
+                continue
+            files.extend(dir_files)
+            pending.extend((subdirectory, dir_depth + 1) for subdirectory in subdirectories)
+        return files
+
+    async def _poll(self):
+        """Diffs stat snapshots of the polled roots; a deleted and a created file with the same stat signature is a move."""
+        while not self._stopping:
+            for root in list(self._polled_roots):
+                extensions = self._roots.get(root, {}).get("extensions", [])
+                files = await asyncio.to_thread(self._walk, root, 0, extensions)
+                snapshot = {file[0]: file[3] for file in files}
+                previous = self._snapshots.get(root)
+                self._snapshots[root] = snapshot
+                if previous is None:
+                    continue
+                created = {path: signature for path, signature in snapshot.items() if path not in previous}
+                deleted = {path: signature for path, signature in previous.items() if path not in snapshot}
+                by_signature = {signature: path for path, signature in created.items() if signature[2]}
+                for path, signature in deleted.items():
+                    destination = by_signature.pop(signature, None)
+                    if destination is not None:
+                        created.pop(destination)
+                        self._record("move", path, destination)
+                    else:
+                        self._record("delete", path)
+                for path in created:
+                    self._record("upsert", path)
+                for path, signature in snapshot.items():
+                    if path in previous and previous[path] != signature:
+                        self._record("upsert", path)
+            await asyncio.sleep(self.poll_interval)
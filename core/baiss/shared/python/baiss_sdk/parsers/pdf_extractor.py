@@ -16,6 +16,7 @@ import pandas as pd
 import baisstools
 baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
 from io import StringIO
+from typing import Iterator, List, Optional, Tuple
 from baiss_sdk.parsers import extract_chunks
 from baiss_sdk.files.file_reader import FileReader
 
@@ -49,70 +50,133 @@ class PDFParser:
         # Use pdfplumber to open and process the PDF
         with pdfplumber.open(pdf_path) as pdf:
             for page_num, page in enumerate(pdf.pages):
-                page_result = {
-                    "page_number": page_num + 1,
-                    "tags": [],
-                    "full_text": "",
-                    "tables": [],
-                    "images": []
-                }
-
-                # 1. Extract all text from the page
-                text = page.extract_text(layout=True) or ""
-
-                # Fallback: If layout=True results in CID encoding errors, try layout=False
-                if "(cid:" in text:
-                    text_simple = page.extract_text(layout=False) or ""
-                    # Only use the fallback if it actually fixed the CID issue
-                    if "(cid:" not in text_simple:
-                        text = text_simple
-                
-                # Clean up any remaining CID tags
-                if "(cid:" in text:
-                    text = text.replace('(cid:3)', ' ')
-                    text = re.sub(r'\(cid:[^)]*\)', '', text)
-                    
-                    if not text.replace('\n', '').replace(' ', ''):
-                        text = ""
-                        return []
-
-                page_result["full_text"] = text
-
-                if not text.replace('\n', '').replace(' ', ''):
-                    page_result["chunks"] = []
-                else:
-                    page_result["chunks"] = extract_chunks( text )
-                # print(page_result["full_text"])
-                
-                # 2. Detect and extract tables
-                # extract_tables() returns table data as a list of lists
-                extracted_tables = page.extract_tables()
-                if extracted_tables:
-                    page_result["tags"].append("table")
-                    for table_data in extracted_tables:
-                        page_result["tables"].append(table_data)
-
-                # 3. Detect images
-                # page.images provides a list of image objects with coordinates
-                if page.images:
-                    page_result["tags"].append("image")
-                    for img in page.images:
-                        page_result["images"].append({
-                            "bbox": (img["x0"], img["top"], img["x1"], img["bottom"]),
-                            "width": img["width"],
-                            "height": img["height"]
-                        })
-
-                # 4. Heuristic for graph/chart detection
-                # A high number of vector lines/curves could indicate a chart.
-                # This threshold can be adjusted based on document types.
-                if len(page.lines) + len(page.curves) > 20 and "table" not in page_result["tags"]:
-                    page_result["tags"].append("graph")
-
+                page_result = self.parse_page(page, page_num + 1, selective = False)
+                if page_result is None:
+                    return []
                 parsed_document.append(page_result)
 
         return parsed_document
 
+    def parse_page(self, page, page_number: int, selective: bool = True) -> Optional[dict]:
+        """
+        Parses one pdfplumber page.
+
+        Args:
+            page: The pdfplumber page.
+            page_number: 1-based page number.
+            selective: Only run the layout text pass and the table pass on pages with
+                drawn edges (lines, rectangles, curves). Tables are found from those edges,
+                so pages without any cannot have tables and the pass is skipped without loss.
+
+        Returns:
+            The parsed page, or None if its text is only unreadable CID glyphs.
+        """
+        page_result = {
+            "page_number": page_number,
+            "tags": [],
+            "full_text": "",
+            "tables": [],
+            "images": []
+        }
+        has_edges = bool(page.edges) if selective else True
+
+        # 1. Extract all text from the page
+        text = page.extract_text(layout=has_edges) or ""
+
+        # Fallback: If layout=True results in CID encoding errors, try layout=False
+        if "(cid:" in text and has_edges:
+            text_simple = page.extract_text(layout=False) or ""
+            # Only use the fallback if it actually fixed the CID issue
+            if "(cid:" not in text_simple:
+                text = text_simple
+
+        # Clean up any remaining CID tags
+        if "(cid:" in text:
+            text = text.replace('(cid:3)', ' ')
+            text = re.sub(r'\(cid:[^)]*\)', '', text)
+
+            if not text.replace('\n', '').replace(' ', ''):
+                return None
+
+        page_result["full_text"] = text
+
+        if not text.replace('\n', '').replace(' ', ''):
+            page_result["chunks"] = []
+        else:
+            page_result["chunks"] = extract_chunks( text )
+
+        # 2. Detect and extract tables
+        # extract_tables() returns table data as a list of lists
+        extracted_tables = page.extract_tables() if has_edges else []
+        if extracted_tables:
+            page_result["tags"].append("table")
+            for table_data in extracted_tables:
+                page_result["tables"].append(table_data)
+
+        # 3. Detect images
+        # page.images provides a list of image objects with coordinates
+        if page.images:
+            page_result["tags"].append("image")
+            for img in page.images:
+                page_result["images"].append({
+                    "bbox": (img["x0"], img["top"], img["x1"], img["bottom"]),
+                    "width": img["width"],
+                    "height": img["height"]
+                })
+
+        # 4. Heuristic for graph/chart detection
+        # A high number of vector lines/curves could indicate a chart.
+        # This threshold can be adjusted based on document types.
+        if len(page.lines) + len(page.curves) > 20 and "table" not in page_result["tags"]:
+            page_result["tags"].append("graph")
+
+        return page_result
+
+    @staticmethod
+    def page_count(pdf_path: str) -> int:
+        """Returns the number of pages of a PDF without parsing them."""
+        pdf_path = FileReader.update_file_path(pdf_path)
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError(f"PDF file not found at: {pdf_path}")
+        with pdfplumber.open(pdf_path) as pdf:
+            return len(pdf.pages)
+
+    @staticmethod
+    def page_ranges(page_count: int, pages_per_range: int = 32) -> List[Tuple[int, int]]:
+        """Splits pages 1..page_count into (first, last) ranges, both inclusive."""
+        pages_per_range = max(1, pages_per_range)
+        return [
+            (first, min(first + pages_per_range - 1, page_count))
+            for first in range(1, page_count + 1, pages_per_range)
+        ]
+
+    def iter_pages(self, pdf_path: str, first_page: int = 1, last_page: int = None) -> Iterator[dict]:
+        """
+        Streams parsed pages of a PDF, one at a time, with the selective passes of parse_page.
+        Pages are released as soon as they are parsed, so memory stays flat on large documents;
+        unreadable pages are yielded without chunks.
+
+        Args:
+            pdf_path: Path to the PDF file.
+            first_page: First page to parse (1-based).
+            last_page: Last page to parse, inclusive (the last page of the document if None).
+        """
+        pdf_path = FileReader.update_file_path(pdf_path)
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError(f"PDF file not found at: {pdf_path}")
+
+        with pdfplumber.open(pdf_path) as pdf:
+            last_page = len(pdf.pages) if last_page is None else min(last_page, len(pdf.pages))
+            for page_number in range(first_page, last_page + 1):
+                page = pdf.pages[page_number - 1]
+                try:
+                    page_result = self.parse_page(page, page_number)
+                finally:
+                    page.close()
+                if page_result is None:
+                    page_result = {"page_number": page_number, "tags": [], "full_text": "", "tables": [], "images": [], "chunks": []}
+                yield page_result
+
     def get_structure(self, parsed_document: list) -> list:
 
         for page in parsed_document:
@@ -0,0 +1,183 @@
+import re
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from typing import Any, Dict, List, Optional, Tuple
+from baiss_sdk.parsers.json_extractor import JsonExtractor
+from baiss_sdk.parsers.python_extractor import PythonExtractor
+
+# "def"/"async" keyword that may start a function (see PythonExtractor.is_function_start)
+_FUNCTION_START = re.compile(r"(?<!\S)(?:async|def)\s")
+_OPENERS        = "{["
+_CLOSERS        = "}]"
+
+
+class StreamParser:
+    """
+    Incremental parser of a streamed LLM reply.
+    Fed with the content deltas, it returns the text to show, without the hidden tags (which
+    may be split across deltas), and the events found so far:
+        {"type": "object",   "value": <JSON object or list>}
+        {"type": "function", "value": <function, as returned by PythonExtractor.extract_function>}
+    An object is reported when its closing bracket arrives, a function when the first line
+    after its body (or a closing fence/tag) arrives, so that they can be acted upon while the
+    rest of the reply is generated. Once closed, the events are the ones JsonExtractor and
+    PythonExtractor would extract from the whole reply.
+    """
+
+    def __init__(self, hidden_tags: Tuple[str, ...] = ("code_execution",)):
+        """
+        Args:
+            hidden_tags (Tuple[str, ...]): Names of the tags whose markup (<name> and </name>)
+                is removed from the shown text.
+        """
+        self._tags: List[str] = [f"<{name}>" for name in hidden_tags] + [f"</{name}>" for name in hidden_tags]
+        self._text      = ""
+        self._held      = ""
+        self._closed    = False
+        # JSON scan: next position, start, bracket depth and string state of the open candidate
+        self._object_scan  = 0
+        self._object_start: Optional[int] = None
+        self._depth        = 0
+        self._in_string    = False
+        self._escaped      = False
+        # Function scan: next position, open candidate and the last line it was checked at
+        self._function_scan  = 0
+        self._function_start: Optional[int] = None
+        self._checked_line: Optional[Tuple[int, bool]] = None
+
+    @property
+    def text(self) -> str:
+        """The whole reply received so far, tags included."""
+        return self._text
+
+    def feed(self, delta: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Parses the next content delta.
+        Args:
+            delta (str): Content of the stream chunk.
+        Returns:
+            Tuple[str, List[Dict[str, Any]]]: The text to show (may be empty while a possible tag
+                is held back) and the events completed by this delta.
+        """
+        if self._closed:
+            raise ValueError("The stream parser is closed.")
+        if not delta:
+            return "", []
+        self._text += delta
+        visible = self._visible(delta)
+        return visible, self._scan_objects() + self._scan_functions(final = False)
+
+    def close(self) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Ends the stream: releases the held text and reports the function still open at the end of
+        the reply, as well as the objects of an unbalanced tail. Closing twice returns nothing.
+        """
+        if self._closed:
+            return "", []
+        self._closed = True
+        visible, self._held = self._held, ""
+        events = self._scan_objects()
+        if self._object_start is not None:
+            events += [{"type": "object", "value": value} for value in JsonExtractor.extract_objects(self._text[self._object_start:])]
+            self._object_start = None
+        return visible, events + self._scan_functions(final = True)
+
+    def _visible(self, delta: str) -> str:
+        """Removes the hidden tags, holding back a trailing '<...' that may still become one."""
+        text, self._held, shown = self._held + delta, "", []
+        pos = 0
+        while pos < len(text):
+            lt = text.find("<", pos)
+            if lt < 0:
+                shown.append(text[pos:])
+                break
+            shown.append(text[pos:lt])
+            tag = next((tag for tag in self._tags if text.startswith(tag, lt)), None)
+            if tag is not None:
+                pos = lt + len(tag)
+                continue
+            rest = text[lt:]
+            if any(tag.startswith(rest) for tag in self._tags):
+                self._held = rest
+                break
+            shown.append("<")
+            pos = lt + 1
+        return "".join(shown)
+
+    def _scan_objects(self) -> List[Dict[str, Any]]:
+        """Brackets and JSON strings of the new text; a balanced span that parses is an object."""
+        events = []
+        text, pos = self._text, self._object_scan
+        while pos < len(text):
+            char = text[pos]
+            if self._object_start is None:
+                if char in _OPENERS:
+                    self._object_start, self._depth, self._in_string, self._escaped = pos, 1, False, False
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in _OPENERS:
+                self._depth += 1
+            elif char in _CLOSERS:
+                self._depth -= 1
+                if self._depth == 0:
+                    start, self._object_start = self._object_start, None
+                    try:
+                        events.append({"type": "object", "value": JsonExtractor.parse_json_or_dict(text[start:pos + 1])})
+                    except ValueError:
+                        # Not an object: look for one inside it, as JsonExtractor does
+                        pos = start
+            pos += 1
+        self._object_scan = pos
+        return events
+
+    def _scan_functions(self, final: bool) -> List[Dict[str, Any]]:
+        """Functions completed by the new text, all the open ones if final."""
+        events = []
+        text, length = self._text, len(self._text)
+        if final:
+            # PythonExtractor strips the reply: a function ending it has no trailing blank lines
+            length = len(text.rstrip())
+        while True:
+            if self._function_start is None:
+                match = _FUNCTION_START.search(text, self._function_scan)
+                if match is None:
+                    # A keyword may still be arriving at the end of the text
+                    self._function_scan = max(self._function_scan, length - len("async "))
+                    return events
+                self._function_start = match.start()
+                self._checked_line   = None
+            if not final:
+                # The end of a function (or of its header) only shows on a new line: check once per
+                # new line and once more when its first non blank character arrives
+                newline = text.rfind("\n")
+                line    = (newline, bool(text[newline + 1:].strip()))
+                if line == self._checked_line:
+                    return events
+                self._checked_line = line
+            start    = self._function_start
+            function = PythonExtractor.extract_function(start, text, length)
+            if function:
+                if function["end"] >= length and not final:
+                    return events
+                events.append({"type": "function", "value": function})
+                self._function_scan = function["end"]
+            elif not final and self._header_open(start, text, length):
+                return events
+            else:
+                self._function_scan = start + 1
+            self._function_start = None
+
+    @staticmethod
+    def _header_open(start: int, text: str, length: int) -> bool:
+        """Whether the text ends before the newline after the function header at start."""
+        pos = PythonExtractor.skip_definition(start, text, length)
+        while (pos < length) and text[pos].isspace() and (text[pos] != "\n"):
+            pos += 1
+        return pos >= length
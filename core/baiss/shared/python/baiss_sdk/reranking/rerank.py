@@ -1,58 +1,214 @@
 import baisstools
 baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
 
+import glob
 import logging
 import os
-from typing import List, Dict, Any, Tuple
+import time
+import hashlib
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
 from baiss_sdk import get_baiss_project_path
+from baiss_sdk.search.lru import LruCache
+
+# Passages are cut to max_length * _CHARS_PER_TOKEN characters before tokenization; the
+# tokenizer still truncates to max_length tokens, this only avoids tokenizing long chunks
+_CHARS_PER_TOKEN = 6
+
+
+class _Batch:
+    """(query, passage) pairs of concurrent rerank calls scored by one model call."""
+
+    def __init__(self):
+        self.pairs: List[Tuple[str, str]] = []
+        self.scores: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+        self.closed = False
+        self.done = threading.Event()
 
 
 class BaissReranker:
-    def __init__(self, model_name: str = "ms-marco-MiniLM-L-12-v2"):
+    def __init__(self, model_name: str = "ms-marco-MiniLM-L-12-v2", max_length: int = 512, threads: int = None,
+                 max_batch_pairs: int = 256, score_cache_entries: int = 20000):
         """
         Initializes FlashRank.
+        Args:
+            model_name (str): FlashRank cross-encoder (pairwise) model.
+            max_length (int): Max tokens of a (query, passage) pair.
+            threads (int): Intra-op threads of the ONNX session, onnxruntime's default if None.
+            max_batch_pairs (int): Max pairs scored by one model call.
+            score_cache_entries (int): Size of the (query hash, chunk id) -> score cache.
         """
         try:
             from flashrank import Ranker, RerankRequest
             self.RerankRequest = RerankRequest
-            
+
             cache_dir = get_baiss_project_path("local-data", "models")
 
             logging.info(f"Loading FlashRank model: {model_name}...")
-            self.ranker = Ranker(model_name=model_name, cache_dir=cache_dir)
+            self.ranker = Ranker(model_name=model_name, cache_dir=cache_dir, max_length=max_length)
+            if threads:
+                self._set_threads(os.path.join(cache_dir, model_name), threads)
             logging.info("FlashRank model loaded successfully.")
         except ImportError:
             logging.error("FlashRank not found. Please install: pip install flashrank")
             raise
+        self.max_length      = max_length
+        self.max_batch_pairs = max_batch_pairs
+        self.scores          = LruCache(score_cache_entries)
+        # Moving average of the model time per pair, drives the candidate count under a budget
+        self.seconds_per_pair: Optional[float] = None
+        self._lock           = threading.Lock()
+        self._model_lock     = threading.Lock()
+        self._pending: Optional[_Batch] = None
+
+    def _set_threads(self, model_dir: str, threads: int):
+        """Recreates the ONNX session of the ranker with the given intra-op thread count."""
+        import onnxruntime as ort
+        models = glob.glob(os.path.join(model_dir, "*.onnx"))
+        if not models:
+            logging.warning(f"No ONNX model found in {model_dir}, keeping the default thread count")
+            return
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = int(threads)
+        options.inter_op_num_threads = 1
+        self.ranker.session = ort.InferenceSession(models[0], sess_options = options, providers = ["CPUExecutionProvider"])
+        logging.info(f"FlashRank session uses {threads} intra-op threads")
+
+    def _truncate(self, text: str) -> str:
+        return (text or "")[:self.max_length * _CHARS_PER_TOKEN]
+
+    def _run_model(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        """Scores (query, passage) pairs with the cross-encoder, as Ranker.rerank does for one query."""
+        scores = []
+        for start in range(0, len(pairs), self.max_batch_pairs):
+            encoded = self.ranker.tokenizer.encode_batch([list(pair) for pair in pairs[start:start + self.max_batch_pairs]])
+            input_ids      = np.array([e.ids for e in encoded], dtype = np.int64)
+            attention_mask = np.array([e.attention_mask for e in encoded], dtype = np.int64)
+            token_type_ids = np.array([e.type_ids for e in encoded], dtype = np.int64)
+            onnx_input = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if np.any(token_type_ids):
+                onnx_input["token_type_ids"] = token_type_ids
+            logits = self.ranker.session.run(None, onnx_input)[0]
+            if logits.shape[1] == 1:
+                scores.append(1 / (1 + np.exp(-logits.flatten())))
+            else:
+                exp_logits = np.exp(logits)
+                scores.append(exp_logits[:, 1] / np.sum(exp_logits, axis = 1))
+        return np.concatenate(scores) if scores else np.zeros(0)
+
+    def _score(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        """
+        Scores pairs together with the pairs of concurrent calls: the first call of a batch
+        waits for the model, calls arriving meanwhile join its batch, then one model call
+        scores the whole batch. An idle model is used right away.
+        """
+        with self._lock:
+            batch = self._pending
+            leader = batch is None or batch.closed or len(batch.pairs) + len(pairs) > self.max_batch_pairs
+            if leader:
+                batch = _Batch()
+                self._pending = batch
+            offset = len(batch.pairs)
+            batch.pairs.extend(pairs)
+        if leader:
+            with self._model_lock:
+                with self._lock:
+                    batch.closed = True
+                    if self._pending is batch:
+                        self._pending = None
+                start_time = time.time()
+                try:
+                    batch.scores = self._run_model(batch.pairs)
+                except BaseException as e:
+                    batch.error = e
+                elapsed = (time.time() - start_time) / max(1, len(batch.pairs))
+                self.seconds_per_pair = elapsed if self.seconds_per_pair is None else 0.8 * self.seconds_per_pair + 0.2 * elapsed
+            batch.done.set()
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.scores[offset:offset + len(pairs)]
+
+    def candidate_count(self, uncached: List[bool], top_k: int, budget_ms: float = None) -> int:
+        """
+        Number of leading candidates that can be reranked within budget_ms, given which of them
+        are not cached yet; never less than top_k.
+        """
+        if not budget_ms or self.seconds_per_pair is None:
+            return len(uncached)
+        affordable = int(budget_ms / 1000.0 / max(self.seconds_per_pair, 1e-9))
+        count = 0
+        for missing in uncached:
+            if missing:
+                if affordable <= 0:
+                    break
+                affordable -= 1
+            count += 1
+        return max(min(top_k, len(uncached)), count)
+
+    def rerank(self, query: str, initial_results: List[Tuple], top_k: int = 5, budget_ms: float = None) -> List[Dict[str, Any]]:
+        """
+        Reranks hybrid search results (best first) with the cross-encoder.
+        Args:
+            query (str): The query text.
+            initial_results (List[Tuple]): (content, path, score, chunk_id, metadata, ...) tuples, best first.
+            top_k (int): Number of results to return.
+            budget_ms (float): Model time budget; only as many leading candidates as fit in it are
+                reranked (at least top_k), cached scores are free.
+        Returns:
+            List[Dict[str, Any]]: The top_k reranked results.
+        """
+        return self.rerank_many([query], [initial_results], top_k, budget_ms)[0]
+
+    def rerank_many(self, queries: List[str], initial_results: List[List[Tuple]], top_k: int = 5,
+                    budget_ms: float = None) -> List[List[Dict[str, Any]]]:
+        """
+        Reranks the hybrid search results of several queries, the uncached pairs of all of them
+        are scored by one batch (see rerank).
+        Args:
+            queries (List[str]): The query texts.
+            initial_results (List[List[Tuple]]): The results of each query, best first.
+            top_k (int): Number of results to return per query.
+            budget_ms (float): Model time budget of the whole batch, shared evenly by the queries.
+        Returns:
+            List[List[Dict[str, Any]]]: The top_k reranked results of each query, in query order.
+        """
+        start_time = time.time()
+        query_budget = budget_ms / max(1, len(queries)) if budget_ms else None
+        batches, pairs = [], []
+        for query, results in zip(queries, initial_results):
+            query_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
+            cached = [self.scores.get((query_hash, res[3])) for res in results]
+            count = self.candidate_count([score is None for score in cached], top_k, query_budget)
+            candidates, cached = results[:count], cached[:count]
+            missing = [i for i, score in enumerate(cached) if score is None]
+            batches.append((query_hash, candidates, cached, missing, len(pairs)))
+            pairs.extend((query, self._truncate(candidates[i][0])) for i in missing)
+
+        scores = self._score(pairs).tolist() if pairs else []
 
-    def rerank(self, query: str, initial_results: List[Tuple], top_k: int = 5) -> List[Dict[str, Any]]:
-        if not initial_results:
-            return []
-
-        passages = []
-        for i, res in enumerate(initial_results):
-            passages.append({
-                "id": str(res[3]),
-                "text": res[0],
-                "meta": {"original_tuple": res} 
-            })
-
-        rerank_request = self.RerankRequest(query=query, passages=passages)
-        ranked_results = self.ranker.rerank(rerank_request)
-
-        final_results = []
-        for res in ranked_results:
-            original = res['meta']['original_tuple']
-            new_score = res['score']
-            
-            final_results.append({
-                "chunk_content": original[0],
-                "path": original[1],
-                "score": float(new_score),
-                "reranked_score": float(new_score),
-                "old_hybrid_score": original[2],
-                "id": original[3],
-                "metadata": original[4]
-            })
-
-        return final_results[:top_k]
\ No newline at end of file
+        reranked = []
+        for (query_hash, candidates, cached, missing, offset), results in zip(batches, initial_results):
+            for i, score in zip(missing, scores[offset:offset + len(missing)]):
+                cached[i] = score
+                self.scores.put((query_hash, candidates[i][3]), score)
+            ranked = sorted(zip(candidates, cached), key = lambda item: item[1], reverse = True)
+            reranked.append([
+                {
+                    "chunk_content": original[0],
+                    "path": original[1],
+                    "score": float(new_score),
+                    "reranked_score": float(new_score),
+                    "old_hybrid_score": original[2],
+                    "id": original[3],
+                    "metadata": original[4]
+                }
+                for original, new_score in ranked[:top_k]
+            ])
+        reranked_count = sum(len(batch[1]) for batch in batches)
+        if reranked_count:
+            logging.info(f"Reranked {reranked_count} of {sum(len(results) for results in initial_results)} candidates of {len(queries)} queries ({reranked_count - len(pairs)} cached) in {time.time() - start_time:.4f} seconds")
+        return reranked
@@ -0,0 +1,251 @@
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from typing import Any, Dict, List, Optional
+from baiss_sdk.sandbox.worker import pool_worker_main
+
+logger = logging.getLogger(__name__)
+
+# Modules imported by the workers before their first execution
+DEFAULT_PRELOAD = ["json", "math", "asyncio", "baiss_sdk.tools"]
+
+
+class _Worker:
+    def __init__(self, process: multiprocessing.Process, conn):
+        self.process    = process
+        self.conn       = conn
+        self.executions = 0
+
+
+def _failure(error: str) -> Dict[str, Any]:
+    return {
+        "success"  : False,
+        "status"   : 500,
+        "stdout"   : "",
+        "stderr"   : "",
+        "return"   : None,
+        "error"    : error
+    }
+
+
+class SandboxPool:
+    """
+    Pre-started sandbox worker processes, started and stopped by the app lifespan (see main.py).
+    Workers import the sandbox modules and resolve the tool references once, then run one snippet
+    at a time: each snippet still gets fresh globals, but module state (e.g. a loaded model) is
+    kept, which is what makes them warm. A worker is replaced after max_executions snippets, when
+    its memory grows past max_memory_mb, and when it is killed on timeout or cancellation.
+    Workers are forked from a fork server that preloaded the modules where available, so they
+    never inherit the threads and connections of the server, else spawned.
+    When the pool is not running (scripts), PythonSandbox starts a process per snippet.
+    """
+
+    def __init__(self, size: int = 2, max_executions: int = 50, max_memory_mb: float = 1024,
+                 preload: List[str] = None, tool_references: List[dict] = None, start_timeout: float = 60.0):
+        """
+        Args:
+            size (int): Number of workers.
+            max_executions (int): Snippets run by a worker before it is replaced (0 = no limit).
+            max_memory_mb (float): Resident memory past which a worker is replaced (0 = no limit).
+            preload (List[str]): Modules imported by the workers up front.
+            tool_references (List[dict]): Tools resolved by the workers up front (see
+                PythonSandbox.add_tool_reference).
+            start_timeout (float): Seconds a new worker has to get ready.
+        """
+        self.size            = size
+        self.max_executions  = max_executions
+        self.max_memory_mb   = max_memory_mb
+        self.preload         = list(preload) if preload is not None else list(DEFAULT_PRELOAD)
+        self.tool_references = list(tool_references or [])
+        self.start_timeout   = start_timeout
+        self._context        = None
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers        = set()
+        # Replacements being started
+        self._pending        = 0
+        self._lock           = threading.Lock()
+        self._stats          = {"executions": 0, "timeouts": 0, "cancelled": 0, "queue_timeouts": 0, "recycled": 0, "queue_ms": 0.0, "execution_ms": 0.0}
+
+    @property
+    def running(self) -> bool:
+        return self._context is not None
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["workers"] = len(self._workers)
+        stats["idle"] = self._idle.qsize()
+        executions = max(1, stats["executions"])
+        stats["mean_queue_ms"] = stats["queue_ms"] / executions
+        stats["mean_execution_ms"] = stats["execution_ms"] / executions
+        return stats
+
+    def start(self):
+        """Starts the workers and waits until they are ready. Blocking, run it with asyncio.to_thread."""
+        if self.running or self.size <= 0:
+            return
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(self.preload)
+        else:
+            context = multiprocessing.get_context("spawn")
+        self._context = context
+        try:
+            for _ in range(self.size):
+                self._add_worker()
+        except Exception:
+            self.stop()
+            raise
+        logger.info(f"Sandbox pool started with {self.size} workers ({context.get_start_method()})")
+
+    def stop(self):
+        """Stops the workers; running snippets are killed. Blocking."""
+        if not self.running:
+            return
+        self._context = None
+        with self._lock:
+            workers, self._workers = list(self._workers), set()
+        for worker in workers:
+            self._retire(worker)
+        while not self._idle.empty():
+            self._idle.get_nowait()
+        logger.info("Sandbox pool stopped")
+
+    def _add_worker(self):
+        context = self._context
+        if context is None:
+            return
+        conn, child_conn = context.Pipe()
+        process = context.Process(target = pool_worker_main, args = (child_conn, self.preload, self.tool_references), daemon = True)
+        process.start()
+        child_conn.close()
+        if not conn.poll(self.start_timeout) or conn.recv() != "ready":
+            process.kill()
+            raise RuntimeError(f"Sandbox worker was not ready after {self.start_timeout} seconds")
+        worker = _Worker(process, conn)
+        with self._lock:
+            if self._context is None:
+                # Stopped meanwhile
+                self._retire(worker)
+                return
+            self._workers.add(worker)
+        self._idle.put(worker)
+
+    def _retire(self, worker: _Worker, kill: bool = False):
+        if not kill:
+            try:
+                worker.conn.send(None)
+                worker.process.join(1.0)
+            except (OSError, ValueError):
+                pass
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(1.0)
+        worker.conn.close()
+
+    def _replace(self, worker: _Worker, kill: bool = False):
+        """Retires a worker and starts its replacement, off the calling thread."""
+        with self._lock:
+            self._workers.discard(worker)
+            self._pending += 1
+
+        def replace():
+            self._retire(worker, kill)
+            try:
+                self._add_worker()
+            except Exception as e:
+                logger.error(f"Sandbox worker could not be replaced: {e}")
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+        threading.Thread(target = replace, name = "baiss-sandbox-replace", daemon = True).start()
+
+    def run(self, code: str, builtins: dict, retvar_name: str, module_names: list, tool_references: list,
+            host: Optional[tuple], timeout: float, cancelled: threading.Event = None) -> Dict[str, Any]:
+        """
+        Runs code on an idle worker (see worker.run_code). The timeout bounds the wait for an idle
+        worker, then the execution; a worker that times out, or whose call is cancelled, is killed
+        and replaced.
+        Args:
+            host (tuple): Client config of the host bridge the tools call, None for none.
+            cancelled (threading.Event): Set to give up the call.
+        Returns:
+            Dict[str, Any]: The sandbox result, with "timings": {"queue_ms", "execution_ms"}.
+        """
+        queued = time.perf_counter()
+        worker = None
+        while worker is None:
+            if not self.running:
+                return _failure("Sandbox pool is not running.")
+            if cancelled is not None and cancelled.is_set():
+                return _failure("CancelledError: Execution was cancelled.")
+            try:
+                worker = self._idle.get(timeout = 0.1)
+            except queue.Empty:
+                with self._lock:
+                    if not self._workers and not self._pending:
+                        # Every replacement failed, no worker will become idle
+                        return _failure("Sandbox pool has no workers left.")
+                    if time.perf_counter() - queued >= timeout:
+                        self._stats["queue_timeouts"] += 1
+                        return _failure(f"TimeoutError: No sandbox worker was idle after {timeout} seconds.")
+                continue
+            if not worker.process.is_alive():
+                self._replace(worker, kill = True)
+                worker = None
+        started = time.perf_counter()
+        deadline = started + timeout
+        result, rss, outcome = None, None, "executions"
+        try:
+            worker.conn.send((code, builtins, retvar_name, module_names, tool_references, host))
+            while True:
+                if worker.conn.poll(max(0.0, min(0.05, deadline - time.perf_counter()))):
+                    result, rss = worker.conn.recv()
+                    break
+                if cancelled is not None and cancelled.is_set():
+                    outcome = "cancelled"
+                    result = _failure("CancelledError: Execution was cancelled.")
+                    break
+                if time.perf_counter() >= deadline:
+                    outcome = "timeouts"
+                    result = _failure(f"TimeoutError: Execution timed out after {timeout} seconds.")
+                    break
+        except (EOFError, OSError):
+            worker.process.join(1.0)
+            outcome = "crashed"
+            result = _failure(f"Process exited with code {worker.process.exitcode}.")
+        except Exception as e:
+            # Request that cannot be pickled: the worker is fine
+            self._idle.put(worker)
+            return _failure(f"{type(e).__name__}: {e}")
+        finished = time.perf_counter()
+        result["timings"] = {"queue_ms": (started - queued) * 1000.0, "execution_ms": (finished - started) * 1000.0}
+
+        worker.executions += 1
+        with self._lock:
+            self._stats["queue_ms"] += result["timings"]["queue_ms"]
+            self._stats["execution_ms"] += result["timings"]["execution_ms"]
+            self._stats["executions"] += 1
+            if outcome in ("timeouts", "cancelled"):
+                self._stats[outcome] += 1
+        if outcome != "executions":
+            self._replace(worker, kill = True)
+        elif (self.max_executions and worker.executions >= self.max_executions) or \
+             (self.max_memory_mb and rss is not None and rss > self.max_memory_mb * 1024 * 1024):
+            logger.info(f"Recycling sandbox worker after {worker.executions} executions ({(rss or 0) / 1048576:.0f} MB)")
+            with self._lock:
+                self._stats["recycled"] += 1
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+        return result
+
+
+# Started by the app lifespan, shared by the sandboxes of the process
+sandbox_pool = SandboxPool()
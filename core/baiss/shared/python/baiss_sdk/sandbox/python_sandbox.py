@@ -1,10 +1,13 @@
-import io
+import time
 import uuid
+import asyncio
 import types
-import contextlib
-import importlib
+import threading
 import multiprocessing
 from baiss_sdk.parsers.python_extractor import PythonExtractor
+from baiss_sdk.sandbox.worker import run_code
+from baiss_sdk.sandbox.pool import sandbox_pool
+from baiss_sdk.sandbox.rpc import host_bridge
 
 __SAFE_BUILTINS__ = {
     # '__builtins__': __builtins__,
@@ -31,7 +34,7 @@ __SAFE_BUILTINS__ = {
     '__import__'  : __import__,
 }
 
-def _worker_exec(code: str, result_queue: multiprocessing.Queue, builtins: dict, retvar_name: str, module_names: list, tool_references: list):
+def _worker_exec(code: str, result_queue: multiprocessing.Queue, builtins: dict, retvar_name: str, module_names: list, tool_references: list, host: tuple = None):
     """
     Worker function that accepts module names as strings and tool references.
     Reconstructs the environment by dynamically importing modules and tools.
@@ -48,76 +51,9 @@ def _worker_exec(code: str, result_queue: multiprocessing.Queue, builtins: dict,
             - class_name: The class name (optional)
             - method_name: The method name (optional, if class_name is provided)
             - init_kwargs: kwargs to pass to class __init__ (optional)
+        host: Client config of the host bridge the tools call (optional)
     """
-    import asyncio
-    
-    stdout = io.StringIO()
-    stderr = io.StringIO()
-    
-    # 1. Reconstruct the environment with builtins
-    session_globals = {'__builtins__': builtins}
-    
-    # 2. Dynamically import requested modules inside the worker
-    for mod_name in module_names:
-        try:
-            mod = importlib.import_module(mod_name)
-            session_globals[mod_name] = mod
-            if mod_name == "pandas":
-                session_globals["pd"] = mod
-        except ImportError as e:
-            stderr.write(f"Warning: Could not import module '{mod_name}': {e}\n")
-    
-    # 3. Resolve tool references (functions/methods from other modules)
-    for tool_ref in tool_references:
-        try:
-            name = tool_ref["name"]
-            module_path = tool_ref["module_path"]
-            class_name = tool_ref.get("class_name")
-            method_name = tool_ref.get("method_name")
-            init_kwargs = tool_ref.get("init_kwargs", {})
-            
-            # Import the module
-            mod = importlib.import_module(module_path)
-            
-            if class_name:
-                # Get the class and instantiate it
-                cls = getattr(mod, class_name)
-                instance = cls(**init_kwargs)
-                if method_name:
-                    # Get the method from the instance
-                    func = getattr(instance, method_name)
-                else:
-                    # Use the instance itself
-                    func = instance
-            else:
-                # Get a function directly from the module
-                func = getattr(mod, method_name or name)
-            
-            session_globals[name] = func
-        except Exception as e:
-            stderr.write(f"Warning: Could not resolve tool '{tool_ref.get('name', 'unknown')}': {e}\n")
-
-    try:
-        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
-            exec(code, session_globals)
-        
-        result_queue.put({
-            "success"  : True,
-            "status"   : 200,
-            "stdout"   : str(stdout.getvalue()).strip(),
-            "stderr"   : str(stderr.getvalue()).strip(),
-            "return"   : session_globals.get(retvar_name),
-            "error"    : None
-        })
-    except Exception as e:
-        result_queue.put({
-            "success"  : False,
-            "status"   : 500,
-            "stdout"   : str(stdout.getvalue()).strip(),
-            "stderr"   : str(stderr.getvalue()).strip(),
-            "return"   : session_globals.get(retvar_name),
-            "error"    : f"{type(e).__name__}: {str(e)}\n{stderr.getvalue()}",
-        })
+    result_queue.put(run_code(code, builtins, retvar_name, module_names, tool_references, host))
 
 class PythonSandbox:
 
@@ -262,7 +198,8 @@ class PythonSandbox:
                     "stdout"   : str,
                     "stderr"   : str,
                     "return"   : any,
-                    "error"    : str | None
+                    "error"    : str | None,
+                    "timings"  : {"queue_ms": float, "execution_ms": float}
                 }
         """
         function = self.get_function_by_name(name)
@@ -286,13 +223,47 @@ class PythonSandbox:
             if not isinstance(v, types.ModuleType):
                 safe_builtins[k] = v
         
+        if sandbox_pool.running:
+            return sandbox_pool.run(code, safe_builtins, retvar_name, self._modules, self._tool_references, host_bridge.client_config(), timeout)
+        started = time.perf_counter()
         result_queue = multiprocessing.Queue()
         process = multiprocessing.Process(
             target = _worker_exec,
-            args   = (code, result_queue, safe_builtins, retvar_name, self._modules, self._tool_references)
+            args   = (code, result_queue, safe_builtins, retvar_name, self._modules, self._tool_references, host_bridge.client_config())
         )
         process.start()
         process.join(timeout = timeout)
+        return self._result(process, result_queue, timeout, started)
+
+    def _request(self, code: str = None):
+        """Arguments of the worker of execute: code, sanitized builtins, return variable, modules, tools and host bridge."""
+        if code is None:
+            code = self._code
+        
+        # Sanitize builtins (remove modules)
+        safe_builtins = self._sanitize_builtins()
+        # The tools run their searches on the server through the host bridge when it is running
+        return (code, safe_builtins, "", self._modules, self._tool_references, host_bridge.client_config())
+
+    def _start(self, code: str = None):
+        """Forks the worker process of execute, returns it with its result queue."""
+        request = self._request(code)
+        result_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target = _worker_exec,
+            args   = (request[0], result_queue) + request[1:]
+        )
+        process.start()
+        return process, result_queue
+
+    def _result(self, process: multiprocessing.Process, result_queue: multiprocessing.Queue, timeout: int, started: float):
+        """Result of a worker process started at started and joined with the given timeout (see execute)."""
+        result = self._process_result(process, result_queue, timeout)
+        # Same timings as the pool's: a process per call does not wait, its start counts as execution
+        result["timings"] = {"queue_ms": 0.0, "execution_ms": (time.perf_counter() - started) * 1000.0}
+        return result
+
+    def _process_result(self, process: multiprocessing.Process, result_queue: multiprocessing.Queue, timeout: int):
         if process.is_alive():
             process.terminate()
             process.join()
@@ -339,50 +310,38 @@ class PythonSandbox:
                     "stdout"   : str,
                     "stderr"   : str,
                     "return"   : None,
-                    "error"    : str | None
+                    "error"    : str | None,
+                    "timings"  : {"queue_ms": float, "execution_ms": float}
                 }
         """
-        if code is None:
-            code = self._code
-        
-        # Sanitize builtins (remove modules)
-        safe_builtins = self._sanitize_builtins()
-        
-        result_queue = multiprocessing.Queue()
-        process = multiprocessing.Process(
-            target = _worker_exec,
-            args   = (code, result_queue, safe_builtins, "", self._modules, self._tool_references)
-        )
-        process.start()
+        if sandbox_pool.running:
+            return sandbox_pool.run(*self._request(code), timeout)
+        started = time.perf_counter()
+        process, result_queue = self._start(code)
         process.join(timeout = timeout)
-        if process.is_alive():
+        return self._result(process, result_queue, timeout, started)
+
+    async def execute_async(self, code: str = None, timeout: int = 30):
+        """
+            Awaitable execute: the code runs on a worker of the pool, or a worker process forked from
+            the calling thread (a child forked from a non-main thread does not exit cleanly), which is
+            waited for on a thread, so the event loop keeps serving other requests while the code runs.
+            Same arguments and result as execute.
+        """
+        if sandbox_pool.running:
+            cancelled = threading.Event()
+            try:
+                return await asyncio.to_thread(sandbox_pool.run, *self._request(code), timeout, cancelled)
+            except asyncio.CancelledError:
+                # The session went away (e.g. the reply stream failed): the pool kills the worker
+                cancelled.set()
+                raise
+        started = time.perf_counter()
+        process, result_queue = self._start(code)
+        try:
+            await asyncio.to_thread(process.join, timeout)
+        except asyncio.CancelledError:
+            # The session went away (e.g. the reply stream failed): do not leave the code running
             process.terminate()
-            process.join()
-            return {
-                "success"  : False,
-                "status"   : 500,
-                "stdout"   : "",
-                "stderr"   : "",
-                "return"   : None,
-                "error"    : f"TimeoutError: Execution timed out after {timeout} seconds."
-            }
-        elif process.exitcode == 0:
-            if result_queue.empty():
-                return {
-                    "success"  : False,
-                    "status"   : 500,
-                    "stdout"   : "",
-                    "stderr"   : "",
-                    "return"   : None,
-                    "error"    : "No result was returned from the execution process."
-                }
-            result = result_queue.get()
-            return result
-        return {
-            "success"  : False,
-            "status"   : 500,
-            "stdout"   : "",
-            "stderr"   : "",
-            "return"   : None,
-            "error"    : f"Process exited with code {process.exitcode}."
-        }
+            raise
+        return self._result(process, result_queue, timeout, started)
@@ -0,0 +1,180 @@
+import os
+import asyncio
+import logging
+import threading
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class HostCallError(Exception):
+    """A function called on the host through the bridge failed."""
+
+
+class HostBridge:
+    """
+    Lets the sandbox workers call functions of the server process, started and stopped by the app
+    lifespan (see main.py). The server registers async functions by name; a worker given the
+    bridge's client config (see PythonSandbox) calls them with call_host and only the arguments
+    and results cross the connection. The functions run on the server's event loop, so they use
+    its warm search service, caches and reranker.
+    Connections are local (a Unix socket, a named pipe on Windows) and authenticated with a key
+    generated at start.
+    """
+
+    def __init__(self):
+        self._functions: Dict[str, Callable[..., Awaitable[Any]]] = {}
+        self._listener: Optional[Listener] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._authkey: Optional[bytes] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._listener is not None
+
+    def register(self, name: str, function: Callable[..., Awaitable[Any]]):
+        """Makes the async function callable by the sandbox workers under name."""
+        self._functions[name] = function
+
+    def client_config(self) -> Optional[Tuple[Any, bytes]]:
+        """(address, authkey) to give to the sandbox workers, None when the bridge is not running."""
+        if not self.running:
+            return None
+        return (self._listener.address, self._authkey)
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """
+        Listens for the workers.
+        Args:
+            loop (asyncio.AbstractEventLoop): Loop running the called functions, a loop per call if None.
+        """
+        if self.running:
+            return
+        self._loop = loop
+        self._authkey = os.urandom(32)
+        self._listener = Listener(authkey = self._authkey)
+        self._thread = threading.Thread(target = self._serve, args = (self._listener,), name = "baiss-host-bridge", daemon = True)
+        self._thread.start()
+        logger.info(f"Host bridge listening on {self._listener.address}")
+
+    def stop(self):
+        """Stops accepting workers; calls in progress end with their connection."""
+        if not self.running:
+            return
+        listener, self._listener = self._listener, None
+        try:
+            # Wakes up the accept of the serving thread
+            Client(listener.address, authkey = self._authkey).close()
+        except OSError:
+            pass
+        self._thread.join(5.0)
+        listener.close()
+        self._thread = None
+        self._loop = None
+        logger.info("Host bridge stopped")
+
+    def _serve(self, listener: Listener):
+        while self._listener is listener:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # Failed handshake, or the listener was closed
+                if self._listener is not listener:
+                    break
+                logger.warning(f"Host bridge connection refused: {e}")
+                continue
+            if self._listener is not listener:
+                conn.close()
+                break
+            threading.Thread(target = self._handle, args = (conn,), name = "baiss-host-call", daemon = True).start()
+
+    def _handle(self, conn: Connection):
+        """Answers the calls of one worker connection: (name, kwargs) -> ("ok", result) | ("error", message)."""
+        try:
+            while True:
+                try:
+                    name, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    break
+                try:
+                    reply = ("ok", self._call(name, kwargs))
+                except Exception as e:
+                    logger.error(f"Host call {name} failed: {e}", exc_info = True)
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    # The worker was killed meanwhile
+                    break
+        finally:
+            conn.close()
+
+    def _call(self, name: str, kwargs: Dict[str, Any]) -> Any:
+        function = self._functions.get(name)
+        if function is None:
+            raise ValueError(f"Unknown host function: {name}")
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            return asyncio.run_coroutine_threadsafe(function(**kwargs), loop).result()
+        return asyncio.run(function(**kwargs))
+
+
+# Started by the app lifespan, serves the sandbox workers of the process
+host_bridge = HostBridge()
+
+# Sandbox side: client config of the host and idle connections to it
+_host: Optional[Tuple[Any, bytes]] = None
+_connections: List[Connection] = []
+_connections_lock = threading.Lock()
+
+
+def connect_host(config: Optional[Tuple[Any, bytes]]):
+    """Sets the bridge the host functions are called through (HostBridge.client_config), None for none."""
+    global _host
+    with _connections_lock:
+        if config == _host:
+            return
+        _host = config
+        while _connections:
+            _connections.pop().close()
+
+
+def host_available() -> bool:
+    """Whether this process (a sandbox worker) can call the host."""
+    return _host is not None
+
+
+def call_host(name: str, **kwargs) -> Any:
+    """
+    Calls a function registered on the host bridge, blocking.
+    Raises:
+        HostCallError: If the host function failed.
+    """
+    with _connections_lock:
+        host = _host
+        conn = _connections.pop() if _connections else None
+    if host is None:
+        raise RuntimeError("No host bridge is configured in this process.")
+    if conn is None:
+        conn = Client(host[0], authkey = host[1])
+    try:
+        conn.send((name, kwargs))
+        status, value = conn.recv()
+    except BaseException:
+        conn.close()
+        raise
+    with _connections_lock:
+        if host == _host:
+            _connections.append(conn)
+        else:
+            conn.close()
+    if status != "ok":
+        raise HostCallError(value)
+    return value
+
+
+async def call_host_async(name: str, **kwargs) -> Any:
+    """call_host on a thread, so that the calls of a snippet can run concurrently."""
+    return await asyncio.to_thread(call_host, name, **kwargs)
@@ -0,0 +1,143 @@
+import io
+import sys
+import contextlib
+import importlib
+from typing import Any, Dict, List, Optional
+from baiss_sdk.sandbox.rpc import connect_host
+
+
+def build_session_globals(builtins: dict, module_names: list, tool_references: list, stderr: io.StringIO,
+                          tools: Optional[Dict[tuple, Any]] = None) -> Dict[str, Any]:
+    """
+    Globals of a sandboxed execution: the builtins, the requested modules and the resolved tools.
+    Args:
+        builtins: Safe builtin functions/values (picklable only)
+        module_names: List of module names to import (strings)
+        tool_references: List of tool reference dicts (see PythonSandbox.add_tool_reference)
+        stderr: Receives the import and tool resolution warnings
+        tools: Cache of the tool instances of a long-lived worker, keyed by class and init kwargs
+    """
+    # 1. Reconstruct the environment with builtins
+    session_globals = {'__builtins__': builtins}
+
+    # 2. Dynamically import requested modules inside the worker
+    for mod_name in module_names:
+        try:
+            mod = importlib.import_module(mod_name)
+            session_globals[mod_name] = mod
+            if mod_name == "pandas":
+                session_globals["pd"] = mod
+        except ImportError as e:
+            stderr.write(f"Warning: Could not import module '{mod_name}': {e}\n")
+
+    # 3. Resolve tool references (functions/methods from other modules)
+    for tool_ref in tool_references:
+        try:
+            name = tool_ref["name"]
+            module_path = tool_ref["module_path"]
+            class_name = tool_ref.get("class_name")
+            method_name = tool_ref.get("method_name")
+            init_kwargs = tool_ref.get("init_kwargs", {})
+
+            # Import the module
+            mod = importlib.import_module(module_path)
+
+            if class_name:
+                # Get the class and instantiate it (once per init kwargs in a long-lived worker)
+                key = (module_path, class_name, repr(sorted(init_kwargs.items())))
+                instance = tools.get(key) if tools is not None else None
+                if instance is None:
+                    instance = getattr(mod, class_name)(**init_kwargs)
+                    if tools is not None:
+                        tools[key] = instance
+                if method_name:
+                    # Get the method from the instance
+                    func = getattr(instance, method_name)
+                else:
+                    # Use the instance itself
+                    func = instance
+            else:
+                # Get a function directly from the module
+                func = getattr(mod, method_name or name)
+
+            session_globals[name] = func
+        except Exception as e:
+            stderr.write(f"Warning: Could not resolve tool '{tool_ref.get('name', 'unknown')}': {e}\n")
+    return session_globals
+
+
+def run_code(code: str, builtins: dict, retvar_name: str, module_names: list, tool_references: list,
+             host: Optional[tuple] = None, tools: Optional[Dict[tuple, Any]] = None) -> Dict[str, Any]:
+    """
+    Executes code in a fresh session (see build_session_globals), returns the sandbox result.
+    The tools call the host through the bridge of host (see HostBridge.client_config) if given.
+    """
+    connect_host(host)
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    session_globals = build_session_globals(builtins, module_names, tool_references, stderr, tools)
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            exec(code, session_globals)
+
+        return {
+            "success"  : True,
+            "status"   : 200,
+            "stdout"   : str(stdout.getvalue()).strip(),
+            "stderr"   : str(stderr.getvalue()).strip(),
+            "return"   : session_globals.get(retvar_name),
+            "error"    : None
+        }
+    except Exception as e:
+        return {
+            "success"  : False,
+            "status"   : 500,
+            "stdout"   : str(stdout.getvalue()).strip(),
+            "stderr"   : str(stderr.getvalue()).strip(),
+            "return"   : session_globals.get(retvar_name),
+            "error"    : f"{type(e).__name__}: {str(e)}\n{stderr.getvalue()}",
+        }
+
+
+def rss_bytes() -> Optional[int]:
+    """Resident memory of the process: current with psutil, else the peak (None on Windows without psutil)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def pool_worker_main(conn, module_names: List[str], tool_references: List[dict]):
+    """
+    Loop of a pooled sandbox worker (see SandboxPool): imports the modules and resolves the tools
+    once, reports "ready", then runs (code, builtins, retvar_name, module_names, tool_references,
+    host) requests until it receives None, answering each with (result, resident memory).
+    """
+    tools: Dict[tuple, Any] = {}
+    build_session_globals({}, module_names, tool_references, io.StringIO(), tools)
+    conn.send("ready")
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+        result = run_code(*request, tools = tools)
+        try:
+            conn.send((result, rss_bytes()))
+        except Exception as e:
+            # The return value could not be pickled
+            result["return"] = None
+            result["success"], result["status"] = False, 500
+            result["error"] = f"{type(e).__name__}: the return value could not be sent back: {e}"
+            conn.send((result, rss_bytes()))
+    conn.close()
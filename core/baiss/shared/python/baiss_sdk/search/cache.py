@@ -0,0 +1,116 @@
+import logging
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from baiss_sdk.db.generation import index_generation
+from baiss_sdk.files.embeddings import Embeddings
+from baiss_sdk.search.service import search_service
+from baiss_sdk.search.lru import LruCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class SearchCache:
+    """
+    Per-process caches of the searches repeated within a conversation (tool loop, sandbox tool):
+    query embeddings keyed by (embedding model, query), and final search results keyed by
+    (query, search type, top_k, search parameters, index generation). Queries are matched
+    exactly: a query that differs in whitespace is embedded (and ranked) on its own.
+    Any committed ingestion, delete, move or migration bumps the index generation (see
+    db/generation.py), so results computed before it are never served again.
+    Results are only cached in the process running the search service, which holds the
+    database for writing and therefore sees every generation bump.
+    """
+
+    def __init__(self, max_embeddings: int = 1024, max_results: int = 512):
+        self.embeddings = LruCache(max_embeddings)
+        self.results    = LruCache(max_results)
+
+    async def embed(self, embeddings: Embeddings, query: str) -> Optional[list]:
+        """Embeds the query with embeddings, reusing the embedding of an identical query."""
+        return (await self.embed_many(embeddings, [query]))[0]
+
+    async def embed_many(self, embeddings: Embeddings, queries: List[str]) -> List[Optional[list]]:
+        """Embeds the queries whose embedding is not cached with one embedding request, in query order."""
+        model_id = await embeddings.model_id()
+        keys = [(model_id, query) for query in queries]
+        results = [self.embeddings.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(results) if embedding is None]
+        if missing:
+            computed = await embeddings.embed_many([queries[i] for i in missing], batch_size = len(missing))
+            for i, embedding in zip(missing, computed):
+                results[i] = embedding
+                if embedding is not None:
+                    self.embeddings.put(keys[i], embedding)
+        return results
+
+    @staticmethod
+    def _key(query: str, search_type: str, top_k: int, params: Dict[str, Any], generation: int) -> tuple:
+        return (
+            query, search_type, top_k,
+            tuple(sorted((name, repr(value)) for name, value in params.items())),
+            generation,
+        )
+
+    async def search(self, compute: Callable[[], Awaitable[Any]], query: str, search_type: str, top_k: int, **params) -> Any:
+        """
+        Returns the cached results of this search, or awaits compute() and caches them.
+        Cached results are shared between callers and must not be modified.
+        Args:
+            compute (Callable[[], Awaitable[Any]]): Runs the search (embedding the query if needed).
+            query (str): The query text.
+            search_type (str): "cosine", "bm25" or "hybrid".
+            top_k (int): Number of results.
+            **params: Every other parameter the results depend on (weights, thresholds, filters...).
+        """
+        if not search_service.running:
+            return await compute()
+        # Read before searching: a write committed meanwhile makes this entry unreachable
+        key = self._key(query, search_type, top_k, params, index_generation())
+        results = self.results.get(key, _MISSING)
+        if results is _MISSING:
+            results = await compute()
+            self.results.put(key, results)
+        return results
+
+    async def search_many(self, compute: Callable[[List[str]], Awaitable[List[Any]]], queries: List[str], search_type: str,
+                          top_k: int, **params) -> List[Any]:
+        """
+        Batch version of search: compute(missing queries) runs the queries whose results are not
+        cached in one call and returns their results in order. Entries are shared with search.
+        """
+        if not search_service.running:
+            return await compute(queries)
+        generation = index_generation()
+        keys = [self._key(query, search_type, top_k, params, generation) for query in queries]
+        results = [self.results.get(key, _MISSING) for key in keys]
+        # Repeated queries of the batch are computed once
+        missing: Dict[tuple, List[int]] = {}
+        for i, result in enumerate(results):
+            if result is _MISSING:
+                missing.setdefault(keys[i], []).append(i)
+        if missing:
+            computed = await compute([queries[indexes[0]] for indexes in missing.values()])
+            for (key, indexes), result in zip(missing.items(), computed):
+                self.results.put(key, result)
+                for i in indexes:
+                    results[i] = result
+        return results
+
+    def clear(self):
+        self.embeddings.clear()
+        self.results.clear()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "embeddings"      : self.embeddings.stats,
+            "results"         : self.results.stats,
+            "index_generation": index_generation(),
+        }
+
+
+# Shared by the search endpoints and tools of the process
+search_cache = SearchCache()
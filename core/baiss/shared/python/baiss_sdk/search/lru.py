@@ -0,0 +1,47 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+_MISSING = object()
+
+
+class LruCache:
+    """Thread-safe in-memory LRU cache counting its hits and misses."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits        = 0
+        self.misses      = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock       = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits"    : self.hits,
+            "misses"  : self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "entries" : len(self._entries),
+        }
@@ -4,12 +4,15 @@ baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
 import logging
 from typing import List, Dict, Any
 from baiss_sdk.db.duck_db import DuckDb
+from baiss_sdk.db.filters import SearchFilters
 from baiss_sdk.reranking.rerank import BaissReranker
 
 class SearchPipeline:
-    def __init__(self, db: DuckDb):
+    def __init__(self, db: DuckDb, reranker: BaissReranker = None, rerank_budget_ms: float = None):
         self.db = db
-        self._reranker = None
+        self._reranker = reranker
+        # Model time allowed to the rerank stage, see BaissReranker.rerank
+        self.rerank_budget_ms = rerank_budget_ms
 
     @property
     def reranker(self):
@@ -18,18 +21,27 @@ class SearchPipeline:
             self._reranker = BaissReranker()
         return self._reranker
 
-    def search(self, query_text: str, query_embedding: List[float], final_top_k: int = 5) -> List[Dict[str, Any]]:
+    def retrieve(self, query_text: str, query_embedding: List[float], fusion: str = "zscore",
+                 filters: SearchFilters = None) -> List[tuple]:
+        """Stage 1: the hybrid search candidates of the reranker, best first."""
         retrieval_k = 50 
-        logging.info(f"Stage 1: Retrieving top {retrieval_k} candidates via Hybrid Search...")
+        logging.info(f"Stage 1: Retrieving top {retrieval_k} candidates via Hybrid Search ({fusion} fusion)...")
         
-        initial_results = self.db.hybrid_similarity_search(
+        # Only the fused top candidates are materialized with their content for the reranker
+        return self.db.hybrid_similarity_search(
             query_text=query_text,
             query_embedding=query_embedding,
             top_k=retrieval_k,
             cosine_weight=0.3, 
-            score_threshold=0.0
+            score_threshold=0.0,
+            fusion=fusion,
+            filters=filters
         )
 
+    def search(self, query_text: str, query_embedding: List[float], final_top_k: int = 5, fusion: str = "zscore",
+               filters: SearchFilters = None) -> List[Dict[str, Any]]:
+        initial_results = self.retrieve(query_text, query_embedding, fusion, filters)
+
         if not initial_results:
             return []
 
@@ -38,8 +50,22 @@ class SearchPipeline:
         return self.reranker.rerank(
             query=query_text,
             initial_results=initial_results,
-            top_k=final_top_k
+            top_k=final_top_k,
+            budget_ms=self.rerank_budget_ms
         )
+
+    def search_many(self, query_texts: List[str], query_embeddings: List[List[float]], final_top_k: int = 5,
+                    fusion: str = "zscore", filters: SearchFilters = None) -> List[List[Dict[str, Any]]]:
+        """Searches several queries, reranking the candidates of all of them in one batch. Results are in query order."""
+        candidates = [self.retrieve(text, embedding, fusion, filters) for text, embedding in zip(query_texts, query_embeddings)]
+        return self.rerank_many(query_texts, candidates, final_top_k)
+
+    def rerank_many(self, query_texts: List[str], candidates: List[List[tuple]], final_top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Stage 2 of several queries: one batched rerank of their candidates."""
+        if not any(candidates):
+            return [[] for _ in query_texts]
+        logging.info(f"Stage 2: Reranking {sum(map(len, candidates))} candidates of {len(query_texts)} queries via FlashRank...")
+        return self.reranker.rerank_many(query_texts, candidates, final_top_k, self.rerank_budget_ms)
         
         
 if __name__ == "__main__":
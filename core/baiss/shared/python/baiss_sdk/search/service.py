@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import threading
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from baiss_sdk.db import DbProxyClient
+from baiss_sdk.db.filters import SearchFilters
+from baiss_sdk.search.pipeline import SearchPipeline
+from baiss_sdk.reranking.rerank import BaissReranker
+
+logger = logging.getLogger(__name__)
+
+def open_search_client() -> DbProxyClient:
+    """Connects a DbProxyClient and validates the extensions and search indexes."""
+    db_client = DbProxyClient()
+    db_client.connect()
+    try:
+        db_client.setup_extensions()
+        db_client.create_fts_index()
+        db_client.create_hnsw_index()
+    except Exception:
+        db_client.disconnect()
+        raise
+    return db_client
+
+
+class SearchService:
+    """
+    Warm search state of the server, started and stopped by the app lifespan (see main.py):
+    one DuckDB connection whose extensions and indexes are validated once at start, a shared
+    reranker (which batches the rerank requests of concurrent searches), and a dedicated thread
+    pool running the synchronous DuckDB calls off the event loop. Every call gets its own cursor
+    of the connection.
+    When the service is not running (scripts, or a server without the host bridge), calls fall
+    back to a connection of their own. Sandbox processes never use the service: their tools
+    search through the server (see baiss_sdk.sandbox.rpc), since DuckDB locks the database file
+    for the process holding a connection and the warm connection is held for the lifespan.
+    """
+
+    def __init__(self, max_workers: int = 4, rerank_threads: int = None, rerank_budget_ms: float = None):
+        self.max_workers = max_workers
+        # Intra-op threads of the reranker model and model time budget of the rerank stage
+        self.rerank_threads = rerank_threads
+        self.rerank_budget_ms = rerank_budget_ms
+        self.db_client: Optional[DbProxyClient] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._reranker = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.db_client is not None
+
+    def start(self):
+        """Opens the warm connection. Blocking, run it with asyncio.to_thread."""
+        if self.running:
+            return
+        self.db_client = open_search_client()
+        self._executor = ThreadPoolExecutor(max_workers = self.max_workers, thread_name_prefix = "baiss-search")
+        logger.info(f"Search service started with {self.max_workers} workers")
+
+    def stop(self):
+        """Waits for the running searches, then closes the connection. Blocking."""
+        if not self.running:
+            return
+        self._executor.shutdown(wait = True)
+        self._executor = None
+        self.db_client.disconnect()
+        self.db_client = None
+        logger.info("Search service stopped")
+
+    @contextmanager
+    def cursor(self) -> Iterator[DbProxyClient]:
+        """A client bound to a new cursor of the warm connection, closed on exit."""
+        db_client = self.db_client.cursor()
+        try:
+            yield db_client
+        finally:
+            db_client.disconnect()
+
+    def pipeline(self, db_client: DbProxyClient) -> SearchPipeline:
+        """A SearchPipeline over db_client that shares the service's reranker."""
+        with self._lock:
+            if self._reranker is None:
+                self._reranker = BaissReranker(threads = self.rerank_threads)
+        return SearchPipeline(db_client, reranker = self._reranker, rerank_budget_ms = self.rerank_budget_ms)
+
+    def _call(self, fn: Callable[..., Any], args: tuple) -> Any:
+        if self.running:
+            with self.cursor() as db_client:
+                return fn(db_client, *args)
+        db_client = open_search_client()
+        try:
+            return fn(db_client, *args)
+        finally:
+            db_client.disconnect()
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Runs fn(db_client, *args) on the search thread pool with a cursor of the warm connection."""
+        if not self.running:
+            return await asyncio.to_thread(self._call, fn, args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, fn, args)
+
+    async def search_many(self, query_texts: List[str], query_embeddings: List[List[float]], final_top_k: int = 5,
+                          fusion: str = "zscore", filters: SearchFilters = None) -> List[List[Dict[str, Any]]]:
+        """
+        Hybrid search and rerank of several queries (see SearchPipeline.search_many). The retrievals
+        run concurrently on cursors of the warm connection, then the candidates of every query are
+        reranked by one batch. Results are in query order.
+        """
+        if not self.running:
+            return await self.run(lambda db_client: self.pipeline(db_client).search_many(query_texts, query_embeddings, final_top_k, fusion, filters))
+        candidates = await asyncio.gather(*(
+            self.run(lambda db_client, text = text, embedding = embedding: self.pipeline(db_client).retrieve(text, embedding, fusion, filters))
+            for text, embedding in zip(query_texts, query_embeddings)
+        ))
+        return await self.run(lambda db_client: self.pipeline(db_client).rerank_many(query_texts, list(candidates), final_top_k))
+
+
+# Started by the app lifespan, shared by the search endpoints and tools of the process
+search_service = SearchService()
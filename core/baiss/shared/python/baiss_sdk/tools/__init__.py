@@ -1,5 +1,5 @@
 import json
-from typing import Dict, Any
+from typing import Dict, Any, List
 import os
 import sys
 import multiprocessing
@@ -19,45 +19,59 @@ sys.path.insert(0,
 )
 
 import json
-from baiss_sdk.search.pipeline import SearchPipeline
+from baiss_sdk.search.service import search_service
+from baiss_sdk.search.cache import search_cache
 from baiss_sdk.sandbox.python_sandbox import PythonSandbox
 from baiss_sdk.files.embeddings import Embeddings
 import logging
-from baiss_sdk.db import DbProxyClient
+from baiss_sdk.db.filters import SearchFilters
+from baiss_sdk.sandbox.rpc import host_bridge, host_available, call_host_async
 logger = logging.getLogger(__name__)
 
 class allTools:
-    def __init__(self, url_embedding: str = None):
+    def __init__(self, url_embedding: str = None, paths: List[str] = None):
         self.url_embedding    = url_embedding
+        self.paths            = list(paths) if paths else None
+        # Files attached to the chat: searches only look into them
+        self.filters          = SearchFilters(path_prefixes = self.paths) if paths else None
 
 
     async def searchlocaldocuments(self, query: str, k: int = 5, search_type="hybrid") -> list[dict[str, Any]]:
         """
         """
+        if host_available():
+            # In a sandbox worker: the search runs on the server's warm search service and only
+            # the results come back (see baiss_sdk.sandbox.rpc)
+            return await call_host_async(
+                "searchlocaldocuments",
+                query=query,
+                k=k,
+                search_type=search_type,
+                url_embedding=self.url_embedding,
+                paths=self.paths
+            )
+
         if self.url_embedding is None:
             search_type = "bm25"
         
 
-        db_client = DbProxyClient()
-        db_client.connect()
-        
-        # Setup extensions
-        db_client.setup_extensions()
-        # Create FTS index if not exists
-        db_client.create_fts_index()
-        
+        # Uses the warm connection of the search service when running in the server process,
+        # otherwise (scripts, a sandbox without the host bridge) a connection of its own
 
         if search_type == "hybrid":
-            query_embedding = await Embeddings(url = self.url_embedding).embed(query)
-
-            search_pipeline = SearchPipeline(db_client)
-
-             # Perform hybrid search
-            results = search_pipeline.search(
-                query_text=query,
-                query_embedding=query_embedding,
-                final_top_k=k
-            )
+            async def hybrid_search():
+                query_embedding = await search_cache.embed(Embeddings(url = self.url_embedding), query)
+
+                 # Perform hybrid search
+                return await search_service.run(
+                    lambda db_client: search_service.pipeline(db_client).search(
+                        query_text=query,
+                        query_embedding=query_embedding,
+                        final_top_k=k,
+                        filters=self.filters
+                    )
+                )
+            results = await search_cache.search(hybrid_search, query, search_type, k, fusion="zscore", url_embedding=self.url_embedding, filters=self.filters)
             logger.info(f"Hybrid search returned {results} results.")
             # exit(0)
             
@@ -76,9 +90,15 @@ class allTools:
                 for result in results
             ]
         elif search_type == "bm25":
-            results = db_client.similarity_search_bm25(
-                query=query,
-                top_k=k
+            results = await search_cache.search(
+                lambda: search_service.run(
+                    lambda db_client: db_client.similarity_search_bm25(
+                        query=query,
+                        top_k=k,
+                        filters=self.filters
+                    )
+                ),
+                query, search_type, k, score_threshold=0.0, filters=self.filters
             )
             
             
@@ -96,9 +116,7 @@ class allTools:
             ]
         else:
             raise ValueError(f"Unsupported search type: {search_type}")
-        
 
-        db_client.disconnect()
 
         # formatted_results = [
         #     {
@@ -113,6 +131,15 @@ class allTools:
         return formatted_results
 
 
+async def host_searchlocaldocuments(query: str, k: int = 5, search_type: str = "hybrid", url_embedding: str = None,
+                                    paths: List[str] = None) -> list[dict[str, Any]]:
+    """searchlocaldocuments of a sandbox worker, run by the server."""
+    return await allTools(url_embedding = url_embedding, paths = paths).searchlocaldocuments(query, k, search_type)
+
+
+host_bridge.register("searchlocaldocuments", host_searchlocaldocuments)
+
+
 if __name__ == "__main__":
     sandbox = PythonSandbox()
 
@@ -0,0 +1,90 @@
+import random
+import baisstools
+baisstools.insert_syspath(__file__, matcher = [r"^baiss_.*$"])
+import pytest
+from baiss_sdk.parsers.json_extractor import JsonExtractor
+from baiss_sdk.parsers.python_extractor import PythonExtractor
+from baiss_sdk.parsers.stream_parser import StreamParser
+
+REPLIES = [
+    'Let me look that up.\n{"tool": "search", "query": "quarterly revenue"}\n',
+    'Two searches: {"tool": "search", "query": "a [b] {c}"} and {"tool": "search", "query": "say \\"hi\\""}',
+    "I will compute it.\n<code_execution>\nasync def main():\n    total = sum([1, 2, 3])\n    print({'total': total})\n</code_execution>\nDone.",
+    "<code_execution>\nasync def main():\n    print('ends right after the function')\n",
+    "<code_execution>\nasync def main():\n    print('ends right after the function')\n</code_execution>",
+    "```python\ndef helper(x):\n    return x * 2\n\nasync def main():\n    print(helper(2))\n```\nThe result is 4.",
+    "Values a < b and c <= d, not a <code tag, then <code_execution>\nasync def main():\n    if 1 < 2:\n        print('<ok>')\n\n\n",
+    'A list [1, 2, 3], a dict {"a": {"b": [1, {"c": 2}]}} and broken {"open": 1 then text.',
+    "No tools in this reply at all, only text with a stray } and ] and a lone <.",
+    'def not_a_function, then {"tool": "search", "query": "x"}\n  async def main(a,\n           b):\n      return a\nafter',
+]
+
+
+def random_split(text: str, rng: random.Random) -> list:
+    """Splits text into deltas of 1 to 8 characters."""
+    deltas, pos = [], 0
+    while pos < len(text):
+        size = rng.randint(1, 8)
+        deltas.append(text[pos:pos + size])
+        pos += size
+    return deltas
+
+
+def stream(reply: str, deltas: list, hidden_tags = ("code_execution",)):
+    parser = StreamParser(hidden_tags = hidden_tags)
+    shown, events = [], []
+    for delta in deltas:
+        visible, found = parser.feed(delta)
+        shown.append(visible)
+        events += found
+    visible, found = parser.close()
+    shown.append(visible)
+    return shown, events + found
+
+
+def function_fields(function: dict) -> tuple:
+    return function["name"], function["body"], function["definition"]
+
+
+@pytest.mark.parametrize("seed", range(50))
+@pytest.mark.parametrize("reply", REPLIES)
+def test_random_splits_match_extractors(reply, seed):
+    shown, events = stream(reply, random_split(reply, random.Random(seed)))
+    text = "".join(shown)
+    assert "<code_execution>" not in text and "</code_execution>" not in text
+    assert text == reply.replace("<code_execution>", "").replace("</code_execution>", "")
+    objects = [event["value"] for event in events if event["type"] == "object"]
+    functions = [event["value"] for event in events if event["type"] == "function"]
+    assert objects == JsonExtractor.extract_objects(reply)
+    assert [function_fields(function) for function in functions] == [function_fields(function) for function in PythonExtractor(reply).functions]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_split_tags_never_leak(seed):
+    rng = random.Random(seed)
+    reply = "".join(rng.choice(["text ", "<", "<code", "<code_execution>", "</code_execution>", "</", "_execution", ">", "\n"]) for _ in range(40))
+    shown, _ = stream(reply, random_split(reply, rng))
+    for visible in shown:
+        assert "<code_execution>" not in visible and "</code_execution>" not in visible
+    assert "".join(shown) == reply.replace("<code_execution>", "").replace("</code_execution>", "")
+
+
+def test_function_reported_before_the_reply_ends():
+    parser = StreamParser()
+    _, events = parser.feed("<code_execution>\nasync def main():\n    print(1)\n")
+    assert events == []
+    _, events = parser.feed("</code_execution>\n")
+    assert [event["value"]["name"] for event in events] == ["main"]
+
+
+def test_body_of_a_function_ending_the_reply():
+    _, events = stream("", ["async def main():\n", "    print(1)\n"])
+    assert [event["value"]["body"] for event in events] == ["async def main():\n    print(1)"]
+
+
+def test_feed_after_close_raises():
+    parser = StreamParser()
+    parser.close()
+    assert parser.close() == ("", [])
+    with pytest.raises(ValueError):
+        parser.feed("more")